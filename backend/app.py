@@ -1,61 +1,400 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Request, request, jsonify, Response, g
 from flask_cors import CORS
 from werkzeug.utils import secure_filename
-import os
+import json
+import threading
+import time
+from datetime import date
+from functools import wraps
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
-from services.ocr_service import extract_text_pdf
-from services.xml_service import ler_xml_nfe
+from services.nota_service import formato_suportado, processar_arquivo, get_cache
+from services.batch_service import coletar_arquivos, processar_lote
+from services.job_service import get_fila, STATUS_FINAIS, JOB_SSE_MAX_STREAMS, JOB_SSE_MAX_SECONDS
+from services.webhook_service import get_webhook_dispatcher, WebhookUrlNaoPermitidaError
+from services.upload_service import MAX_UPLOAD_BYTES, MAX_BATCH_UPLOAD_BYTES, novo_buffer, tamanho_stream
+from services.invoice_store import get_invoice_store, FILTROS, PAGINA_PADRAO
+from services.export_service import FORMATOS_EXPORTACAO, gerar_csv, gerar_xlsx, comprimir_gzip, xlsx_disponivel
+from services.metrics_service import metricas, etapa, registrar_erro, iniciar_requisicao, finalizar_requisicao, registrar_requisicao
+from services.startup_service import estado
+from services import auth_service
+
+class UploadRequest(Request):
+    # Uploads are parsed into our spooled buffers: in memory up to
+    # UPLOAD_SPOOL_KB, then an anonymous temp file unique to this upload
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return novo_buffer()
 
 app = Flask(__name__)
+app.request_class = UploadRequest
 CORS(app)  # Enable CORS for all routes (important for file:// or localhost)
 
-# Configure upload folder (optional, or process in memory)
-UPLOAD_FOLDER = os.path.join(os.getcwd(), 'backend', 'uploads')
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+# Uploads are processed in memory; the largest request we accept is a batch.
+# Single-file routes check their own, smaller limit before reading the body.
+app.config['MAX_CONTENT_LENGTH'] = MAX_BATCH_UPLOAD_BYTES
+
+def _erro_tamanho():
+    limite_mb = MAX_UPLOAD_BYTES // (1024 * 1024)
+    return jsonify({'error': f'Arquivo excede o limite de {limite_mb} MB.'}), 413
+
+def _upload_grande_demais():
+    # Content-Length is known before the body is read, so oversize uploads
+    # are rejected without buffering them
+    return request.content_length is not None and request.content_length > MAX_UPLOAD_BYTES
+
+def _protegida(rota):
+    # Saved notas and webhook payloads belong to a user; see auth_service
+    @wraps(rota)
+    def verificar(*args, **kwargs):
+        token = request.headers.get('X-API-Token') or request.args.get('token')
+        if not auth_service.acesso_permitido(token, request.remote_addr):
+            return jsonify({'error': 'Acesso não autorizado. Envie o token da API em X-API-Token.'}), 401
+        return rota(*args, **kwargs)
+    return verificar
+
+@app.before_request
+def _iniciar_metricas():
+    g.metricas = iniciar_requisicao()
+
+@app.after_request
+def _server_timing(response):
+    contexto = g.pop('metricas', None)
+    if contexto is None:
+        return response
+    rota = request.url_rule.rule if request.url_rule else 'desconhecida'
+    if response.is_streamed:
+        # NDJSON lots, SSE and exports produce their body after this hook:
+        # measure until the response is closed, and send no Server-Timing
+        finalizar_requisicao(contexto, rota, response.status_code, streaming=True)
+        status = response.status_code
+        response.call_on_close(lambda: registrar_requisicao(contexto, rota, status))
+        return response
+    server_timing = finalizar_requisicao(contexto, rota, response.status_code)
+    if server_timing:
+        response.headers['Server-Timing'] = server_timing
+        # The frontend is served from another origin (see CORS above)
+        response.headers['Timing-Allow-Origin'] = '*'
+    return response
+
+@app.errorhandler(413)
+def upload_muito_grande(e):
+    limite_mb = MAX_BATCH_UPLOAD_BYTES // (1024 * 1024)
+    return jsonify({'error': f'Requisição excede o limite de {limite_mb} MB.'}), 413
 
 @app.route('/api/ler-nota', methods=['POST'])
 def ler_nota():
-    if 'file' not in request.files:
+    if _upload_grande_demais():
+        return _erro_tamanho()
+
+    # Parsing the multipart body is what used to be file.save()
+    with etapa('upload'):
+        arquivos = request.files
+
+    if 'file' not in arquivos:
         return jsonify({'error': 'Nenhum arquivo enviado'}), 400
     
-    file = request.files['file']
+    file = arquivos['file']
     
     if file.filename == '':
         return jsonify({'error': 'Nome do arquivo vazio'}), 400
     
     filename = secure_filename(file.filename)
-    filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-    file.save(filepath)
-    
+    if not formato_suportado(filename):
+        return jsonify({'error': 'Formato não suportado. Use PDF ou XML.'}), 400
+
+    # Chunked uploads have no Content-Length; check what was actually received
+    if tamanho_stream(file.stream) > MAX_UPLOAD_BYTES:
+        return _erro_tamanho()
+
     try:
-        data = {}
-        if filename.lower().endswith('.pdf'):
-            # OCR Service
-            # Since extract_text_pdf returns raw text, we might need to parse it further.
-            # For this exercise, let's assume the service returns structured data or we parse it here.
-            # But the prompt says "Criar função extrair_texto_pdf(caminho)".
-            # So I'll assume the service returns text and maybe we have a parser, or the service returns a dict.
-            # I will implement the service to return a dict for simplicity in the integration.
-            data = extract_text_pdf(filepath)
-        elif filename.lower().endswith('.xml'):
-            # XML Service
-            data = ler_xml_nfe(filepath)
-        else:
-            return jsonify({'error': 'Formato não suportado. Use PDF ou XML.'}), 400
-            
+        data = processar_arquivo(filename, file.stream)
         return jsonify(data)
 
     except Exception as e:
+        registrar_erro(e, 'ler_nota')
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/ler-notas-lote', methods=['POST'])
+def ler_notas_lote():
+    """
+    Processes many notas (or a ZIP of notas) in parallel.
+
+    The response is NDJSON: one line per file, written as soon as that file
+    is done, followed by a final summary line.
+    """
+    with etapa('upload'):
+        files = request.files.getlist('files') + request.files.getlist('file')
+    if not files:
+        return jsonify({'error': 'Nenhum arquivo enviado'}), 400
+
+    try:
+        itens, erros = coletar_arquivos(files)
+    except Exception as e:
+        registrar_erro(e, 'lote')
         return jsonify({'error': str(e)}), 500
-    finally:
-        # Clean up
-        if os.path.exists(filepath):
-            os.remove(filepath)
+
+    def gerar():
+        sucesso = 0
+        total = 0
+        try:
+            for resultado in erros:
+                total += 1
+                yield json.dumps(resultado, ensure_ascii=False) + '\n'
+            for resultado in processar_lote(itens):
+                total += 1
+                sucesso += resultado['ok']
+                yield json.dumps(resultado, ensure_ascii=False) + '\n'
+            resumo = {'total': total, 'sucesso': sucesso, 'erros': total - sucesso}
+            yield json.dumps({'resumo': resumo}, ensure_ascii=False) + '\n'
+        finally:
+            for _, fonte in itens:
+                fonte.close()
+
+    return Response(gerar(), mimetype='application/x-ndjson')
+
+@app.route('/metrics', methods=['GET'])
+def exportar_metricas():
+    """
+    Prometheus scrape endpoint: stage latencies, extraction method counts,
+    bytes processed, errors by type and in-flight requests.
+    """
+    return Response(metricas.exportar(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    """
+    Readiness probe: answers as soon as the worker can serve requests.
+    'aquecido' turns true once the background warm-up has loaded the PDF/LLM
+    dependencies and created the shared clients.
+    """
+    return jsonify(estado())
+
+@app.route('/api/cache/stats', methods=['GET'])
+def cache_stats():
+    cache = get_cache()
+    if cache is None:
+        return jsonify({'habilitado': False})
+    return jsonify(dict(cache.stats(), habilitado=True))
+
+@app.route('/api/jobs', methods=['POST'])
+def criar_job():
+    """
+    Stores the upload and enqueues it. Returns 202 with the job ID right away.
+    """
+    if _upload_grande_demais():
+        return _erro_tamanho()
+
+    if 'file' not in request.files:
+        return jsonify({'error': 'Nenhum arquivo enviado'}), 400
+
+    file = request.files['file']
+    if file.filename == '':
+        return jsonify({'error': 'Nome do arquivo vazio'}), 400
+    if not formato_suportado(file.filename):
+        return jsonify({'error': 'Formato não suportado. Use PDF ou XML.'}), 400
+    if tamanho_stream(file.stream) > MAX_UPLOAD_BYTES:
+        return _erro_tamanho()
+
+    job = get_fila().submit(file.filename, file.stream)
+    return jsonify(job), 202
+
+@app.route('/api/jobs', methods=['GET'])
+def listar_jobs():
+    """
+    Polls several jobs at once: /api/jobs?ids=a,b,c
+    """
+    ids = [i for i in request.args.get('ids', '').split(',') if i]
+    if not ids:
+        return jsonify({'error': 'Informe os IDs em ?ids='}), 400
+    fila = get_fila()
+    return jsonify({'jobs': [job for job in (fila.get(i) for i in ids) if job]})
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def status_job(job_id):
+    job = get_fila().get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job não encontrado'}), 404
+    return jsonify(job)
+
+_streams_sse = threading.BoundedSemaphore(JOB_SSE_MAX_STREAMS)
+
+@app.route('/api/jobs/<job_id>/eventos', methods=['GET'])
+def eventos_job(job_id):
+    """
+    Server-sent events with every status change of a job.
+
+    A stream holds one server thread, so at most JOB_SSE_MAX_STREAMS run at
+    once (others get 503 and should poll GET /api/jobs/<id>), and each ends
+    after JOB_SSE_MAX_SECONDS. EventSource reconnects on its own when a stream
+    ends before the job does.
+    """
+    fila = get_fila()
+    if fila.get(job_id) is None:
+        return jsonify({'error': 'Job não encontrado'}), 404
+    if not _streams_sse.acquire(blocking=False):
+        resposta = jsonify({'error': 'Muitas conexões de acompanhamento abertas; consulte o status do job.'})
+        resposta.headers['Retry-After'] = '2'
+        return resposta, 503
+
+    def gerar():
+        ultimo = None
+        ultimo_envio = inicio = time.monotonic()
+        yield "retry: 1000\n\n"
+        while time.monotonic() - inicio < JOB_SSE_MAX_SECONDS:
+            job = fila.get(job_id)
+            if job['status'] != ultimo:
+                ultimo = job['status']
+                ultimo_envio = time.monotonic()
+                yield f"event: status\ndata: {json.dumps(job, ensure_ascii=False)}\n\n"
+                if job['status'] in STATUS_FINAIS:
+                    return
+            elif time.monotonic() - ultimo_envio > 15:
+                # Keep proxies from closing an idle connection
+                ultimo_envio = time.monotonic()
+                yield ": ping\n\n"
+            fila.aguardar(1.0)
+
+    resposta = Response(gerar(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+    # Runs however the response ends, even if the generator never started
+    resposta.call_on_close(_streams_sse.release)
+    return resposta
+
+@app.route('/api/webhook/entregas', methods=['POST'])
+@_protegida
+def enfileirar_entregas():
+    """
+    Hands notas over to the server-side webhook queue.
+
+    Body: {"webhookUrl": "...", "notas": [{...}, ...]} (or "nota": {...}).
+    Only HTTPS URLs on WEBHOOK_ALLOWED_HOSTS are accepted.
+    Returns 202 with one delivery ID per nota.
+    """
+    corpo = request.get_json(silent=True) or {}
+    webhook_url = corpo.get('webhookUrl')
+    notas = corpo.get('notas') or ([corpo['nota']] if corpo.get('nota') else [])
+
+    if not notas or not all(isinstance(nota, dict) for nota in notas):
+        return jsonify({'error': 'Nenhuma nota enviada'}), 400
+
+    try:
+        ids = get_webhook_dispatcher().enfileirar(webhook_url, notas)
+    except WebhookUrlNaoPermitidaError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'ids': ids}), 202
+
+@app.route('/api/webhook/entregas/<entrega_id>', methods=['GET'])
+@_protegida
+def status_entrega(entrega_id):
+    entrega = get_webhook_dispatcher().get(entrega_id)
+    if entrega is None:
+        return jsonify({'error': 'Entrega não encontrada'}), 404
+    return jsonify(entrega)
+
+@app.route('/api/webhook/dead-letter', methods=['GET'])
+@_protegida
+def listar_dead_letter():
+    limite = request.args.get('limite', 100, type=int)
+    return jsonify({'entregas': get_webhook_dispatcher().dead_letter(limite)})
+
+@app.route('/api/webhook/dead-letter/replay', methods=['POST'])
+@_protegida
+def reenviar_dead_letter():
+    """
+    Requeues failed deliveries: all of them, or only {"ids": [...]}.
+    """
+    corpo = request.get_json(silent=True) or {}
+    total = get_webhook_dispatcher().reenviar(corpo.get('ids'))
+    return jsonify({'reenviadas': total})
+
+@app.route('/api/notas', methods=['GET'])
+@_protegida
+def consultar_notas():
+    """
+    Paginated, filtered list of a user's saved notas:
+    /api/notas?usuario=...&cnpj=&status=&uploadDate=&emissaoDe=&emissaoAte=&busca=&pagina=1&tamanhoPagina=50
+    """
+    usuario = request.args.get('usuario')
+    if not usuario:
+        return jsonify({'error': 'Informe o usuário em ?usuario='}), 400
+
+    filtros = {nome: request.args.get(nome) for nome in (*FILTROS, 'busca')}
+    pagina = request.args.get('pagina', 1, type=int)
+    tamanho = request.args.get('tamanhoPagina', PAGINA_PADRAO, type=int)
+    return jsonify(get_invoice_store().consultar(usuario, filtros, pagina, tamanho))
+
+@app.route('/api/notas/exportar', methods=['GET'])
+@_protegida
+def exportar_notas():
+    """
+    Streams a user's notas as CSV or XLSX:
+    /api/notas/exportar?usuario=...&formato=csv|xlsx&cnpj=&status=&emissaoDe=&emissaoAte=...
+
+    &excel=1 writes numeric-looking CSV text as ="..." for opening in Excel.
+
+    Rows are read from the store in chunks and written as they come, so
+    memory use does not grow with the export. CSV is gzipped on the fly when
+    the client accepts it (XLSX is already a zip).
+    """
+    usuario = request.args.get('usuario')
+    if not usuario:
+        return jsonify({'error': 'Informe o usuário em ?usuario='}), 400
+    formato = request.args.get('formato', 'csv').lower()
+    if formato not in FORMATOS_EXPORTACAO:
+        return jsonify({'error': 'Formato inválido. Use csv ou xlsx.'}), 400
+
+    filtros = {nome: request.args.get(nome) for nome in (*FILTROS, 'busca')}
+    notas = get_invoice_store().iterar(usuario, filtros)
+    headers = {'Content-Disposition': f'attachment; filename="notas-{date.today():%Y%m%d}.{formato}"'}
+
+    if formato == 'xlsx':
+        if not xlsx_disponivel():
+            return jsonify({'error': 'Exportação XLSX indisponível: openpyxl não instalado.'}), 501
+        mimetype = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+        return Response(gerar_xlsx(notas), mimetype=mimetype, headers=headers)
+
+    corpo = gerar_csv(notas, excel=request.args.get('excel') == '1')
+    headers['Vary'] = 'Accept-Encoding'
+    if 'gzip' in request.headers.get('Accept-Encoding', ''):
+        corpo = comprimir_gzip(corpo)
+        headers['Content-Encoding'] = 'gzip'
+    return Response(corpo, mimetype='text/csv; charset=utf-8', headers=headers)
+
+@app.route('/api/notas', methods=['POST'])
+@_protegida
+def salvar_notas():
+    """
+    Inserts or updates notas by ID: {"usuario": "...", "notas": [{...}]} (or "nota": {...}).
+
+    Returns one result per nota; duplicates are rejected with the ID of the
+    nota already stored. A single nota that is a duplicate returns 409.
+    """
+    corpo = request.get_json(silent=True) or {}
+    usuario = corpo.get('usuario')
+    notas = corpo.get('notas') or ([corpo['nota']] if corpo.get('nota') else [])
+
+    if not usuario:
+        return jsonify({'error': 'Informe o usuário'}), 400
+    if not notas or not all(isinstance(nota, dict) for nota in notas):
+        return jsonify({'error': 'Nenhuma nota enviada'}), 400
+
+    resultados = get_invoice_store().salvar(usuario, notas)
+    status = 409 if len(resultados) == 1 and not resultados[0]['ok'] else 200
+    return jsonify({'resultados': resultados}), status
+
+@app.route('/api/notas', methods=['DELETE'])
+@_protegida
+def remover_notas():
+    """
+    Deletes notas: {"usuario": "...", "ids": [...]}
+    """
+    corpo = request.get_json(silent=True) or {}
+    if not corpo.get('usuario'):
+        return jsonify({'error': 'Informe o usuário'}), 400
+    total = get_invoice_store().remover(corpo['usuario'], corpo.get('ids') or [])
+    return jsonify({'removidas': total})
 
 if __name__ == '__main__':
     app.run(debug=True, port=5001)
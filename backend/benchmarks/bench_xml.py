@@ -0,0 +1,115 @@
+"""
+Compares the streaming ler_xml_nfe against the previous full-tree parser.
+
+Usage (from backend/):
+    python -m benchmarks.bench_xml [--itens 100 1000 5000] [--notas 1] [--repeticoes 5]
+"""
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+import xml.etree.ElementTree as ET
+
+from benchmarks.corpus import gerar_xml_nfe
+from services.xml_service import ler_xml_nfe
+
+
+def ler_xml_nfe_legado(xml_path):
+    """
+    The parser as it was before the iterparse rewrite, kept for comparison only.
+    """
+    try:
+        tree = ET.parse(xml_path)
+        root = tree.getroot()
+
+        for elem in root.iter():
+            if '}' in elem.tag:
+                elem.tag = elem.tag.split('}', 1)[1]
+
+        inf_nfe = root.find('.//infNFe')
+        if inf_nfe is None:
+            raise ValueError("Estrutura infNFe não encontrada.")
+
+        emit = inf_nfe.find('emit')
+        ide = inf_nfe.find('ide')
+        total = inf_nfe.find('total')
+
+        data = {}
+
+        if ide is not None:
+            data['numeroNota'] = ide.find('nNF').text if ide.find('nNF') is not None else ''
+            dh_emi = ide.find('dhEmi').text if ide.find('dhEmi') is not None else ''
+            if dh_emi:
+                data['dataEmissao'] = dh_emi.split('T')[0]
+
+        if emit is not None:
+            data['cnpj'] = emit.find('CNPJ').text if emit.find('CNPJ') is not None else ''
+            data['fornecedor'] = emit.find('xNome').text if emit.find('xNome') is not None else ''
+
+        if total is not None:
+            icms_tot = total.find('ICMSTot')
+            if icms_tot is not None:
+                data['valor'] = icms_tot.find('vNF').text if icms_tot.find('vNF') is not None else ''
+
+        cobr = inf_nfe.find('cobr')
+        if cobr is not None:
+            dup = cobr.find('dup')
+            if dup is not None:
+                data['dataVencimento'] = dup.find('dVenc').text if dup.find('dVenc') is not None else ''
+
+        return data
+
+    except Exception as e:
+        print(f"Erro ao ler XML: {e}")
+        return {}
+
+
+def gerar_xml(caminho, itens, notas=1):
+    """
+    Writes a synthetic nfeProc (notas=1) or enviNFe lot (notas>1) to `caminho`.
+    """
+    with open(caminho, 'wb') as f:
+        f.write(gerar_xml_nfe(42, itens, notas))
+
+
+def medir(func, caminho, repeticoes):
+    tempos = []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        func(caminho)
+        tempos.append(time.perf_counter() - inicio)
+
+    tracemalloc.start()
+    func(caminho)
+    _, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return min(tempos), pico
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--itens', type=int, nargs='+', default=[10, 1000, 5000])
+    parser.add_argument('--notas', type=int, default=1)
+    parser.add_argument('--repeticoes', type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'itens':>6} {'KB':>8} {'legado ms':>10} {'novo ms':>9} {'legado pico KB':>15} {'novo pico KB':>13}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for itens in args.itens:
+            caminho = os.path.join(tmp, f'nfe_{itens}.xml')
+            gerar_xml(caminho, itens, args.notas)
+            assert ler_xml_nfe(caminho)['numeroNota'] == ler_xml_nfe_legado(caminho)['numeroNota']
+
+            t_legado, m_legado = medir(ler_xml_nfe_legado, caminho, args.repeticoes)
+            t_novo, m_novo = medir(ler_xml_nfe, caminho, args.repeticoes)
+            print(
+                f"{itens:>6} {os.path.getsize(caminho) / 1024:>8.0f} "
+                f"{t_legado * 1000:>10.1f} {t_novo * 1000:>9.1f} "
+                f"{m_legado / 1024:>15.0f} {m_novo / 1024:>13.0f}"
+            )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,229 @@
+"""
+Seeded generator of synthetic NFe XMLs and text-based DANFE PDFs.
+
+The same seed always produces the same bytes, so benchmark runs on different
+machines or commits measure the same inputs.
+"""
+import random
+from datetime import date, timedelta
+
+from services.chave_service import _digito_mod11, formatar_cnpj
+
+NFE_NS = 'http://www.portalfiscal.inf.br/nfe'
+
+# padrao: default namespace, as issued by SEFAZ
+# prefixo: same namespace bound to a prefix (nfe:NFe), as some ERPs export
+# sem_namespace: no namespace at all, as in hand-edited or legacy files
+VARIANTES_XML = ('padrao', 'prefixo', 'sem_namespace')
+
+_UFS = ('35', '33', '31', '41', '43', '42', '29', '52')
+_RAZOES = ('COMERCIO', 'DISTRIBUIDORA', 'INDUSTRIA', 'ATACADO', 'SERVICOS', 'LOGISTICA')
+_SUFIXOS = ('LTDA', 'S.A.', 'EIRELI', 'ME')
+_PRODUTOS = ('PARAFUSO', 'CABO', 'TINTA', 'PAPEL A4', 'TONER', 'CANETA', 'CAIXA', 'FITA', 'LUVA', 'DISCO')
+
+# Lines of items per DANFE page after the first one
+ITENS_POR_PAGINA = 50
+
+
+def gerar_cnpj(rng):
+    """
+    Random CNPJ (14 digits) with valid check digits.
+    """
+    base = [rng.randint(0, 9) for _ in range(8)] + [0, 0, 0, 1]
+    pesos = [5, 4, 3, 2, 9, 8, 7, 6, 5, 4, 3, 2]
+    for _ in range(2):
+        resto = sum(d * p for d, p in zip(base, pesos)) % 11
+        base.append(0 if resto < 2 else 11 - resto)
+        pesos = [6] + pesos
+    return ''.join(map(str, base))
+
+
+def gerar_nota(rng, numero, itens):
+    """
+    Header, items and totals of one nota, shared by the XML and PDF renderers.
+    """
+    cnpj = gerar_cnpj(rng)
+    emissao = date(2024, 1, 1) + timedelta(days=rng.randrange(366))
+    produtos = []
+    for n in range(1, itens + 1):
+        quantidade = rng.randint(1, 20)
+        unitario = rng.randint(100, 50000) / 100
+        produtos.append({
+            'item': n,
+            'codigo': f'{rng.randrange(10 ** 6):06d}',
+            'descricao': f'{rng.choice(_PRODUTOS)} {rng.randint(1, 999)}',
+            'quantidade': quantidade,
+            'unitario': unitario,
+            'total': round(quantidade * unitario, 2),
+        })
+
+    uf = rng.choice(_UFS)
+    serie = rng.randint(1, 9)
+    base = (f'{uf}{emissao:%y%m}{cnpj}55{serie:03d}{numero:09d}1'
+            f'{rng.randrange(10 ** 8):08d}')
+    return {
+        'numero': numero,
+        'serie': serie,
+        'chave': base + str(_digito_mod11(base)),
+        'cnpj': cnpj,
+        'fornecedor': f'{rng.choice(_RAZOES)} {rng.choice(_PRODUTOS)} {rng.choice(_SUFIXOS)}',
+        'emissao': emissao,
+        'vencimento': emissao + timedelta(days=rng.choice((0, 15, 28, 30, 45))),
+        'itens': produtos,
+        'valor': round(sum(p['total'] for p in produtos), 2),
+    }
+
+
+def gerar_xml_nfe(seed, itens, notas=1, variante='padrao'):
+    """
+    One nfeProc (notas=1) or an enviNFe lot (notas>1), as UTF-8 bytes.
+
+    Args:
+        seed (int): Generator seed.
+        itens (int): <det> items per nota.
+        notas (int): NFe documents in the file.
+        variante (str): One of VARIANTES_XML.
+    """
+    if variante not in VARIANTES_XML:
+        raise ValueError(f'Variante desconhecida: {variante}')
+    rng = random.Random(seed)
+    p = 'nfe:' if variante == 'prefixo' else ''
+
+    def abre(tag, atributos=''):
+        return f'<{p}{tag}{atributos}>'
+
+    def campo(tag, valor):
+        return f'<{p}{tag}>{valor}</{p}{tag}>'
+
+    raiz = 'nfeProc' if notas == 1 else 'enviNFe'
+    if variante == 'padrao':
+        declaracao = f' xmlns="{NFE_NS}" versao="4.00"'
+    elif variante == 'prefixo':
+        declaracao = f' xmlns:nfe="{NFE_NS}" versao="4.00"'
+    else:
+        declaracao = ' versao="4.00"'
+
+    partes = ['<?xml version="1.0" encoding="UTF-8"?>', abre(raiz, declaracao)]
+    for numero in range(1, notas + 1):
+        nota = gerar_nota(rng, numero, itens)
+        partes += [
+            abre('NFe'),
+            abre('infNFe', f' Id="NFe{nota["chave"]}" versao="4.00"'),
+            abre('ide'), campo('nNF', nota['numero']), campo('serie', nota['serie']),
+            campo('dhEmi', f'{nota["emissao"]:%Y-%m-%d}T10:00:00-03:00'), f'</{p}ide>',
+            abre('emit'), campo('CNPJ', nota['cnpj']), campo('xNome', nota['fornecedor']), f'</{p}emit>',
+        ]
+        for item in nota['itens']:
+            partes.append(
+                abre('det', f' nItem="{item["item"]}"') + abre('prod')
+                + campo('cProd', item['codigo']) + campo('xProd', item['descricao'])
+                + campo('NCM', '84713012') + campo('CFOP', '5102') + campo('uCom', 'UN')
+                + campo('qCom', f'{item["quantidade"]:.4f}') + campo('vUnCom', f'{item["unitario"]:.2f}')
+                + campo('vProd', f'{item["total"]:.2f}') + f'</{p}prod>'
+                + abre('imposto') + abre('ICMS') + abre('ICMS00') + campo('orig', 0) + campo('CST', '00')
+                + campo('vBC', f'{item["total"]:.2f}') + campo('pICMS', '18.00')
+                + campo('vICMS', f'{item["total"] * 0.18:.2f}')
+                + f'</{p}ICMS00></{p}ICMS></{p}imposto></{p}det>'
+            )
+        partes += [
+            abre('total'), abre('ICMSTot'), campo('vNF', f'{nota["valor"]:.2f}'), f'</{p}ICMSTot></{p}total>',
+            abre('cobr'), abre('dup'), campo('nDup', '001'),
+            campo('dVenc', f'{nota["vencimento"]:%Y-%m-%d}'), campo('vDup', f'{nota["valor"]:.2f}'),
+            f'</{p}dup></{p}cobr>',
+            f'</{p}infNFe></{p}NFe>',
+        ]
+    partes.append(f'</{p}{raiz}>')
+    return ''.join(partes).encode('utf-8')
+
+
+def _numero_danfe(numero):
+    n = f'{numero:09d}'
+    return f'{n[:3]}.{n[3:6]}.{n[6:]}'
+
+
+def _moeda(valor):
+    return f'{valor:,.2f}'.replace(',', '_').replace('.', ',').replace('_', '.')
+
+
+def gerar_paginas_danfe(seed, paginas, completo=True):
+    """
+    Text lines of a DANFE, one list per page.
+
+    Page 1 holds the header, the chave de acesso and the totals block, like a
+    real DANFE; the other pages hold items only. With completo=False the
+    chave and the emitter block are left out, so the local scanner is not
+    confident and the LLM gets called.
+    """
+    rng = random.Random(seed)
+    nota = gerar_nota(rng, rng.randint(1, 999999), max(1, (paginas - 1) * ITENS_POR_PAGINA + 10))
+    chave = ' '.join(nota['chave'][i:i + 4] for i in range(0, 44, 4))
+    primeira = ['DANFE - DOCUMENTO AUXILIAR DA NOTA FISCAL ELETRONICA']
+    if completo:
+        primeira += [
+            f'RECEBEMOS DE {nota["fornecedor"]} OS PRODUTOS CONSTANTES DA NOTA FISCAL INDICADA AO LADO',
+            f'CHAVE DE ACESSO {chave}',
+            f'CNPJ {formatar_cnpj(nota["cnpj"])}',
+        ]
+    primeira += [
+        f'NF-e No {_numero_danfe(nota["numero"])} SERIE {nota["serie"]:03d}',
+        f'DATA DE EMISSAO {nota["emissao"]:%d/%m/%Y}',
+        f'VENCIMENTO {nota["vencimento"]:%d/%m/%Y}',
+        f'VALOR TOTAL DA NOTA R$ {_moeda(nota["valor"])}',
+    ]
+    itens = [
+        f'{i["codigo"]} {i["descricao"]} UN {i["quantidade"]} {_moeda(i["unitario"])} {_moeda(i["total"])}'
+        for i in nota['itens']
+    ]
+    resultado = [primeira + itens[:10]]
+    for inicio in range(10, len(itens), ITENS_POR_PAGINA):
+        resultado.append(itens[inicio:inicio + ITENS_POR_PAGINA])
+    return resultado[:paginas]
+
+
+def gerar_texto_danfe(seed, paginas, completo=True):
+    """
+    The text PyPDF2 would return for gerar_pdf_danfe with the same arguments.
+    """
+    return ''.join('\n'.join(linhas) + '\n' for linhas in gerar_paginas_danfe(seed, paginas, completo))
+
+
+def gerar_pdf_danfe(seed, paginas, completo=True):
+    """
+    Text-based DANFE PDF (Helvetica, no compression, no images) as bytes.
+    """
+    return pdf_de_paginas(gerar_paginas_danfe(seed, paginas, completo))
+
+
+def pdf_de_paginas(paginas):
+    """
+    Minimal PDF with one list of text lines per page.
+    """
+    objetos = ['<< /Type /Catalog /Pages 2 0 R >>', None,
+               '<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>']
+    kids = []
+    for linhas in paginas:
+        texto = ' '.join(
+            f"BT /F1 8 Tf 30 {810 - 11 * i} Td ({_escapar(linha)}) Tj ET" for i, linha in enumerate(linhas)
+        )
+        objetos.append(f"<< /Length {len(texto.encode('latin-1'))} >>\nstream\n{texto}\nendstream")
+        objetos.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {len(objetos)} 0 R >>"
+        )
+        kids.append(f"{len(objetos)} 0 R")
+    objetos[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(kids)} >>"
+
+    saida = bytearray(b'%PDF-1.4\n')
+    offsets = []
+    for numero, corpo in enumerate(objetos, start=1):
+        offsets.append(len(saida))
+        saida += f"{numero} 0 obj\n{corpo}\nendobj\n".encode('latin-1')
+    xref = len(saida)
+    saida += f"xref\n0 {len(objetos) + 1}\n0000000000 65535 f \n".encode('latin-1')
+    saida += ''.join(f"{o:010d} 00000 n \n" for o in offsets).encode('latin-1')
+    saida += f"trailer\n<< /Size {len(objetos) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode('latin-1')
+    return bytes(saida)
+
+
+def _escapar(texto):
+    return texto.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
@@ -0,0 +1,278 @@
+"""
+Benchmark suite: throughput, latency percentiles and peak memory of the extractors.
+
+Inputs come from the seeded corpus generator, and LLM calls go to a local
+stub server, so two runs with the same arguments measure the same work.
+Results are saved as JSON and can be compared against an earlier run.
+
+Usage (from backend/):
+    python -m benchmarks.run [--rapido] [--casos xml pdf regex e2e]
+                             [--saida benchmarks/resultados/base.json]
+                             [--comparar benchmarks/resultados/base.json]
+"""
+import argparse
+import io
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+# Settings the services read at import time: no cache (every call does the
+# work), no real API key, and a rate limit that never throttles the stub
+os.environ.setdefault('DATA_DIR', tempfile.mkdtemp(prefix='nf_bench_'))
+os.environ.setdefault('CACHE_ENABLED', '0')
+os.environ.setdefault('GOOGLE_API_KEY', 'benchmark')
+os.environ.setdefault('LLM_RATE_PER_MINUTE', '1000000')
+
+from benchmarks.corpus import VARIANTES_XML, gerar_pdf_danfe, gerar_texto_danfe, gerar_xml_nfe
+from benchmarks.stub_llm import StubLLM
+
+PASTA_RESULTADOS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'resultados')
+
+# Time regressions smaller than this are noise, whatever the percentage
+_RUIDO_MS = 0.5
+
+
+def percentil(valores, p):
+    """
+    Nearest-rank percentile of an already sorted list.
+    """
+    indice = max(0, min(len(valores) - 1, round(p / 100 * len(valores) + 0.5) - 1))
+    return valores[indice]
+
+
+def resumir(tempos, pico=None, tamanho=None, duracao_total=None):
+    tempos = sorted(tempos)
+    total = duracao_total if duracao_total is not None else sum(tempos)
+    resultado = {
+        'repeticoes': len(tempos),
+        'mediaMs': round(sum(tempos) / len(tempos) * 1000, 3),
+        'p50Ms': round(percentil(tempos, 50) * 1000, 3),
+        'p95Ms': round(percentil(tempos, 95) * 1000, 3),
+        'p99Ms': round(percentil(tempos, 99) * 1000, 3),
+        'porSegundo': round(len(tempos) / total, 2) if total else None,
+        'picoKB': round(pico / 1024, 1) if pico is not None else None,
+    }
+    if tamanho:
+        resultado['entradaKB'] = round(tamanho / 1024, 1)
+        resultado['mbPorSegundo'] = round(tamanho * len(tempos) / total / 1024 / 1024, 2) if total else None
+    return resultado
+
+
+def medir(func, conteudo, repeticoes):
+    """
+    Times `func` on a fresh stream over `conteudo`, then measures its peak
+    Python memory in one extra, traced call (tracing slows everything down,
+    so it is kept out of the timings).
+    """
+    func(_entrada(conteudo))
+    tempos = []
+    for _ in range(repeticoes):
+        entrada = _entrada(conteudo)
+        inicio = time.perf_counter()
+        func(entrada)
+        tempos.append(time.perf_counter() - inicio)
+
+    entrada = _entrada(conteudo)
+    tracemalloc.start()
+    try:
+        func(entrada)
+        _, pico = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return resumir(tempos, pico, len(conteudo))
+
+
+def _entrada(conteudo):
+    return io.BytesIO(conteudo) if isinstance(conteudo, bytes) else conteudo
+
+
+def casos_extratores(args):
+    """
+    Yields (nome, func, conteudo, repeticoes) for the in-process benchmarks.
+    """
+    from services.ocr_service import extract_text_pdf, parse_invoice_text
+    from services.xml_service import iter_xml_nfe, ler_xml_nfe
+
+    rep = args.repeticoes
+    if 'xml' in args.casos:
+        for itens in args.itens:
+            yield f'xml/itens={itens}', ler_xml_nfe, gerar_xml_nfe(args.seed, itens), rep
+        for variante in VARIANTES_XML:
+            yield f'xml/variante={variante}/itens=100', ler_xml_nfe, gerar_xml_nfe(args.seed, 100, variante=variante), rep
+        lote = gerar_xml_nfe(args.seed, 20, notas=args.notas_lote)
+        yield f'xml_lote/notas={args.notas_lote}/primeira', ler_xml_nfe, lote, rep
+        yield f'xml_lote/notas={args.notas_lote}/todas', lambda f: sum(1 for _ in iter_xml_nfe(f)), lote, rep
+
+    if 'pdf' in args.casos:
+        for paginas in args.paginas:
+            yield f'pdf/paginas={paginas}', extract_text_pdf, gerar_pdf_danfe(args.seed, paginas), rep
+        # No chave/emitter block: the scanner is not confident and the stub LLM is called
+        yield 'pdf_llm/paginas=1', extract_text_pdf, gerar_pdf_danfe(args.seed, 1, completo=False), max(3, rep // 4)
+
+    if 'regex' in args.casos:
+        for paginas in args.paginas:
+            texto = gerar_texto_danfe(args.seed, paginas)
+            yield f'regex/paginas={paginas}', parse_invoice_text, texto, rep
+
+
+def casos_e2e(args):
+    """
+    POSTs to /api/ler-nota from `concorrencia` threads against a real HTTP
+    server running the app in this process.
+    """
+    if 'e2e' not in args.casos:
+        return
+    import httpx
+    from werkzeug.serving import make_server
+
+    import app as app_module
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    servidor = make_server('127.0.0.1', 0, app_module.app, threaded=True)
+    threading.Thread(target=servidor.serve_forever, name='bench-http', daemon=True).start()
+    url = f'http://127.0.0.1:{servidor.server_port}/api/ler-nota'
+
+    arquivos = {
+        'xml': ('nota.xml', gerar_xml_nfe(args.seed, 50), 'text/xml'),
+        'pdf': ('nota.pdf', gerar_pdf_danfe(args.seed, 3), 'application/pdf'),
+    }
+    try:
+        with httpx.Client(limits=httpx.Limits(max_connections=args.concorrencia)) as client:
+            for formato, arquivo in arquivos.items():
+                def enviar(_):
+                    inicio = time.perf_counter()
+                    resposta = client.post(url, files={'file': arquivo})
+                    resposta.raise_for_status()
+                    return time.perf_counter() - inicio
+
+                enviar(None)
+                inicio = time.perf_counter()
+                with ThreadPoolExecutor(max_workers=args.concorrencia) as executor:
+                    tempos = list(executor.map(enviar, range(args.requisicoes)))
+                duracao = time.perf_counter() - inicio
+                yield (f'e2e/{formato}/concorrencia={args.concorrencia}',
+                       resumir(tempos, tamanho=len(arquivo[1]), duracao_total=duracao))
+    finally:
+        servidor.shutdown()
+
+
+def comparar(atual, base, tolerancia):
+    """
+    Prints the change of every case present in both runs and returns the
+    regressions above `tolerancia` (0.2 = 20% slower or larger).
+    """
+    regressoes = []
+    print(f"\n{'caso':<42} {'p50 base':>10} {'p50 atual':>10} {'Δ':>8} {'pico base':>10} {'pico atual':>10} {'Δ':>8}")
+    for nome, resultado in atual['casos'].items():
+        anterior = base.get('casos', {}).get(nome)
+        if not anterior:
+            continue
+        colunas = []
+        for metrica in ('p50Ms', 'picoKB'):
+            antes, depois = anterior.get(metrica), resultado.get(metrica)
+            if not antes or depois is None:
+                colunas.append(('-', '-', ''))
+                continue
+            variacao = depois / antes - 1
+            ruido = metrica.endswith('Ms') and depois - antes < _RUIDO_MS
+            if variacao > tolerancia and not ruido:
+                regressoes.append((nome, metrica, antes, depois))
+            colunas.append((f'{antes:.1f}', f'{depois:.1f}', f'{variacao:+.0%}'))
+        (b1, a1, d1), (b2, a2, d2) = colunas
+        print(f"{nome:<42} {b1:>10} {a1:>10} {d1:>8} {b2:>10} {a2:>10} {d2:>8}")
+
+    for nome, metrica, antes, depois in regressoes:
+        print(f"REGRESSÃO: {nome} {metrica} {antes:.1f} -> {depois:.1f}")
+    return regressoes
+
+
+def _commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--casos', nargs='+', default=['xml', 'pdf', 'regex', 'e2e'],
+                        choices=['xml', 'pdf', 'regex', 'e2e'])
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--itens', type=int, nargs='+', default=[1, 100, 1000, 5000])
+    parser.add_argument('--paginas', type=int, nargs='+', default=[1, 10, 50])
+    parser.add_argument('--notas-lote', type=int, default=200)
+    parser.add_argument('--repeticoes', type=int, default=20)
+    parser.add_argument('--concorrencia', type=int, default=8)
+    parser.add_argument('--requisicoes', type=int, default=200)
+    parser.add_argument('--latencia-llm-ms', type=float, default=800)
+    parser.add_argument('--rapido', action='store_true', help='Entradas menores e menos repetições')
+    parser.add_argument('--saida', default=os.path.join(PASTA_RESULTADOS, 'ultimo.json'))
+    parser.add_argument('--comparar', help='JSON de uma execução anterior')
+    parser.add_argument('--tolerancia', type=float, default=0.2)
+    args = parser.parse_args()
+
+    if args.rapido:
+        args.itens = [1, 100, 1000]
+        args.paginas = [1, 10]
+        args.notas_lote = 50
+        args.repeticoes = 5
+        args.requisicoes = 40
+        args.latencia_llm_ms = min(args.latencia_llm_ms, 50)
+
+    # The stub must be up before llm_service is imported, which reads LLM_BASE_URL once
+    stub = StubLLM(latencia_ms=args.latencia_llm_ms, seed=args.seed).start()
+    os.environ['LLM_BASE_URL'] = stub.base_url
+
+    resultados = {
+        'meta': {
+            'data': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'commit': _commit(),
+            'python': platform.python_version(),
+            'plataforma': platform.platform(),
+            'cpus': os.cpu_count(),
+            'argumentos': {k: v for k, v in vars(args).items() if k not in ('saida', 'comparar')},
+        },
+        'casos': {},
+    }
+
+    print(f"{'caso':<42} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'ops/s':>9} {'pico KB':>9}")
+
+    def _imprimir(nome, resultado):
+        resultados['casos'][nome] = resultado
+        pico = resultado['picoKB']
+        print(f"{nome:<42} {resultado['p50Ms']:>9.2f} {resultado['p95Ms']:>9.2f} {resultado['p99Ms']:>9.2f} "
+              f"{resultado['porSegundo']:>9.1f} {pico if pico is not None else '-':>9}")
+
+    try:
+        for nome, func, conteudo, repeticoes in casos_extratores(args):
+            _imprimir(nome, medir(func, conteudo, repeticoes))
+        for nome, resultado in casos_e2e(args):
+            _imprimir(nome, resultado)
+    finally:
+        stub.stop()
+    resultados['meta']['chamadasLLM'] = stub.chamadas
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.saida)), exist_ok=True)
+    with open(args.saida, 'w', encoding='utf-8') as f:
+        json.dump(resultados, f, indent=2, ensure_ascii=False)
+    print(f"\nResultados salvos em {args.saida}")
+
+    if args.comparar:
+        with open(args.comparar, encoding='utf-8') as f:
+            base = json.load(f)
+        if comparar(resultados, base, args.tolerancia):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""
+Local stand-in for the Gemini generateContent API, with configurable latency.
+
+Point the backend at it with LLM_BASE_URL=http://127.0.0.1:<porta>. It answers
+every prompt with one JSON object per "=== NOTA n ===" block, so batched
+prompts from LLMDispatcher get the right number of results.
+
+Usage (from backend/):
+    python -m benchmarks.stub_llm [--porta 8089] [--latencia-ms 800] [--jitter-ms 200]
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_NOTA_RE = re.compile(r'=== NOTA \d+ ===\n(.*?)(?=\n\n=== NOTA \d+ ===|\Z)', re.DOTALL)
+_CNPJ_RE = re.compile(r'\d{2}\.\d{3}\.\d{3}/\d{4}-\d{2}')
+_NUMERO_RE = re.compile(r'N[ºo°]\s*([\d.]+)', re.IGNORECASE)
+
+
+def _resposta(texto):
+    cnpj = _CNPJ_RE.search(texto)
+    numero = _NUMERO_RE.search(texto)
+    return {
+        'numeroNota': numero.group(1).replace('.', '').lstrip('0') if numero else '1',
+        'cnpj': cnpj.group(0) if cnpj else '11.222.333/0001-81',
+        'fornecedor': 'FORNECEDOR SIMULADO LTDA',
+        'valor': 100.0,
+        'dataEmissao': '2024-01-01',
+        'dataVencimento': '2024-01-31',
+    }
+
+
+class StubLLM:
+    """
+    Threaded HTTP server that mimics generateContent.
+
+    Attributes:
+        chamadas (int): Requests answered so far (one per batched prompt).
+    """
+
+    def __init__(self, porta=0, latencia_ms=0, jitter_ms=0, seed=0):
+        self.latencia = latencia_ms / 1000
+        self.jitter = jitter_ms / 1000
+        self.chamadas = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                corpo = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                prompt = corpo['contents'][0]['parts'][0]['text']
+                with stub._lock:
+                    stub.chamadas += 1
+                    espera = stub.latencia + stub._rng.uniform(0, stub.jitter)
+                time.sleep(espera)
+
+                notas = [dict(_resposta(texto), nota=n)
+                         for n, texto in enumerate(_NOTA_RE.findall(prompt), start=1)] or [_resposta(prompt)]
+                texto = json.dumps(notas, ensure_ascii=False)
+                saida = json.dumps(
+                    {'candidates': [{'content': {'role': 'model', 'parts': [{'text': texto}]}}]}
+                ).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(saida)))
+                self.end_headers()
+                self.wfile.write(saida)
+
+            def log_message(self, *args):
+                pass
+
+        self._servidor = ThreadingHTTPServer(('127.0.0.1', porta), Handler)
+        self._servidor.daemon_threads = True
+
+    @property
+    def base_url(self):
+        return f'http://127.0.0.1:{self._servidor.server_address[1]}'
+
+    def start(self):
+        threading.Thread(target=self._servidor.serve_forever, name='stub-llm', daemon=True).start()
+        return self
+
+    def stop(self):
+        self._servidor.shutdown()
+        self._servidor.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--porta', type=int, default=8089)
+    parser.add_argument('--latencia-ms', type=float, default=800)
+    parser.add_argument('--jitter-ms', type=float, default=0)
+    args = parser.parse_args()
+
+    stub = StubLLM(args.porta, args.latencia_ms, args.jitter_ms)
+    print(f"Stub LLM em {stub.base_url} (latência {args.latencia_ms:.0f} ms + até {args.jitter_ms:.0f} ms)")
+    try:
+        stub._servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
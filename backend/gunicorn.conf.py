@@ -0,0 +1,28 @@
+"""
+Gunicorn settings (Procfile: gunicorn --chdir backend -c backend/gunicorn.conf.py app:app).
+Gunicorn loads -c before it applies --chdir, so the path is relative to the
+repo root.
+
+The app is imported once in the master (preload_app) and forked into the
+workers. Importing it is cheap, since PDF, LLM and XLSX dependencies load on
+first use. Each worker then drops anything it inherited and warms up on a
+background thread: it loads those dependencies and creates its own clients
+(LLM, webhooks, SQLite stores, job queue).
+"""
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '10000')}"
+workers = int(os.getenv('WEB_CONCURRENCY', 1))
+threads = int(os.getenv('GUNICORN_THREADS', 8))
+timeout = 0
+
+# Set PRELOAD_APP=0 to import the app in each worker instead
+preload_app = os.getenv('PRELOAD_APP', '1') != '0'
+
+
+def post_fork(server, worker):
+    from services import startup_service
+
+    startup_service.reiniciar_apos_fork()
+    if startup_service.WARMUP_ENABLED:
+        startup_service.aquecer_em_segundo_plano()
@@ -0,0 +1,24 @@
+import hmac
+import os
+
+# Shared secret for the routes that read or change saved notas and webhook
+# deliveries. Clients send it in the X-API-Token header (or ?token= on a
+# download link). Without it, those routes only answer requests from this
+# machine, so a deployed server must set API_TOKEN.
+API_TOKEN = os.getenv('API_TOKEN', '')
+
+_LOOPBACK = ('127.0.0.1', '::1')
+
+
+def acesso_permitido(token, endereco):
+    """
+    Checks a request's token, or, when API_TOKEN is unset, that it came
+    from the loopback address.
+
+    Args:
+        token (str): Token sent by the client, if any.
+        endereco (str): Remote address of the request.
+    """
+    if API_TOKEN:
+        return bool(token) and hmac.compare_digest(token.encode('utf-8'), API_TOKEN.encode('utf-8'))
+    return endereco in _LOOPBACK
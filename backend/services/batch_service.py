@@ -0,0 +1,150 @@
+import os
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from services.metrics_service import registrar_erro
+from services.nota_service import extrair_notas, formato_suportado
+from services.upload_service import (
+    MAX_BATCH_UPLOAD_BYTES, MAX_UPLOAD_BYTES, ArquivoMuitoGrandeError, copiar_para_buffer, desanexar_stream, tamanho_stream,
+)
+
+# Threads are enough here: most of the time per nota is spent waiting on the
+# LLM round trip, which does not hold the GIL.
+BATCH_MAX_WORKERS = int(os.getenv('BATCH_MAX_WORKERS', os.cpu_count() or 4))
+
+# Files per lot, ZIP members included. Together with MAX_BATCH_UPLOAD_BYTES
+# as a cap on the decompressed total, this keeps a small, highly compressible
+# ZIP from filling the disk before the first result is sent.
+BATCH_MAX_FILES = int(os.getenv('BATCH_MAX_FILES', 1000))
+
+
+def coletar_arquivos(files):
+    """
+    Lists the notas in an upload, expanding any ZIP among the files.
+
+    Uploaded PDFs and XMLs are used straight from the buffers UploadRequest
+    parsed them into, detached from the request so they outlive the view.
+    Only ZIP members are copied, each into its own spooled buffer (memory
+    first, temp file when large). Nothing goes to a shared folder.
+
+    Past BATCH_MAX_FILES notas, or MAX_BATCH_UPLOAD_BYTES in total, the rest
+    of the lot is not read and each file is reported as an error instead.
+
+    Args:
+        files (list): werkzeug FileStorage objects from the request.
+
+    Returns:
+        tuple: (itens, erros) where itens is a list of (nome, stream) ready to
+        process, to be closed by the caller, and erros is a list of per-file
+        error results.
+    """
+    itens = []
+    erros = []
+    restante = MAX_BATCH_UPLOAD_BYTES
+
+    def admitir(nome, tamanho=0):
+        if len(itens) >= BATCH_MAX_FILES:
+            erros.append(_resultado_erro(nome, f'Lote excede o limite de {BATCH_MAX_FILES} arquivos.'))
+            return False
+        if tamanho > MAX_UPLOAD_BYTES:
+            erros.append(_resultado_erro(nome, 'Arquivo excede o tamanho máximo permitido.'))
+            return False
+        if restante <= 0 or tamanho > restante:
+            erros.append(_resultado_erro(nome, 'Lote excede o tamanho máximo permitido.'))
+            return False
+        return True
+
+    def adicionar(nome, stream):
+        nonlocal restante
+        restante -= tamanho_stream(stream)
+        itens.append((nome, stream))
+
+    for file in files:
+        nome = file.filename or ''
+        if not nome:
+            continue
+
+        if nome.lower().endswith('.zip'):
+            try:
+                with zipfile.ZipFile(file.stream) as zf:
+                    for info in zf.infolist():
+                        if info.is_dir():
+                            continue
+                        membro = f"{nome}/{info.filename}"
+                        if not formato_suportado(info.filename):
+                            erros.append(_resultado_erro(membro, 'Formato não suportado. Use PDF ou XML.'))
+                            continue
+                        if not admitir(membro, info.file_size):
+                            continue
+                        limite = min(MAX_UPLOAD_BYTES, restante)
+                        try:
+                            with zf.open(info) as src:
+                                adicionar(membro, copiar_para_buffer(src, limite))
+                        except ArquivoMuitoGrandeError as e:
+                            # file_size in the ZIP header lied
+                            mensagem = str(e) if limite == MAX_UPLOAD_BYTES else 'Lote excede o tamanho máximo permitido.'
+                            erros.append(_resultado_erro(membro, mensagem))
+            except zipfile.BadZipFile:
+                erros.append(_resultado_erro(nome, 'Arquivo ZIP inválido.'))
+            continue
+
+        if not formato_suportado(nome):
+            erros.append(_resultado_erro(nome, 'Formato não suportado. Use PDF ou XML.'))
+            continue
+
+        if admitir(nome, tamanho_stream(file.stream)):
+            adicionar(nome, desanexar_stream(file))
+
+    return itens, erros
+
+
+def processar_lote(itens, max_workers=None):
+    """
+    Processes a lot of notas on a bounded thread pool.
+
+    Results are yielded as soon as each file finishes (not in upload order),
+    and a failure in one file never interrupts the others. An XML lot yields
+    one result per NFe, numbered by 'nota' (1-based) out of 'notasNoArquivo'.
+
+    Args:
+        itens (list): (nome, stream) pairs, as returned by coletar_arquivos.
+        max_workers (int): Pool size. Defaults to BATCH_MAX_WORKERS.
+
+    Yields:
+        dict: One result per nota: {'arquivo', 'ok', 'dados'} or {'arquivo', 'ok', 'erro'}.
+    """
+    if not itens:
+        return
+
+    workers = max(1, min(max_workers or BATCH_MAX_WORKERS, len(itens)))
+    executor = ThreadPoolExecutor(max_workers=workers)
+    try:
+        futures = {
+            executor.submit(extrair_notas, nome, fonte): nome
+            for nome, fonte in itens
+        }
+        for future in as_completed(futures):
+            nome = futures[future]
+            try:
+                notas = future.result()
+            except Exception as e:
+                registrar_erro(e, 'lote')
+                yield _resultado_erro(nome, str(e))
+                continue
+
+            if not notas:
+                yield _resultado_erro(nome, 'Não foi possível extrair dados do arquivo.')
+            elif len(notas) == 1:
+                yield {'arquivo': nome, 'ok': True, 'dados': notas[0]}
+            else:
+                for indice, data in enumerate(notas, start=1):
+                    yield {'arquivo': nome, 'ok': True, 'dados': data, 'nota': indice, 'notasNoArquivo': len(notas)}
+    finally:
+        # Also reached when the client disconnects and the generator is
+        # closed: files not started yet are dropped instead of processed
+        # (and sent to the LLM) for nobody
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def _resultado_erro(nome, mensagem):
+    return {'arquivo': nome, 'ok': False, 'erro': mensagem}
@@ -0,0 +1,177 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+DATA_DIR = os.getenv('DATA_DIR', os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data'))
+
+CACHE_ENABLED = os.getenv('CACHE_ENABLED', '1') != '0'
+CACHE_DB_PATH = os.getenv('CACHE_DB_PATH', os.path.join(DATA_DIR, 'cache.sqlite3'))
+CACHE_MEMORY_ENTRIES = int(os.getenv('CACHE_MEMORY_ENTRIES', 512))
+CACHE_DISK_ENTRIES = int(os.getenv('CACHE_DISK_ENTRIES', 50000))
+CACHE_MAX_AGE_DAYS = float(os.getenv('CACHE_MAX_AGE_DAYS', 90))
+
+# Expired rows are purged every N writes instead of on every write
+_PURGE_EVERY = 200
+
+
+def hash_conteudo(fonte):
+    """
+    Returns the content address (sha256 hex digest) of an upload.
+
+    Args:
+        fonte (str | bytes | file): Path, raw bytes or seekable binary stream.
+            Streams are read in chunks and rewound to where they were.
+    """
+    if isinstance(fonte, (bytes, bytearray)):
+        return hashlib.sha256(fonte).hexdigest()
+
+    digest = hashlib.sha256()
+    if isinstance(fonte, str):
+        with open(fonte, 'rb') as f:
+            for chunk in iter(lambda: f.read(64 * 1024), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    posicao = fonte.tell()
+    for chunk in iter(lambda: fonte.read(64 * 1024), b''):
+        digest.update(chunk)
+    fonte.seek(posicao)
+    return digest.hexdigest()
+
+
+class ExtractionCache:
+    """
+    Two-tier cache for extraction results, keyed by the hash of the uploaded file.
+
+    The first tier is an in-memory LRU, the second a SQLite table that survives
+    restarts. Every entry is stored with a version string: entries written
+    under a different version (new prompt, new model, new parser) are misses.
+    """
+
+    def __init__(self, db_path, versao, memory_entries=CACHE_MEMORY_ENTRIES,
+                 disk_entries=CACHE_DISK_ENTRIES, max_age_days=CACHE_MAX_AGE_DAYS):
+        self.versao = versao
+        self.memory_entries = memory_entries
+        self.disk_entries = disk_entries
+        self.max_age = max_age_days * 86400
+
+        self._lock = threading.Lock()
+        self._memoria = OrderedDict()
+        self._writes = 0
+        self._stats = {
+            'hitsMemoria': 0,
+            'hitsDisco': 0,
+            'misses': 0,
+            'gravacoes': 0,
+            'tempoEconomizadoMs': 0.0,
+        }
+
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS extracoes (
+                chave TEXT PRIMARY KEY,
+                versao TEXT NOT NULL,
+                dados TEXT NOT NULL,
+                duracao_ms REAL NOT NULL DEFAULT 0,
+                criado_em REAL NOT NULL,
+                acessado_em REAL NOT NULL
+            )
+        """)
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_extracoes_acessado ON extracoes (acessado_em)')
+        # Entries from older prompt/model/parser versions can never be hit again
+        self._conn.execute('DELETE FROM extracoes WHERE versao != ?', (versao,))
+        self._conn.commit()
+
+    def get(self, chave):
+        """
+        Returns the cached result for `chave`, or None on a miss.
+        """
+        agora = time.time()
+        with self._lock:
+            entrada = self._memoria.get(chave)
+            if entrada is not None:
+                dados, duracao_ms, criado_em = entrada
+                if agora - criado_em <= self.max_age:
+                    self._memoria.move_to_end(chave)
+                    self._stats['hitsMemoria'] += 1
+                    self._stats['tempoEconomizadoMs'] += duracao_ms
+                    return json.loads(dados)
+                del self._memoria[chave]
+
+            row = self._conn.execute(
+                'SELECT dados, duracao_ms, criado_em FROM extracoes WHERE chave = ? AND versao = ?',
+                (chave, self.versao)
+            ).fetchone()
+            if row is None or agora - row[2] > self.max_age:
+                self._stats['misses'] += 1
+                return None
+
+            dados, duracao_ms, criado_em = row
+            self._conn.execute('UPDATE extracoes SET acessado_em = ? WHERE chave = ?', (agora, chave))
+            self._conn.commit()
+            self._lembrar(chave, (dados, duracao_ms, criado_em))
+            self._stats['hitsDisco'] += 1
+            self._stats['tempoEconomizadoMs'] += duracao_ms
+            return json.loads(dados)
+
+    def set(self, chave, valor, duracao_ms=0.0):
+        """
+        Stores `valor` under `chave`. `duracao_ms` is how long the extraction
+        took, used to report the latency saved by later hits.
+        """
+        agora = time.time()
+        dados = json.dumps(valor, ensure_ascii=False)
+        with self._lock:
+            self._lembrar(chave, (dados, duracao_ms, agora))
+            self._conn.execute(
+                'INSERT OR REPLACE INTO extracoes (chave, versao, dados, duracao_ms, criado_em, acessado_em) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (chave, self.versao, dados, duracao_ms, agora, agora)
+            )
+            self._stats['gravacoes'] += 1
+            self._writes += 1
+            if self._writes % _PURGE_EVERY == 0:
+                self._purgar(agora)
+            self._conn.commit()
+
+    def stats(self):
+        """
+        Returns hit/miss counters and current sizes of both tiers.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entradasMemoria'] = len(self._memoria)
+            stats['entradasDisco'] = self._conn.execute('SELECT COUNT(*) FROM extracoes').fetchone()[0]
+        consultas = stats['hitsMemoria'] + stats['hitsDisco'] + stats['misses']
+        stats['taxaAcerto'] = round((consultas - stats['misses']) / consultas, 4) if consultas else 0.0
+        stats['tempoEconomizadoMs'] = round(stats['tempoEconomizadoMs'], 1)
+        stats['versao'] = self.versao
+        return stats
+
+    def clear(self):
+        with self._lock:
+            self._memoria.clear()
+            self._conn.execute('DELETE FROM extracoes')
+            self._conn.commit()
+
+    def _lembrar(self, chave, entrada):
+        self._memoria[chave] = entrada
+        self._memoria.move_to_end(chave)
+        while len(self._memoria) > self.memory_entries:
+            self._memoria.popitem(last=False)
+
+    def _purgar(self, agora):
+        # Age first, then trim the least recently used rows above the size limit
+        self._conn.execute('DELETE FROM extracoes WHERE criado_em < ?', (agora - self.max_age,))
+        self._conn.execute(
+            'DELETE FROM extracoes WHERE chave IN ('
+            '  SELECT chave FROM extracoes ORDER BY acessado_em DESC LIMIT -1 OFFSET ?'
+            ')',
+            (self.disk_entries,)
+        )
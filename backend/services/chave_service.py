@@ -0,0 +1,107 @@
+import re
+
+# cUF (IBGE) -> sigla
+CODIGOS_UF = {
+    '11': 'RO', '12': 'AC', '13': 'AM', '14': 'RR', '15': 'PA', '16': 'AP', '17': 'TO',
+    '21': 'MA', '22': 'PI', '23': 'CE', '24': 'RN', '25': 'PB', '26': 'PE', '27': 'AL',
+    '28': 'SE', '29': 'BA', '31': 'MG', '32': 'ES', '33': 'RJ', '35': 'SP', '41': 'PR',
+    '42': 'SC', '43': 'RS', '50': 'MS', '51': 'MT', '52': 'GO', '53': 'DF',
+}
+
+MODELOS = {'55': 'NF-e', '65': 'NFC-e'}
+
+# DANFEs print the key as 11 groups of 4 digits, separated by spaces or dots
+CHAVE_RE = re.compile(r'(?<!\d)\d{4}(?:[ .]?\d{4}){10}(?!\d)')
+_NAO_DIGITO_RE = re.compile(r'\D')
+
+
+def _digito_mod11(digitos):
+    # Weights 2..9 from right to left, restarting after 9 (Manual de Orientação do Contribuinte)
+    soma = 0
+    peso = 2
+    for d in reversed(digitos):
+        soma += int(d) * peso
+        peso = 2 if peso == 9 else peso + 1
+    dv = 11 - soma % 11
+    return 0 if dv >= 10 else dv
+
+
+def chave_valida(chave):
+    """
+    Checks length, UF, month, model and the mod-11 check digit of an access key.
+    """
+    if not chave or len(chave) != 44 or not chave.isdigit():
+        return False
+    if chave[0:2] not in CODIGOS_UF or chave[20:22] not in MODELOS:
+        return False
+    if not 1 <= int(chave[4:6]) <= 12:
+        return False
+    return _digito_mod11(chave[:43]) == int(chave[43])
+
+
+def decodificar_chave(chave):
+    """
+    Decodes a 44-digit chave de acesso into its fields.
+
+    Args:
+        chave (str): Access key, digits only (separators are ignored).
+
+    Returns:
+        dict: Decoded fields, or None if the key is not valid.
+    """
+    chave = _NAO_DIGITO_RE.sub('', chave or '')
+    if not chave_valida(chave):
+        return None
+
+    return {
+        'chaveAcesso': chave,
+        'uf': CODIGOS_UF[chave[0:2]],
+        'codigoUF': chave[0:2],
+        'anoMes': f"20{chave[2:4]}-{chave[4:6]}",
+        'cnpj': formatar_cnpj(chave[6:20]),
+        'modelo': chave[20:22],
+        'serie': chave[22:25].lstrip('0') or '0',
+        'numeroNota': chave[25:34].lstrip('0') or '0',
+        'tipoEmissao': chave[34],
+        'codigoNumerico': chave[35:43],
+        'digitoVerificador': chave[43],
+    }
+
+
+def encontrar_chave(texto):
+    """
+    Returns the first valid access key found in `texto` (decoded), or None.
+    """
+    for match in CHAVE_RE.finditer(texto or ''):
+        decodificada = decodificar_chave(match.group(0))
+        if decodificada:
+            return decodificada
+    return None
+
+
+def cnpj_valido(cnpj):
+    """
+    Validates the two CNPJ check digits. Accepts formatted or bare CNPJs.
+    """
+    digitos = _NAO_DIGITO_RE.sub('', cnpj or '')
+    if len(digitos) != 14 or digitos == digitos[0] * 14:
+        return False
+
+    def _dv(base, pesos):
+        resto = sum(int(d) * p for d, p in zip(base, pesos)) % 11
+        return '0' if resto < 2 else str(11 - resto)
+
+    pesos = [5, 4, 3, 2, 9, 8, 7, 6, 5, 4, 3, 2]
+    dv1 = _dv(digitos[:12], pesos)
+    dv2 = _dv(digitos[:12] + dv1, [6] + pesos)
+    return digitos[12:] == dv1 + dv2
+
+
+def formatar_cnpj(cnpj):
+    """
+    Formats 14 digits as XX.XXX.XXX/YYYY-ZZ (returns the input unchanged otherwise).
+    """
+    digitos = _NAO_DIGITO_RE.sub('', cnpj or '')
+    if len(digitos) != 14:
+        return cnpj
+    return f"{digitos[:2]}.{digitos[2:5]}.{digitos[5:8]}/{digitos[8:12]}-{digitos[12:]}"
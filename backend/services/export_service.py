@@ -0,0 +1,183 @@
+import csv
+import importlib.util
+import io
+import re
+import tempfile
+import zlib
+from datetime import date
+
+from services.chave_service import formatar_cnpj
+from services.invoice_store import valor_numerico
+
+# Explicit column schema: (field, header, type). IDs, numbers and keys are
+# 'texto' so spreadsheets never turn them into numbers (scientific notation,
+# dropped leading zeros).
+COLUNAS = (
+    ('id', 'ID', 'texto'),
+    ('numeroNota', 'Número da Nota', 'texto'),
+    ('chaveAcesso', 'Chave de Acesso', 'texto'),
+    ('cnpj', 'CNPJ do Fornecedor', 'cnpj'),
+    ('fornecedor', 'Fornecedor', 'texto'),
+    ('valor', 'Valor Total (R$)', 'valor'),
+    ('dataEmissao', 'Data de Emissão', 'data'),
+    ('dataVencimento', 'Data de Vencimento', 'data'),
+    ('uploadDate', 'Data de Upload', 'data'),
+    ('status', 'Status', 'texto'),
+    ('centroCusto', 'Centro de Custo', 'texto'),
+    ('paymentMethod', 'Forma de Pagamento', 'texto'),
+)
+
+FORMATOS_EXPORTACAO = ('csv', 'xlsx')
+
+_CHUNK = 64 * 1024
+
+# Text Excel would parse as a number on opening a CSV (IDs from Date.now(),
+# chaves de acesso, números with leading zeros)
+_NUMERICO_RE = re.compile(r'^[+-]?[\d.,]+([eE][+-]?\d+)?$')
+
+# Leading characters that make a spreadsheet evaluate a cell as a formula.
+# Fornecedor and other fields come from supplier PDFs and the LLM.
+_INICIO_FORMULA = ('=', '+', '-', '@', '\t', '\r')
+
+
+def _data(valor):
+    try:
+        return date.fromisoformat(str(valor)[:10]) if valor else None
+    except ValueError:
+        return None
+
+
+def _celula(nota, campo, tipo):
+    """
+    Typed value of one column: str for texto/cnpj, float for valor, date for data.
+    """
+    valor = nota.get(campo)
+    if tipo == 'valor':
+        valor = valor_numerico(valor)
+        return round(valor, 2) if valor is not None else None
+    if tipo == 'data':
+        return _data(valor)
+    if valor is None:
+        return None
+    if tipo == 'cnpj':
+        return formatar_cnpj(str(valor))
+    return str(valor)
+
+
+def _texto_csv(valor, excel=False):
+    """
+    Text cell of the CSV. Text starting like a formula gets a leading "'", so
+    spreadsheets show it instead of evaluating it.
+
+    With `excel`, numeric-looking text is written as ="...", which Excel shows
+    as-is instead of converting (1,7E+15, dropped leading zeros). Off by
+    default: an ERP import would read that wrapper literally.
+    """
+    if excel and _NUMERICO_RE.match(valor):
+        return f'="{valor}"'
+    if valor.startswith(_INICIO_FORMULA):
+        return "'" + valor
+    return valor
+
+
+def xlsx_disponivel():
+    # Checked without importing openpyxl, which is only loaded by gerar_xlsx
+    return importlib.util.find_spec('openpyxl') is not None
+
+
+def gerar_csv(notas, excel=False):
+    """
+    Streams notas as CSV for Excel pt-BR: UTF-8 with BOM, ';' separator,
+    decimal comma and dd/mm/yyyy dates. Yields bytes, one chunk per ~64 KB.
+
+    Args:
+        excel (bool): Write numeric-looking text as ="..." (see _texto_csv).
+    """
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer, delimiter=';', lineterminator='\r\n')
+    buffer.write('\ufeff')  # BOM, so Excel reads the file as UTF-8
+    escritor.writerow([titulo for _, titulo, _ in COLUNAS])
+
+    for nota in notas:
+        linha = []
+        for campo, _, tipo in COLUNAS:
+            valor = _celula(nota, campo, tipo)
+            if valor is None:
+                linha.append('')
+            elif tipo == 'valor':
+                linha.append(f'{valor:.2f}'.replace('.', ','))
+            elif tipo == 'data':
+                linha.append(valor.strftime('%d/%m/%Y'))
+            else:
+                linha.append(_texto_csv(valor, excel and tipo == 'texto'))
+        escritor.writerow(linha)
+        if buffer.tell() >= _CHUNK:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+
+def gerar_xlsx(notas):
+    """
+    Streams notas as an XLSX workbook with typed cells.
+
+    Rows go through a write-only workbook, which keeps them in a temp file
+    instead of memory; the finished file is then read back in chunks.
+
+    Raises:
+        ImportError: If openpyxl is not installed.
+    """
+    try:
+        import openpyxl
+        from openpyxl.cell import WriteOnlyCell
+    except ImportError:
+        raise ImportError("openpyxl não instalado") from None
+
+    workbook = openpyxl.Workbook(write_only=True)
+    planilha = workbook.create_sheet('Notas')
+    planilha.freeze_panes = 'A2'
+    planilha.append([titulo for _, titulo, _ in COLUNAS])
+
+    # One styled cell per column, reused on every row: append() serializes
+    # the row right away, and styling a new cell per value would dominate
+    formatos = {'texto': '@', 'cnpj': '@', 'valor': '#,##0.00', 'data': 'DD/MM/YYYY'}
+    celulas = []
+    for _, _, tipo in COLUNAS:
+        celula = WriteOnlyCell(planilha)
+        celula.number_format = formatos[tipo]
+        celulas.append(celula)
+
+    for nota in notas:
+        linha = []
+        for celula, (campo, _, tipo) in zip(celulas, COLUNAS):
+            valor = _celula(nota, campo, tipo)
+            if valor is None:
+                linha.append(None)
+            else:
+                celula.value = valor
+                if tipo in ('texto', 'cnpj'):
+                    # openpyxl turns any str starting with '=' into a formula
+                    celula.data_type = 's'
+                linha.append(celula)
+        planilha.append(linha)
+
+    with tempfile.TemporaryFile() as arquivo:
+        workbook.save(arquivo)
+        arquivo.seek(0)
+        for chunk in iter(lambda: arquivo.read(_CHUNK), b''):
+            yield chunk
+
+
+def comprimir_gzip(chunks, nivel=6):
+    """
+    Gzips a stream of byte chunks on the fly (Content-Encoding: gzip).
+    """
+    compressor = zlib.compressobj(nivel, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        saida = compressor.compress(chunk)
+        if saida:
+            yield saida
+    yield compressor.flush()
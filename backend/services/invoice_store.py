@@ -0,0 +1,335 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import uuid
+
+from services.cache_service import DATA_DIR
+
+INVOICE_DB_PATH = os.getenv('INVOICE_DB_PATH', os.path.join(DATA_DIR, 'notas.sqlite3'))
+PAGINA_PADRAO = 50
+PAGINA_MAXIMA = 500
+
+# Query-string filter -> (column, operator)
+FILTROS = {
+    'cnpj': ('cnpj', '='),
+    'status': ('status', '='),
+    'uploadDate': ('upload_date', '='),
+    'uploadDe': ('upload_date', '>='),
+    'uploadAte': ('upload_date', '<='),
+    'emissaoDe': ('data_emissao', '>='),
+    'emissaoAte': ('data_emissao', '<='),
+    'vencimentoDe': ('data_vencimento', '>='),
+    'vencimentoAte': ('data_vencimento', '<='),
+}
+
+_DATA_ISO_RE = re.compile(r'^\d{4}-\d{2}-\d{2}')
+
+
+class NotaDuplicadaError(ValueError):
+    """
+    Raised when a nota has the same chave de acesso, or the same CNPJ and
+    number, as another nota of the same user.
+    """
+
+    def __init__(self, mensagem, existente):
+        super().__init__(mensagem)
+        self.existente = existente
+
+
+class InvoiceStore:
+    """
+    Server-side store for the notas a user has saved.
+
+    Each nota is one row keyed by (usuario, ID), with the fields the UI
+    filters on copied into indexed columns and the full nota kept as JSON.
+    Saving one nota touches one row, instead of rewriting the whole list as
+    localStorage does. IDs come from each user's browser, so they are only
+    unique per user.
+    Duplicates (same chave de acesso, or same CNPJ + número) are rejected by
+    unique indexes at insert time.
+    """
+
+    def __init__(self, db_path):
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS notas (
+                id TEXT NOT NULL,
+                usuario TEXT NOT NULL,
+                numero_nota TEXT,
+                cnpj TEXT,
+                chave_acesso TEXT,
+                fornecedor TEXT,
+                valor REAL,
+                data_emissao TEXT,
+                data_vencimento TEXT,
+                upload_date TEXT,
+                status TEXT,
+                dados TEXT NOT NULL,
+                criado_em REAL NOT NULL,
+                atualizado_em REAL NOT NULL,
+                PRIMARY KEY (usuario, id)
+            )
+        """)
+        for nome, colunas in (
+            ('upload', 'usuario, upload_date'),
+            ('cnpj', 'usuario, cnpj'),
+            ('emissao', 'usuario, data_emissao'),
+            ('vencimento', 'usuario, data_vencimento'),
+            ('status', 'usuario, status'),
+        ):
+            self._conn.execute(f'CREATE INDEX IF NOT EXISTS idx_notas_{nome} ON notas ({colunas})')
+        self._conn.execute(
+            'CREATE UNIQUE INDEX IF NOT EXISTS uq_notas_chave ON notas (usuario, chave_acesso) '
+            'WHERE chave_acesso IS NOT NULL'
+        )
+        self._conn.execute(
+            'CREATE UNIQUE INDEX IF NOT EXISTS uq_notas_numero ON notas (usuario, cnpj, numero_nota) '
+            'WHERE cnpj IS NOT NULL AND numero_nota IS NOT NULL'
+        )
+
+    def salvar(self, usuario, notas):
+        """
+        Inserts or updates notas by ID, in one transaction.
+
+        A nota without an ID gets a new one. Each nota is checked on its own,
+        so one duplicate does not reject the rest of the list.
+
+        Returns:
+            list: One {'id', 'ok'} per nota, in order; duplicates get
+                {'ok': False, 'erro', 'duplicadaDe'} instead.
+        """
+        agora = time.time()
+        resultados = []
+        with self._lock:
+            self._conn.execute('BEGIN')
+            try:
+                for nota in notas:
+                    try:
+                        resultados.append({'id': self._gravar(usuario, nota, agora), 'ok': True})
+                    except NotaDuplicadaError as e:
+                        resultados.append({
+                            'id': nota.get('id'),
+                            'ok': False,
+                            'erro': str(e),
+                            'duplicadaDe': e.existente,
+                        })
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+        return resultados
+
+    def get(self, usuario, nota_id):
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT dados FROM notas WHERE usuario = ? AND id = ?', (usuario, nota_id)
+            ).fetchone()
+        return json.loads(row['dados']) if row else None
+
+    def consultar(self, usuario, filtros=None, pagina=1, tamanho=PAGINA_PADRAO):
+        """
+        Returns one page of a user's notas, most recent upload first.
+
+        Args:
+            filtros (dict): Keys from FILTROS (exact CNPJ/status/uploadDate,
+                inclusive date ranges) plus 'busca', a substring matched
+                against fornecedor, número, status and CNPJ.
+            pagina (int): 1-based page number.
+            tamanho (int): Page size, capped at PAGINA_MAXIMA.
+
+        Returns:
+            dict: {'notas', 'total', 'pagina', 'tamanhoPagina'}.
+        """
+        pagina = max(1, pagina)
+        tamanho = min(max(1, tamanho), PAGINA_MAXIMA)
+        where, params = _where(usuario, filtros or {})
+
+        with self._lock:
+            total = self._conn.execute(f'SELECT COUNT(*) FROM notas WHERE {where}', params).fetchone()[0]
+            rows = self._conn.execute(
+                f'SELECT dados FROM notas WHERE {where} '
+                f'ORDER BY upload_date DESC, criado_em DESC LIMIT ? OFFSET ?',
+                (*params, tamanho, (pagina - 1) * tamanho)
+            ).fetchall()
+        return {
+            'notas': [json.loads(row['dados']) for row in rows],
+            'total': total,
+            'pagina': pagina,
+            'tamanhoPagina': tamanho,
+        }
+
+    def iterar(self, usuario, filtros=None, lote=1000):
+        """
+        Yields every matching nota in emission-date order (notas without a
+        date first), `lote` rows at a time.
+
+        Each chunk is a keyset range scan over idx_notas_emissao, so the cost
+        per chunk does not grow with the offset, and the lock is not held
+        between chunks.
+        """
+        where, params = _where(usuario, filtros or {})
+        consultas = (
+            ('data_emissao IS NULL AND rowid > ?', lambda row: (row['rowid'],), (0,)),
+            ('data_emissao IS NOT NULL AND (data_emissao, rowid) > (?, ?)',
+             lambda row: (row['data_emissao'], row['rowid']), ('', 0)),
+        )
+        for condicao, chave, ultimo in consultas:
+            while True:
+                with self._lock:
+                    rows = self._conn.execute(
+                        f'SELECT rowid, data_emissao, dados FROM notas INDEXED BY idx_notas_emissao '
+                        f'WHERE {where} AND {condicao} ORDER BY data_emissao, rowid LIMIT ?',
+                        (*params, *ultimo, lote)
+                    ).fetchall()
+                for row in rows:
+                    yield json.loads(row['dados'])
+                if len(rows) < lote:
+                    break
+                ultimo = chave(rows[-1])
+
+    def remover(self, usuario, ids):
+        """
+        Deletes notas by ID. Returns how many were removed.
+        """
+        if not ids:
+            return 0
+        marcadores = ','.join('?' * len(ids))
+        with self._lock:
+            cursor = self._conn.execute(
+                f'DELETE FROM notas WHERE usuario = ? AND id IN ({marcadores})', (usuario, *ids)
+            )
+        return cursor.rowcount
+
+    def _gravar(self, usuario, nota, agora):
+        nota = dict(nota)
+        nota_id = str(nota.get('id') or uuid.uuid4().hex)
+        nota['id'] = nota_id
+
+        colunas = {
+            'numero_nota': _texto(nota.get('numeroNota')),
+            'cnpj': _digitos(nota.get('cnpj')),
+            'chave_acesso': _digitos(nota.get('chaveAcesso')),
+            'fornecedor': _texto(nota.get('fornecedor')),
+            'valor': valor_numerico(nota.get('valor')),
+            'data_emissao': _data(nota.get('dataEmissao')),
+            'data_vencimento': _data(nota.get('dataVencimento')),
+            'upload_date': _data(nota.get('uploadDate')),
+            'status': _texto(nota.get('status')),
+            'dados': json.dumps(nota, ensure_ascii=False),
+        }
+
+        existente = self._duplicada(usuario, nota_id, colunas)
+        if existente:
+            raise NotaDuplicadaError(f"Nota {nota.get('numeroNota') or nota_id} já cadastrada.", existente)
+
+        atribuicoes = ', '.join(f'{coluna} = ?' for coluna in colunas)
+        cursor = self._conn.execute(
+            f'UPDATE notas SET {atribuicoes}, atualizado_em = ? WHERE id = ? AND usuario = ?',
+            (*colunas.values(), agora, nota_id, usuario)
+        )
+        if cursor.rowcount == 0:
+            nomes = ', '.join(colunas)
+            self._conn.execute(
+                f'INSERT INTO notas (id, usuario, {nomes}, criado_em, atualizado_em) '
+                f'VALUES (?, ?, {", ".join("?" * len(colunas))}, ?, ?)',
+                (nota_id, usuario, *colunas.values(), agora, agora)
+            )
+        return nota_id
+
+    def _duplicada(self, usuario, nota_id, colunas):
+        # Checked up front so the error can name the existing nota; the unique
+        # indexes still guard against anything that slips past
+        if colunas['chave_acesso']:
+            row = self._conn.execute(
+                'SELECT id FROM notas WHERE usuario = ? AND chave_acesso = ? AND id != ?',
+                (usuario, colunas['chave_acesso'], nota_id)
+            ).fetchone()
+            if row:
+                return row['id']
+        if colunas['cnpj'] and colunas['numero_nota']:
+            row = self._conn.execute(
+                'SELECT id FROM notas WHERE usuario = ? AND cnpj = ? AND numero_nota = ? AND id != ?',
+                (usuario, colunas['cnpj'], colunas['numero_nota'], nota_id)
+            ).fetchone()
+            if row:
+                return row['id']
+        return None
+
+
+def _where(usuario, filtros):
+    condicoes = ['usuario = ?']
+    params = [usuario]
+    for nome, (coluna, operador) in FILTROS.items():
+        valor = filtros.get(nome)
+        if not valor:
+            continue
+        condicoes.append(f'{coluna} {operador} ?')
+        params.append(_digitos(valor) if coluna == 'cnpj' else valor)
+    if filtros.get('busca'):
+        termo = f"%{filtros['busca']}%"
+        busca = ['fornecedor LIKE ?', 'numero_nota LIKE ?', 'status LIKE ?']
+        params += [termo, termo, termo]
+        # CNPJ is stored as digits, so "11.222.333" and "11222333" both match
+        digitos = _digitos(filtros['busca'])
+        if digitos:
+            busca.append('cnpj LIKE ?')
+            params.append(f'%{digitos}%')
+        condicoes.append(f"({' OR '.join(busca)})")
+    return ' AND '.join(condicoes), params
+
+
+def _texto(valor):
+    if valor is None:
+        return None
+    return str(valor).strip() or None
+
+
+def _digitos(valor):
+    digitos = re.sub(r'\D', '', str(valor or ''))
+    return digitos or None
+
+
+def _data(valor):
+    valor = _texto(valor)
+    return valor[:10] if valor and _DATA_ISO_RE.match(valor) else valor
+
+
+def valor_numerico(valor):
+    """
+    Accepts 150.0, "150.00" and "1.234,56".
+    """
+    if valor is None or valor == '':
+        return None
+    if isinstance(valor, (int, float)):
+        return float(valor)
+    texto = str(valor).replace('R$', '').strip()
+    if ',' in texto:
+        texto = texto.replace('.', '').replace(',', '.')
+    try:
+        return float(texto)
+    except ValueError:
+        return None
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_invoice_store():
+    """
+    Returns the process-wide invoice store.
+    """
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = InvoiceStore(INVOICE_DB_PATH)
+    return _store
@@ -0,0 +1,276 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from werkzeug.utils import secure_filename
+
+from services.cache_service import DATA_DIR
+from services.metrics_service import registrar_erro
+from services.nota_service import extrair_notas
+
+JOBS_DB_PATH = os.getenv('JOBS_DB_PATH', os.path.join(DATA_DIR, 'jobs.sqlite3'))
+JOBS_DIR = os.getenv('JOBS_DIR', os.path.join(DATA_DIR, 'jobs'))
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', 4))
+JOB_TIMEOUT_SECONDS = float(os.getenv('JOB_TIMEOUT_SECONDS', 120))
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', 3))
+
+# Each SSE stream holds a server thread, so streams are capped in number and
+# length; the browser reconnects when one ends, or falls back to polling
+JOB_SSE_MAX_STREAMS = int(os.getenv('JOB_SSE_MAX_STREAMS', 2))
+JOB_SSE_MAX_SECONDS = float(os.getenv('JOB_SSE_MAX_SECONDS', 25))
+
+# Workers also poll the table, so jobs written by another process (or left
+# behind by a restart) are picked up even without a local notification.
+_POLL_SECONDS = 1.0
+
+# Extra lease time so a job is never re-claimed while its worker is still
+# waiting out the timeout
+_LEASE_MARGIN_SECONDS = 30
+
+STATUS_PENDENTE = 'pendente'
+STATUS_PROCESSANDO = 'processando'
+STATUS_CONCLUIDO = 'concluido'
+STATUS_ERRO = 'erro'
+STATUS_FINAIS = (STATUS_CONCLUIDO, STATUS_ERRO)
+
+
+class JobTimeoutError(Exception):
+    pass
+
+
+class JobQueue:
+    """
+    Persistent upload queue backed by SQLite and a folder of stored uploads.
+
+    A job claimed by a worker holds a lease of `timeout` seconds. If the
+    process dies mid-job, the lease expires and any worker (in this or another
+    process) claims it again, up to `max_attempts` times.
+
+    `processar(nome, caminho)` returns the list of notas in the file, so a
+    finished job's result holds every NFe of an XML lot.
+    """
+
+    def __init__(self, db_path, files_dir, processar, workers=JOB_WORKERS,
+                 timeout=JOB_TIMEOUT_SECONDS, max_attempts=JOB_MAX_ATTEMPTS):
+        self.files_dir = files_dir
+        self.processar = processar
+        self.workers = workers
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+
+        self._lock = threading.Lock()
+        self._mudou = threading.Condition()
+        self._parar = threading.Event()
+        self._threads = []
+
+        os.makedirs(files_dir, exist_ok=True)
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                arquivo TEXT NOT NULL,
+                caminho TEXT NOT NULL,
+                status TEXT NOT NULL,
+                resultado TEXT,
+                erro TEXT,
+                tentativas INTEGER NOT NULL DEFAULT 0,
+                lease_ate REAL,
+                criado_em REAL NOT NULL,
+                iniciado_em REAL,
+                concluido_em REAL
+            )
+        """)
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, criado_em)')
+
+    # --- Producer side ---
+
+    def submit(self, filename, stream):
+        """
+        Stores the upload and enqueues it. Returns the new job right away.
+
+        Args:
+            filename (str): Original file name.
+            stream (file): Binary file-like object with the upload.
+        """
+        job_id = uuid.uuid4().hex
+        caminho = os.path.join(self.files_dir, f"{job_id}_{secure_filename(filename) or 'arquivo'}")
+        with open(caminho, 'wb') as f:
+            while True:
+                chunk = stream.read(64 * 1024)
+                if not chunk:
+                    break
+                f.write(chunk)
+
+        with self._lock:
+            self._conn.execute(
+                'INSERT INTO jobs (id, arquivo, caminho, status, criado_em) VALUES (?, ?, ?, ?, ?)',
+                (job_id, filename, caminho, STATUS_PENDENTE, time.time())
+            )
+        self._notificar()
+        return self.get(job_id)
+
+    def get(self, job_id):
+        """
+        Returns the public view of a job, or None if it does not exist.
+        """
+        with self._lock:
+            row = self._conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return _job_publico(row) if row else None
+
+    def aguardar(self, timeout):
+        """
+        Blocks until some job changes in this process, or `timeout` elapses.
+        """
+        with self._mudou:
+            self._mudou.wait(timeout)
+
+    # --- Worker side ---
+
+    def start(self):
+        """
+        Starts the worker threads (idempotent).
+        """
+        if self._threads:
+            return
+        self._parar.clear()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f'job-worker-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        self._parar.set()
+        self._notificar()
+        for thread in self._threads:
+            thread.join(timeout=5)
+        self._threads = []
+
+    def _worker(self):
+        while not self._parar.is_set():
+            try:
+                job = self._reivindicar()
+                if job is not None:
+                    self._executar(job)
+                    continue
+            except Exception as e:
+                # e.g. the SQLite lock timed out: keep the thread alive; a
+                # claimed job comes back when its lease expires
+                registrar_erro(e, 'job_worker')
+                print(f"Fila de jobs: erro no worker ({type(e).__name__}: {e})")
+            with self._mudou:
+                self._mudou.wait(_POLL_SECONDS)
+
+    def _reivindicar(self):
+        agora = time.time()
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = self._conn.execute(
+                    'SELECT * FROM jobs WHERE status = ? OR (status = ? AND lease_ate < ?) '
+                    'ORDER BY criado_em LIMIT 1',
+                    (STATUS_PENDENTE, STATUS_PROCESSANDO, agora)
+                ).fetchone()
+                if row is None:
+                    self._conn.execute('COMMIT')
+                    return None
+
+                if row['tentativas'] >= self.max_attempts:
+                    # Lease expired too many times: the job keeps killing or hanging its worker
+                    self._finalizar_sql(row, STATUS_ERRO, erro='Número máximo de tentativas excedido.')
+                    self._conn.execute('COMMIT')
+                    self._notificar()
+                    return None
+
+                self._conn.execute(
+                    'UPDATE jobs SET status = ?, tentativas = tentativas + 1, lease_ate = ?, iniciado_em = ? '
+                    'WHERE id = ?',
+                    (STATUS_PROCESSANDO, agora + self.timeout + _LEASE_MARGIN_SECONDS, agora, row['id'])
+                )
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+        self._notificar()
+        return row
+
+    def _executar(self, row):
+        resultado = {}
+
+        def _alvo():
+            try:
+                resultado['dados'] = self.processar(row['arquivo'], row['caminho'])
+            except Exception as e:
+                resultado['erro'] = e
+
+        # A hung extraction cannot be killed in Python; the job is failed on
+        # timeout and the daemon thread is abandoned so this worker moves on.
+        thread = threading.Thread(target=_alvo, name=f"job-{row['id']}", daemon=True)
+        thread.start()
+        thread.join(self.timeout)
+
+        if thread.is_alive():
+            erro = JobTimeoutError(f'Tempo limite de {self.timeout:.0f}s excedido.')
+        else:
+            erro = resultado.get('erro')
+        if erro is not None:
+            registrar_erro(erro, 'job')
+
+        with self._lock:
+            if erro is not None:
+                self._finalizar_sql(row, STATUS_ERRO, erro=str(erro))
+            elif not resultado.get('dados'):
+                self._finalizar_sql(row, STATUS_ERRO, erro='Não foi possível extrair dados do arquivo.')
+            else:
+                self._finalizar_sql(row, STATUS_CONCLUIDO, resultado=resultado['dados'])
+        self._notificar()
+
+    def _finalizar_sql(self, row, status, resultado=None, erro=None):
+        self._conn.execute(
+            'UPDATE jobs SET status = ?, resultado = ?, erro = ?, lease_ate = NULL, concluido_em = ? WHERE id = ?',
+            (status, json.dumps(resultado, ensure_ascii=False) if resultado is not None else None,
+             erro, time.time(), row['id'])
+        )
+        if os.path.exists(row['caminho']):
+            os.remove(row['caminho'])
+
+    def _notificar(self):
+        with self._mudou:
+            self._mudou.notify_all()
+
+
+def _job_publico(row):
+    return {
+        'id': row['id'],
+        'arquivo': row['arquivo'],
+        'status': row['status'],
+        'resultado': json.loads(row['resultado']) if row['resultado'] else None,
+        'erro': row['erro'],
+        'tentativas': row['tentativas'],
+        'criadoEm': row['criado_em'],
+        'iniciadoEm': row['iniciado_em'],
+        'concluidoEm': row['concluido_em'],
+    }
+
+
+_fila = None
+_fila_lock = threading.Lock()
+
+
+def get_fila():
+    """
+    Returns the process-wide job queue, starting its workers on first use.
+    """
+    global _fila
+    if _fila is None:
+        with _fila_lock:
+            if _fila is None:
+                fila = JobQueue(JOBS_DB_PATH, JOBS_DIR, extrair_notas)
+                fila.start()
+                _fila = fila
+    return _fila
@@ -0,0 +1,287 @@
+import json
+import os
+import queue
+import random
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from services.metrics_service import etapa, registrar_erro
+
+# User requested Gemma. In Google AI Studio, Gemma models are often accessed as "gemma-2-9b-it"
+# or similar. If this specific string fails, we might need to revert to "gemini-2.0-flash"
+# which has a massive free tier.
+MODEL_ID = os.getenv("LLM_MODEL_ID", "gemma-3-12b-it")
+
+# Point at a local stub server for tests/benchmarks (default: Google AI Studio)
+LLM_BASE_URL = os.getenv("LLM_BASE_URL") or None
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", 60))
+
+# Up to LLM_BATCH_SIZE notas share one prompt; a batch is sent when full or
+# after LLM_BATCH_WAIT_MS, whichever comes first
+LLM_BATCH_SIZE = int(os.getenv("LLM_BATCH_SIZE", 4))
+LLM_BATCH_WAIT_MS = float(os.getenv("LLM_BATCH_WAIT_MS", 200))
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", 4))
+
+# Token bucket sized to the API quota (requests, not notas)
+LLM_RATE_PER_MINUTE = float(os.getenv("LLM_RATE_PER_MINUTE", 30))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", 5))
+_BACKOFF_BASE_SECONDS = 1.0
+_BACKOFF_MAX_SECONDS = 30.0
+
+PROMPT_TEMPLATE = """
+        Você é um assistente especializado em contabilidade. Abaixo há {quantidade} Nota(s) Fiscal(is), cada uma começando com "=== NOTA n ===". Analise cada uma e extraia os seguintes dados em formato JSON.
+
+        {notas}
+
+        Retorne APENAS um array JSON válido com {quantidade} objeto(s), um por nota, cada um com esta estrutura exata. Em "nota", repita o número n do cabeçalho "=== NOTA n ===" da nota correspondente. Não use Markdown (```json).:
+        {{
+            "nota": 0 (int, o n de "=== NOTA n ==="),
+            "numeroNota": "string (apenas números)",
+            "cnpj": "string (XX.XXX.XXX/YYYY-ZZ)",
+            "fornecedor": "string (Nome da Razão Social)",
+            "valor": 0.00 (float, use ponto para decimais),
+            "dataEmissao": "YYYY-MM-DD",
+            "dataVencimento": "YYYY-MM-DD"
+        }}
+        """
+
+
+def montar_prompt(textos):
+    notas = "\n\n".join(f"=== NOTA {i} ===\n{texto}" for i, texto in enumerate(textos, start=1))
+    return PROMPT_TEMPLATE.format(quantidade=len(textos), notas=notas)
+
+
+def limpar_json(content):
+    """
+    Parses a model answer, stripping Markdown code fences if present.
+    """
+    content = content.strip()
+    if content.startswith("```json"):
+        content = content[7:]
+    elif content.startswith("```"):
+        content = content[3:]
+    if content.endswith("```"):
+        content = content[:-3]
+    return json.loads(content)
+
+
+class TokenBucket:
+    """
+    Blocking token bucket: `rate` tokens per second, bursts up to `capacity`.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._ultimo = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                agora = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (agora - self._ultimo) * self.rate)
+                self._ultimo = agora
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                espera = (1 - self._tokens) / self.rate
+            time.sleep(espera)
+
+
+def _retentavel(erro):
+    import httpx
+    from google.genai import errors
+
+    if isinstance(erro, errors.APIError):
+        return erro.code == 429 or erro.code >= 500
+    return isinstance(erro, httpx.TransportError)
+
+
+def _resultados_por_nota(resultados, quantidade):
+    """
+    Maps the objects of a batched answer to their notas (1-based) by the
+    "nota" key the prompt asks for. Objects without a valid, unique key are
+    dropped. A one-nota prompt also accepts an answer without the key.
+    """
+    if quantidade == 1 and len(resultados) == 1 and isinstance(resultados[0], dict):
+        resultado = dict(resultados[0])
+        resultado.pop('nota', None)
+        return {1: resultado}
+
+    por_nota = {}
+    repetidas = set()
+    for resultado in resultados:
+        if not isinstance(resultado, dict):
+            continue
+        resultado = dict(resultado)
+        try:
+            n = int(resultado.pop('nota'))
+        except (KeyError, TypeError, ValueError):
+            continue
+        if not 1 <= n <= quantidade:
+            continue
+        if n in por_nota:
+            repetidas.add(n)
+        por_nota[n] = resultado
+    for n in repetidas:
+        del por_nota[n]
+    return por_nota
+
+
+class LLMDispatcher:
+    """
+    Groups invoice texts from concurrent callers into multi-invoice prompts.
+
+    Callers block on extrair(); a background thread collects pending texts into
+    batches, and a small pool sends them under a shared token bucket, retrying
+    429/5xx with exponential backoff and full jitter.
+    """
+
+    def __init__(self, client, model=MODEL_ID, batch_size=LLM_BATCH_SIZE,
+                 batch_wait_ms=LLM_BATCH_WAIT_MS, concurrency=LLM_CONCURRENCY,
+                 rate_per_minute=LLM_RATE_PER_MINUTE, max_retries=LLM_MAX_RETRIES):
+        self.client = client
+        self.model = model
+        self.batch_size = max(1, batch_size)
+        self.batch_wait = batch_wait_ms / 1000
+        self.max_retries = max_retries
+        self.bucket = TokenBucket(rate_per_minute / 60, max(1, concurrency))
+
+        self._fila = queue.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix='llm')
+        self._thread = threading.Thread(target=self._agrupar, name='llm-dispatcher', daemon=True)
+        self._thread.start()
+
+    def extrair(self, texto, timeout=None):
+        """
+        Returns the model's JSON for one invoice text. Raises on failure.
+        """
+        future = Future()
+        self._fila.put((texto, future))
+        return future.result(timeout)
+
+    def _agrupar(self):
+        while True:
+            lote = [self._fila.get()]
+            limite = time.monotonic() + self.batch_wait
+            while len(lote) < self.batch_size:
+                restante = limite - time.monotonic()
+                if restante <= 0:
+                    break
+                try:
+                    lote.append(self._fila.get(timeout=restante))
+                except queue.Empty:
+                    break
+            self._executor.submit(self._enviar, lote)
+
+    def _enviar(self, lote):
+        textos = [texto for texto, _ in lote]
+        futures = [future for _, future in lote]
+        try:
+            resultados = self._chamar(montar_prompt(textos))
+            if isinstance(resultados, dict) and len(lote) == 1:
+                resultados = [resultados]
+            if not isinstance(resultados, list):
+                raise ValueError("Resposta da IA não é um array JSON")
+        except Exception as e:
+            # An unreadable batched answer (not JSON, not an array) says
+            # nothing about any single nota: ask for each one on its own
+            if isinstance(e, ValueError) and len(lote) > 1:
+                print(f"Resposta da IA ilegível para o lote ({e}); reenviando {len(lote)} notas separadamente")
+                for item in lote:
+                    self._executor.submit(self._enviar, [item])
+                return
+            for future in futures:
+                future.set_exception(e)
+            return
+
+        por_nota = _resultados_por_nota(resultados, len(lote))
+        sozinhas = []
+        for n, (texto, future) in enumerate(lote, start=1):
+            if n in por_nota:
+                future.set_result(por_nota[n])
+            elif len(lote) > 1:
+                sozinhas.append((texto, future))
+            else:
+                future.set_exception(ValueError("Resposta da IA sem a nota"))
+
+        # Notas the batched answer did not clearly account for are asked again
+        # one by one, instead of guessing which object belongs to whom
+        if sozinhas:
+            print(f"IA respondeu {len(por_nota)} de {len(lote)} notas do lote; reenviando {len(sozinhas)} separadamente")
+        for item in sozinhas:
+            self._executor.submit(self._enviar, [item])
+
+    def _chamar(self, prompt):
+        tentativa = 0
+        while True:
+            self.bucket.acquire()
+            try:
+                with etapa('llm_generate_content'):
+                    response = self.client.models.generate_content(model=self.model, contents=prompt)
+                if not response.text:
+                    raise ValueError("Resposta da IA vazia")
+                with etapa('llm_json'):
+                    return limpar_json(response.text)
+            except Exception as e:
+                registrar_erro(e, 'llm_generate_content')
+                if not _retentavel(e) or tentativa >= self.max_retries:
+                    raise
+                espera = random.uniform(0, min(_BACKOFF_MAX_SECONDS, _BACKOFF_BASE_SECONDS * 2 ** tentativa))
+                print(f"IA indisponível ({e}); nova tentativa em {espera:.1f}s")
+                time.sleep(espera)
+                tentativa += 1
+
+
+_client = None
+_dispatcher = None
+_lock = threading.Lock()
+
+
+def get_client():
+    """
+    Returns the process-wide genai client, built on one pooled httpx client.
+
+    google.genai is imported here rather than at module level: it takes most
+    of the app's import time, and XML requests never need it.
+    """
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                import httpx
+                from google import genai
+                from google.genai import types
+
+                api_key = os.getenv("GOOGLE_API_KEY")
+                if not api_key:
+                    raise ValueError("API Key do Google não encontrada no arquivo .env (GOOGLE_API_KEY)")
+                http_client = httpx.Client(
+                    timeout=LLM_TIMEOUT_SECONDS,
+                    limits=httpx.Limits(max_connections=LLM_CONCURRENCY * 2, max_keepalive_connections=LLM_CONCURRENCY),
+                )
+                _client = genai.Client(
+                    api_key=api_key,
+                    http_options=types.HttpOptions(
+                        base_url=LLM_BASE_URL,
+                        timeout=int(LLM_TIMEOUT_SECONDS * 1000),
+                        httpx_client=http_client,
+                    ),
+                )
+    return _client
+
+
+def get_dispatcher():
+    """
+    Returns the process-wide LLM dispatcher.
+    """
+    global _dispatcher
+    if _dispatcher is None:
+        client = get_client()
+        with _lock:
+            if _dispatcher is None:
+                _dispatcher = LLMDispatcher(client)
+    return _dispatcher
@@ -0,0 +1,232 @@
+import contextvars
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# Set METRICS_ENABLED=0 to turn every hook into a no-op
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', '1') != '0'
+
+# Upper bounds in seconds; from a regex pass (~1 ms) to a slow LLM call (~1 min)
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_PREFIXO = 'leitor_nf_'
+
+# Stage timings of the current request, for the Server-Timing header.
+# Stages that run on other threads (batch pool, job workers, LLM dispatcher)
+# are not in this list but still go into the histograms.
+_etapas_requisicao = contextvars.ContextVar('etapas_requisicao', default=None)
+
+
+class _Histograma:
+    __slots__ = ('contagens', 'soma', 'total')
+
+    def __init__(self):
+        self.contagens = [0] * len(BUCKETS)
+        self.soma = 0.0
+        self.total = 0
+
+
+class Metricas:
+    """
+    Counters, gauges and latency histograms in Prometheus text format.
+
+    Each observation is one lock acquisition and a few integer updates, cheap
+    enough to leave on in production. Values are per process: with several
+    gunicorn workers, each one reports its own.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._contadores = {}
+        self._gauges = {}
+        self._histogramas = {}
+        self._ajuda = {}
+
+    def contar(self, nome, valor=1, ajuda='', **labels):
+        chave = (nome, _labels(labels))
+        with self._lock:
+            self._ajuda.setdefault(nome, ('counter', ajuda))
+            self._contadores[chave] = self._contadores.get(chave, 0) + valor
+
+    def somar_gauge(self, nome, valor, ajuda='', **labels):
+        chave = (nome, _labels(labels))
+        with self._lock:
+            self._ajuda.setdefault(nome, ('gauge', ajuda))
+            self._gauges[chave] = self._gauges.get(chave, 0) + valor
+
+    def observar(self, nome, segundos, ajuda='', **labels):
+        chave = (nome, _labels(labels))
+        indice = bisect_left(BUCKETS, segundos)
+        with self._lock:
+            self._ajuda.setdefault(nome, ('histogram', ajuda))
+            histograma = self._histogramas.get(chave)
+            if histograma is None:
+                histograma = self._histogramas[chave] = _Histograma()
+            if indice < len(BUCKETS):
+                histograma.contagens[indice] += 1
+            histograma.soma += segundos
+            histograma.total += 1
+
+    def valor(self, nome, **labels):
+        """
+        Current value of a counter or gauge (0 if never touched).
+        """
+        chave = (nome, _labels(labels))
+        with self._lock:
+            return self._contadores.get(chave, self._gauges.get(chave, 0))
+
+    def exportar(self):
+        """
+        Renders every metric in the Prometheus text exposition format.
+        """
+        with self._lock:
+            contadores = sorted(self._contadores.items())
+            gauges = sorted(self._gauges.items())
+            histogramas = sorted(
+                (chave, (list(h.contagens), h.soma, h.total)) for chave, h in self._histogramas.items()
+            )
+            ajuda = dict(self._ajuda)
+
+        linhas = []
+        vistos = set()
+
+        def _cabecalho(nome):
+            if nome not in vistos:
+                vistos.add(nome)
+                tipo, texto = ajuda[nome]
+                if texto:
+                    linhas.append(f'# HELP {_PREFIXO}{nome} {texto}')
+                linhas.append(f'# TYPE {_PREFIXO}{nome} {tipo}')
+
+        for (nome, labels), valor in contadores + gauges:
+            _cabecalho(nome)
+            linhas.append(f'{_PREFIXO}{nome}{_formatar(labels)} {valor}')
+
+        for (nome, labels), (contagens, soma, total) in histogramas:
+            _cabecalho(nome)
+            acumulado = 0
+            for limite, contagem in zip(BUCKETS, contagens):
+                acumulado += contagem
+                linhas.append(f'{_PREFIXO}{nome}_bucket{_formatar(labels + (("le", repr(limite)),))} {acumulado}')
+            linhas.append(f'{_PREFIXO}{nome}_bucket{_formatar(labels + (("le", "+Inf"),))} {total}')
+            linhas.append(f'{_PREFIXO}{nome}_sum{_formatar(labels)} {soma}')
+            linhas.append(f'{_PREFIXO}{nome}_count{_formatar(labels)} {total}')
+
+        return '\n'.join(linhas) + '\n'
+
+    def clear(self):
+        with self._lock:
+            self._contadores.clear()
+            self._gauges.clear()
+            self._histogramas.clear()
+
+
+def _labels(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _formatar(labels):
+    if not labels:
+        return ''
+    pares = ','.join(
+        '{}="{}"'.format(k, v.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for k, v in labels
+    )
+    return '{' + pares + '}'
+
+
+metricas = Metricas()
+
+
+@contextmanager
+def etapa(nome):
+    """
+    Times one processing stage: `with etapa('pdf_texto'): ...`
+
+    The duration goes into the etapa_segundos histogram and, when called on a
+    request thread, into that request's Server-Timing header.
+    """
+    if not METRICS_ENABLED:
+        yield
+        return
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        duracao = time.perf_counter() - inicio
+        metricas.observar('etapa_segundos', duracao, 'Duração de cada etapa do processamento.', etapa=nome)
+        etapas = _etapas_requisicao.get()
+        if etapas is not None:
+            etapas.append((nome, duracao))
+
+
+def contar_extracao(metodo):
+    """
+    Counts how a PDF's fields were filled: scanner, llm or regex (fallback).
+    """
+    if METRICS_ENABLED:
+        metricas.contar('extracoes_total', ajuda='Extrações de PDF por método.', metodo=metodo)
+
+
+def contar_bytes(formato, quantidade):
+    if METRICS_ENABLED:
+        metricas.contar('bytes_processados_total', quantidade, 'Bytes de arquivos processados.', formato=formato)
+
+
+def registrar_erro(erro, etapa=''):
+    """
+    Counts an error by exception type (and stage, when known).
+    """
+    if METRICS_ENABLED:
+        metricas.contar('erros_total', ajuda='Erros por tipo.', tipo=type(erro).__name__, etapa=etapa)
+
+
+def iniciar_requisicao():
+    """
+    Starts collecting stage timings for the current request.
+    """
+    if METRICS_ENABLED:
+        metricas.somar_gauge('requisicoes_em_andamento', 1, 'Requisições sendo atendidas.')
+    return _etapas_requisicao.set([]), time.perf_counter()
+
+
+def finalizar_requisicao(contexto, rota, status, streaming=False):
+    """
+    Ends stage collection for the current request and returns its
+    Server-Timing header value.
+
+    A streamed body is produced after this runs, so with `streaming` no
+    header is returned and the latency is not recorded yet: call
+    registrar_requisicao() when the response is closed.
+    """
+    token, _ = contexto
+    etapas = _etapas_requisicao.get() or []
+    _etapas_requisicao.reset(token)
+    if streaming:
+        return None
+
+    duracao = registrar_requisicao(contexto, rota, status)
+    if not METRICS_ENABLED:
+        return None
+    totais = {}
+    for nome, segundos in etapas:
+        totais[nome] = totais.get(nome, 0.0) + segundos
+    partes = [f'{nome};dur={segundos * 1000:.1f}' for nome, segundos in totais.items()]
+    partes.append(f'total;dur={duracao * 1000:.1f}')
+    return ', '.join(partes)
+
+
+def registrar_requisicao(contexto, rota, status):
+    """
+    Records the request latency and takes it off requisicoes_em_andamento.
+
+    Returns:
+        float: Seconds since iniciar_requisicao().
+    """
+    duracao = time.perf_counter() - contexto[1]
+    if METRICS_ENABLED:
+        metricas.somar_gauge('requisicoes_em_andamento', -1)
+        metricas.observar('requisicao_segundos', duracao, 'Latência das requisições HTTP.', rota=rota, status=status)
+    return duracao
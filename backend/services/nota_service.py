@@ -0,0 +1,156 @@
+import hashlib
+import os
+import threading
+import time
+
+from services import llm_service, ocr_service, xml_service
+from services.cache_service import CACHE_DB_PATH, CACHE_ENABLED, ExtractionCache, hash_conteudo
+from services.metrics_service import contar_bytes, etapa
+from services.ocr_service import extract_text_pdf
+from services.xml_service import ler_lote_xml_nfe
+
+FORMATOS_SUPORTADOS = ('.pdf', '.xml')
+
+# A result is only cached when these are present, so partial results from the
+# regex fallback (e.g. after an LLM quota error) are retried on the next upload.
+CAMPOS_ESSENCIAIS = ('numeroNota', 'cnpj', 'valor')
+
+# Bump when the shape of cached entries changes
+FORMATO_CACHE = "2"
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def versao_extracao():
+    """
+    Version key for cached results. Changes whenever the model, the prompt or
+    one of the extractors changes, which invalidates every older entry.
+    """
+    partes = [
+        llm_service.MODEL_ID,
+        llm_service.PROMPT_TEMPLATE,
+        ocr_service.EXTRACTOR_VERSION,
+        xml_service.PARSER_VERSION,
+        FORMATO_CACHE,
+    ]
+    return hashlib.sha256('\x00'.join(partes).encode('utf-8')).hexdigest()[:16]
+
+
+def get_cache():
+    """
+    Returns the process-wide extraction cache (None when CACHE_ENABLED=0).
+    """
+    global _cache
+    if not CACHE_ENABLED:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ExtractionCache(CACHE_DB_PATH, versao_extracao())
+    return _cache
+
+
+def formato_suportado(filename):
+    """
+    Checks whether the file extension is one we know how to process.
+    """
+    return filename.lower().endswith(FORMATOS_SUPORTADOS)
+
+
+def processar_arquivo(filename, fonte):
+    """
+    Dispatches a single nota to the right extractor based on its extension.
+
+    An XML lot yields its first nota here, with 'notasNoArquivo' set to the
+    number of notas in the file; extrair_notas returns all of them.
+
+    Args:
+        filename (str): Original file name (used only to pick the format).
+        fonte (str | bytes | file): Path, raw bytes or seekable binary stream.
+
+    Returns:
+        dict: Extracted invoice data (empty when nothing could be read).
+
+    Raises:
+        ValueError: If the format is not supported.
+    """
+    notas = extrair_notas(filename, fonte)
+    if not notas:
+        return {}
+    data = notas[0]
+    if len(notas) > 1:
+        data = dict(data, notasNoArquivo=len(notas))
+    return data
+
+
+def extrair_notas(filename, fonte):
+    """
+    Extracts every nota in a file: one per infNFe of an XML (a lot may hold
+    many), one for a PDF.
+
+    Results are looked up by the hash of the file contents first, so a file
+    uploaded again skips PDF parsing and the LLM call entirely.
+
+    Returns:
+        list: Extracted invoice data, one dict per nota (empty when nothing
+            could be read).
+
+    Raises:
+        ValueError: If the format is not supported.
+    """
+    nome = filename.lower()
+    if nome.endswith('.pdf'):
+        formato, extrator = 'pdf', _extrair_pdf
+    elif nome.endswith('.xml'):
+        formato, extrator = 'xml', ler_lote_xml_nfe
+    else:
+        raise ValueError('Formato não suportado. Use PDF ou XML.')
+
+    contar_bytes(formato, _tamanho_fonte(fonte))
+
+    cache = get_cache()
+    if cache is None:
+        return extrator(fonte)
+
+    with etapa('cache'):
+        chave = f"{formato}:{hash_conteudo(fonte)}"
+        entrada = cache.get(chave)
+    if entrada is not None:
+        notas = entrada['notas']
+        for data in notas:
+            if 'extracaoPdf' in data:
+                # No page was read this time
+                data['extracaoPdf'] = dict(data['extracaoPdf'], paginasLidas=0, tempoMs=0.0, cache=True)
+        return notas
+
+    inicio = time.perf_counter()
+    notas = extrator(fonte)
+    if notas and all(data.get(campo) for data in notas for campo in CAMPOS_ESSENCIAIS):
+        cache.set(chave, {'notas': [_sem_medicoes(data) for data in notas]}, (time.perf_counter() - inicio) * 1000)
+    return notas
+
+
+def _sem_medicoes(data):
+    # Timings of this run must not be replayed as if measured on a cache hit
+    if 'extracaoPdf' not in data:
+        return data
+    extracao = {k: v for k, v in data['extracaoPdf'].items() if k not in ('paginasLidas', 'tempoMs')}
+    return dict(data, extracaoPdf=extracao)
+
+
+def _extrair_pdf(fonte):
+    data = extract_text_pdf(fonte)
+    return [data] if data else []
+
+
+def _tamanho_fonte(fonte):
+    if isinstance(fonte, (bytes, bytearray)):
+        return len(fonte)
+    if isinstance(fonte, str):
+        return os.path.getsize(fonte)
+    posicao = fonte.tell()
+    fonte.seek(0, os.SEEK_END)
+    tamanho = fonte.tell()
+    fonte.seek(posicao)
+    return tamanho
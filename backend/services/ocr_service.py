@@ -1,101 +1,263 @@
-﻿try:
-    import PyPDF2
-except ImportError:
-    PyPDF2 = None
-
-from google import genai
+﻿import io
 import re
 import os
-import json
-import httpx 
+import time
+
+from services.chave_service import CHAVE_RE, cnpj_valido, decodificar_chave
+from services.llm_service import get_dispatcher
+from services.metrics_service import contar_extracao, etapa, registrar_erro
+
+# Bump when the extraction logic changes, to invalidate cached results
+EXTRACTOR_VERSION = "3"
+
+# Below this confidence a locally extracted field is sent to the LLM
+LLM_CONFIDENCE_THRESHOLD = float(os.getenv("LLM_CONFIDENCE_THRESHOLD", 0.8))
+
+# dataVencimento is optional: many notas are paid on issue and have no duplicata
+CAMPOS_OBRIGATORIOS = ('numeroNota', 'cnpj', 'fornecedor', 'valor', 'dataEmissao')
+
+# One scanner for every field, so the text is walked only once
+_SCANNER_RE = re.compile(r"""
+      (?P<chave>(?<!\d)\d{4}(?:[ .]?\d{4}){10}(?!\d))
+    | (?P<cnpj>(?<!\d)\d{2}\.\d{3}\.\d{3}/\d{4}-\d{2}(?!\d))
+    | (?:(?:VALOR\s+|VLR\.?\s*)?TOTAL\s+DA\s+NOTA|VALOR\s+TOTAL(?!\s+D[OE]S?\b)|VLR\.\s*TOTAL(?!\s+D[OE]S?\b))
+      (?P<valor_sep>\D{0,80}?)(?P<valor>\d{1,3}(?:\.\d{3})*,\d{2})
+    | (?:DATA|DT\.?)\s*(?:D[AE]\s+)?EMISS[ÃA]O
+      (?P<emissao_sep>\D{0,80}?)(?P<emissao>\d{2}/\d{2}/\d{4})
+    | VENC(?:IMENTO|TO)?\.?
+      (?P<vencimento_sep>\D{0,80}?)(?P<vencimento>\d{2}/\d{2}/\d{4})
+    | RECEBEMOS\s+DE\s+(?P<fornecedor>[^\n]{2,120}?)\s+OS\s+PRODUTOS
+    | (?<!\w)(?:N[ºO°]|N\.)\s*(?P<numero>\d{1,3}(?:\.\d{3}){1,2}|\d{1,9})(?!\d)
+""", re.IGNORECASE | re.VERBOSE)
+
+# Only the beginning of the text goes into the prompt
+PROMPT_TEXT_LIMIT = 5000
+
+# Page cap for text extraction (0 = no cap)
+PDF_MAX_PAGES = int(os.getenv("PDF_MAX_PAGES", 10))
+
+# Totals block of a DANFE; with the chave de acesso (header) it marks the
+# point where the rest of the document is only items and annexes
+_TOTAIS_RE = re.compile(r'(?:VALOR\s+)?TOTAL\s+DA\s+NOTA', re.IGNORECASE)
 
-def extract_text_pdf(pdf_path):
+def extract_text_pdf(pdf_source):
     """
-    Extracts text from PDF and uses Google Gemini (New SDK) to parse invoice data.
+    Extracts text from PDF and parses invoice data, calling Google Gemini only
+    for fields the local scanner could not extract with confidence.
+
+    Args:
+        pdf_source (str | bytes | file): Path, raw bytes or binary file-like object.
     """
     # 1. Extract raw text
-    full_text = ""
     try:
-        if not PyPDF2:
-             raise ImportError("PyPDF2 não instalado")
-
-        with open(pdf_path, 'rb') as f:
-            pdf_reader = PyPDF2.PdfReader(f)
-            for page in pdf_reader.pages:
-                text = page.extract_text()
-                if text:
-                    full_text += text + "\n"
+        with etapa('pdf_texto'):
+            full_text, info = extrair_texto_pdf(pdf_source)
     except Exception as e:
+        registrar_erro(e, 'pdf_texto')
         print(f"Erro na extração de texto bruto: {e}")
         return {}
 
-    # 2. Use Google Gemini to understand the invoice
+    # 2. Cheap local extraction first, the model only for what is still missing
+    data = extrair_dados_texto(full_text)
+    data['extracaoPdf'] = info
+    return data
+
+def extrair_texto_pdf(pdf_source, max_paginas=PDF_MAX_PAGES):
+    """
+    Extracts the raw text of a PDF, reading only as many pages as needed.
+
+    Pages are read in order and extraction stops as soon as there is enough
+    text for the prompt, or once both the header (chave de acesso) and the
+    totals block have been seen.
+
+    Args:
+        pdf_source (str | bytes | file): Path, raw bytes or binary file-like object.
+        max_paginas (int): Page cap (0 = no cap).
+
+    Returns:
+        tuple: (text, info) where info has paginasLidas, paginasTotal and tempoMs.
+    """
+    PyPDF2 = _pypdf2()
+
+    inicio = time.perf_counter()
+    if isinstance(pdf_source, (bytes, bytearray)):
+        pdf_source = io.BytesIO(pdf_source)
+
+    pdf_reader = PyPDF2.PdfReader(pdf_source)
+    total = len(pdf_reader.pages)
+    limite = min(total, max_paginas) if max_paginas else total
+
+    partes = []
+    tamanho = 0
+    cabecalho = totais = False
+    lidas = 0
+    for pagina in range(limite):
+        text = pdf_reader.pages[pagina].extract_text()
+        lidas += 1
+        if text:
+            partes.append(text)
+            tamanho += len(text)
+            cabecalho = cabecalho or CHAVE_RE.search(text) is not None
+            totais = totais or _TOTAIS_RE.search(text) is not None
+        if tamanho >= PROMPT_TEXT_LIMIT or (cabecalho and totais):
+            break
+
+    info = {
+        'paginasLidas': lidas,
+        'paginasTotal': total,
+        'tempoMs': round((time.perf_counter() - inicio) * 1000, 1),
+    }
+    return ''.join(text + "\n" for text in partes if text), info
+
+def _pypdf2():
+    # Imported on the first PDF, so XML-only processes never load it
     try:
-        api_key = os.getenv("GOOGLE_API_KEY")
-        if not api_key:
-             raise ValueError("API Key do Google não encontrada no arquivo .env (GOOGLE_API_KEY)")
-             
-        client = genai.Client(api_key=api_key)
-        
-        # Using Gemma 2 (9B parameters) via Google AI Studio API
-        # Model ID: "gemini-2.0-flash" (or "gemma-2-9b-it" if explicitly available in your region)
-        # Note: As of now, Google AI Studio exposes Gemini models primarily. 
-        # However, if Gemma is available to your API key, you can try "gemma-2-9b-it".
-        # If that fails, we can fallback to "gemini-2.0-flash" which is very high limit.
-        # Let's try to set it to a model name that represents the user intent or a very cost-effective one.
-        
-        # User requested Gemma. In Google AI Studio, Gemma models are often accessed as "gemma-2-9b-it" 
-        # or similar. If this specific string fails, we might need to revert to "gemini-1.5-flash" 
-        # which has a massive free tier.
-        
-        model_id = "gemma-3-12b-it" # Using efficient Flash model as proxy for high-limit request
-        # If you confirm you have access to "gemma-2-9b-it" specifically, change the line below:
-        # model_id = "gemma-2-9b-it"
+        import PyPDF2
+    except ImportError:
+        raise ImportError("PyPDF2 não instalado") from None
+    return PyPDF2
 
-        prompt = f"""
-        Você é um assistente especializado em contabilidade. Analise o texto desta Nota Fiscal e extraia os seguintes dados em formato JSON.
-        
-        Texto da Nota:
-        {full_text[:5000]}  # Increase limit slightly
-
-        Retorne APENAS um JSON válido com esta estrutura exata. Não use Markdown (```json).:
-        {{
-            "numeroNota": "string (apenas números)",
-            "cnpj": "string (XX.XXX.XXX/YYYY-ZZ)",
-            "fornecedor": "string (Nome da Razão Social)",
-            "valor": 0.00 (float, use ponto para decimais),
-            "dataEmissao": "YYYY-MM-DD",
-            "dataVencimento": "YYYY-MM-DD"
-        }}
-        """
-
-        # Usando o modelo configurado acima (Gemma ou Gemini Flash)
-        # Atenção: Se usar o Gemma, pode ser necessário ajustar o nome exato do modelo 'gemma-2-9b-it'
-        response = client.models.generate_content(
-            model='gemma-3-12b-it',  # Tente "gemma-2-9b-it" se disponível, ou "gemini-2.0-flash" como fallback
-            contents=prompt
-        )
-        
-        if not response.text:
-            raise ValueError("Resposta da IA vazia")
+def extrair_dados_texto(full_text):
+    """
+    Tiered extraction over the raw text of a nota.
 
-        content = response.text.strip()
-        
-        # Clean potential markdown code blocks
-        if content.startswith("```json"):
-            content = content[7:]
-        elif content.startswith("```"):
-            content = content[3:]
-        if content.endswith("```"):
-            content = content[:-3]
-            
-        data = json.loads(content)
+    The local scanner runs first; the LLM is called only when a required field
+    is missing or below LLM_CONFIDENCE_THRESHOLD, and then only fills those
+    fields. If the LLM fails, the regex fallback fills what it can.
+    """
+    with etapa('scanner'):
+        campos = extrair_campos_rapido(full_text)
+    data = {campo: valor for campo, (valor, _) in campos.items()}
+
+    def _confiavel(campo):
+        return campo in campos and campos[campo][1] >= LLM_CONFIDENCE_THRESHOLD
+
+    if all(_confiavel(campo) for campo in CAMPOS_OBRIGATORIOS):
+        contar_extracao('scanner')
         return data
 
+    try:
+        with etapa('llm'):
+            llm_data = _extrair_com_llm(full_text)
     except Exception as e:
+        registrar_erro(e, 'llm')
+        contar_extracao('regex')
         print(f"Erro na IA (Google Gemini): {e}")
         print("Tentando fallback para regex básico...")
-        return parse_invoice_text(full_text)
+        with etapa('fallback'):
+            for campo, valor in parse_invoice_text(full_text).items():
+                data.setdefault(campo, valor)
+        return data
+
+    contar_extracao('llm')
+
+    for campo, valor in llm_data.items():
+        if valor in (None, '') or _confiavel(campo):
+            continue
+        data[campo] = valor
+    return data
+
+def _extrair_com_llm(full_text):
+    """
+    Asks the shared LLM dispatcher (batched, rate limited) to parse the
+    invoice. Raises on any failure.
+    """
+    return get_dispatcher().extrair(full_text[:PROMPT_TEXT_LIMIT])
+
+def _sem_ruido(separador):
+    # True when only a colon, "R$" or whitespace sits between a label and its value
+    return not separador.replace('R$', '').replace(':', '').strip()
+
+def _confianca_rotulo(match, grupo, confianca):
+    """
+    `confianca` when the value follows its label directly, else 0.5.
+
+    A value on a later line counts only if it is alone on that line. In DANFE
+    tax blocks the labels share one row and the values the next, so the first
+    amount below "VALOR TOTAL DA NOTA" is usually another column's.
+    """
+    separador = match.group(f'{grupo}_sep')
+    if not _sem_ruido(separador):
+        return 0.5
+    if '\n' in separador:
+        texto = match.string
+        inicio = texto.rfind('\n', 0, match.start(grupo)) + 1
+        fim = texto.find('\n', match.end(grupo))
+        linha = texto[inicio:fim if fim >= 0 else len(texto)]
+        if not _sem_ruido(linha.replace(match.group(grupo), '', 1)):
+            return 0.5
+    return confianca
+
+def _data_iso(d_str):
+    d, m, y = d_str.split('/')
+    return f"{y}-{m}-{d}"
+
+def extrair_campos_rapido(text):
+    """
+    Single pass over the text with one precompiled scanner.
+
+    Returns:
+        dict: campo -> (valor, confianca), confianca in [0, 1]. The access key,
+        when present and valid, anchors numeroNota, cnpj and the emission month.
+    """
+    achados = {}
+    chave = None
+    for match in _SCANNER_RE.finditer(text or ''):
+        tipo = match.lastgroup
+        if tipo == 'chave':
+            if chave is None:
+                chave = decodificar_chave(match.group('chave'))
+        elif tipo not in achados:
+            achados[tipo] = match
+
+    campos = {}
+    if chave:
+        campos['chaveAcesso'] = (chave['chaveAcesso'], 1.0)
+        campos['numeroNota'] = (chave['numeroNota'], 0.99)
+        campos['cnpj'] = (chave['cnpj'], 0.99)
+
+    if 'numero' in achados and 'numeroNota' not in campos:
+        raw_num = achados['numero'].group('numero').replace('.', '')
+        campos['numeroNota'] = (raw_num.lstrip('0') or raw_num, 0.6)
+
+    if 'cnpj' in achados and 'cnpj' not in campos:
+        cnpj = achados['cnpj'].group('cnpj')
+        # The first CNPJ is usually the emitter's, but it may be the recipient's
+        campos['cnpj'] = (cnpj, 0.75 if cnpj_valido(cnpj) else 0.4)
+
+    if 'fornecedor' in achados:
+        campos['fornecedor'] = (achados['fornecedor'].group('fornecedor').strip(), 0.85)
+
+    if 'valor' in achados:
+        match = achados['valor']
+        try:
+            valor = float(match.group('valor').replace('.', '').replace(',', '.'))
+            campos['valor'] = (valor, _confianca_rotulo(match, 'valor', 0.9))
+        except ValueError:
+            pass
+
+    if 'emissao' in achados:
+        match = achados['emissao']
+        try:
+            emissao = _data_iso(match.group('emissao'))
+            confianca = _confianca_rotulo(match, 'emissao', 0.85)
+            if chave:
+                confianca = 0.95 if emissao[:7] == chave['anoMes'] else 0.4
+            campos['dataEmissao'] = (emissao, confianca)
+        except ValueError:
+            pass
+
+    if 'vencimento' in achados:
+        match = achados['vencimento']
+        try:
+            campos['dataVencimento'] = (
+                _data_iso(match.group('vencimento')),
+                _confianca_rotulo(match, 'vencimento', 0.85)
+            )
+        except ValueError:
+            pass
+
+    return campos
 
 def parse_invoice_text(text):
     """
@@ -0,0 +1,113 @@
+import importlib
+import os
+import sys
+import threading
+import time
+
+# Set WARMUP_ENABLED=0 to skip the warm-up and build everything on first use
+WARMUP_ENABLED = os.getenv('WARMUP_ENABLED', '1') != '0'
+
+# Loaded on first use by the services that need them (PDF, LLM, webhooks,
+# XLSX export); together they are most of a cold import
+DEPENDENCIAS_PESADAS = ('httpx', 'PyPDF2', 'google.genai', 'google.genai.types', 'openpyxl')
+
+# Module -> (lazy singletons, lock guarding them)
+_SINGLETONS = {
+    'services.llm_service': (('_client', '_dispatcher'), '_lock'),
+    'services.nota_service': (('_cache',), '_cache_lock'),
+    'services.invoice_store': (('_store',), '_store_lock'),
+    'services.job_service': (('_fila',), '_fila_lock'),
+    'services.webhook_service': (('_dispatcher',), '_dispatcher_lock'),
+}
+
+_inicio = time.time()
+_aquecido = threading.Event()
+
+
+def precarregar_dependencias():
+    """
+    Imports DEPENDENCIAS_PESADAS, skipping any that are not installed.
+
+    Returns:
+        float: Seconds spent.
+    """
+    inicio = time.perf_counter()
+    for modulo in DEPENDENCIAS_PESADAS:
+        try:
+            importlib.import_module(modulo)
+        except ImportError as e:
+            print(f"Aquecimento: {modulo} indisponível ({e})")
+    return time.perf_counter() - inicio
+
+
+def reiniciar_apos_fork():
+    """
+    Drops the singletons a forked worker inherited from its parent.
+
+    Clients, connection pools, SQLite handles and worker threads must not be
+    shared across processes (threads do not even survive the fork), so each
+    worker builds its own. Locks are replaced too, in case one was held when
+    the parent forked.
+    """
+    global _inicio
+    _inicio = time.time()
+    _aquecido.clear()
+    for nome, (atributos, lock) in _SINGLETONS.items():
+        modulo = sys.modules.get(nome)
+        if modulo is None:
+            continue
+        for atributo in atributos:
+            setattr(modulo, atributo, None)
+        setattr(modulo, lock, threading.Lock())
+
+
+def aquecer():
+    """
+    Loads the heavy dependencies and creates the process-wide clients:
+    extraction cache, invoice store, job queue, webhook dispatcher and, when
+    GOOGLE_API_KEY is set, the LLM client. A failure is logged and left for
+    the first request that needs that service to report.
+    """
+    from services import invoice_store, job_service, llm_service, nota_service, webhook_service
+
+    inicio = time.perf_counter()
+    importacao = precarregar_dependencias()
+    servicos = [
+        nota_service.get_cache,
+        invoice_store.get_invoice_store,
+        job_service.get_fila,
+        webhook_service.get_webhook_dispatcher,
+    ]
+    if os.getenv('GOOGLE_API_KEY'):
+        servicos.append(llm_service.get_dispatcher)
+    for servico in servicos:
+        try:
+            servico()
+        except Exception as e:
+            print(f"Aquecimento: {servico.__name__} falhou ({e})")
+
+    _aquecido.set()
+    print(f"Worker {os.getpid()} aquecido em {time.perf_counter() - inicio:.2f}s "
+          f"(dependências: {importacao:.2f}s)")
+
+
+def aquecer_em_segundo_plano():
+    """
+    Runs aquecer() on a daemon thread, so the worker starts serving right away:
+    an XML request does not wait for google.genai to load.
+    """
+    thread = threading.Thread(target=aquecer, name='aquecimento', daemon=True)
+    thread.start()
+    return thread
+
+
+def estado():
+    """
+    Readiness of this process, for /healthz.
+    """
+    return {
+        'status': 'ok',
+        'aquecido': _aquecido.is_set(),
+        'pid': os.getpid(),
+        'uptimeSegundos': round(time.time() - _inicio, 1),
+    }
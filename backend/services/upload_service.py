@@ -0,0 +1,71 @@
+import io
+import os
+import tempfile
+
+# Uploads up to this size stay in memory; larger ones spill to an anonymous
+# temp file (unique per upload, deleted on close)
+UPLOAD_SPOOL_BYTES = int(os.getenv('UPLOAD_SPOOL_KB', 1024)) * 1024
+
+# Limit for a single nota (/api/ler-nota, /api/jobs, and each file inside a lot)
+MAX_UPLOAD_BYTES = int(float(os.getenv('MAX_UPLOAD_MB', 20)) * 1024 * 1024)
+
+# Limit for a whole request to the batch endpoint
+MAX_BATCH_UPLOAD_BYTES = int(float(os.getenv('MAX_BATCH_UPLOAD_MB', 500)) * 1024 * 1024)
+
+_CHUNK = 64 * 1024
+
+
+class ArquivoMuitoGrandeError(ValueError):
+    pass
+
+
+def novo_buffer():
+    """
+    Returns an empty spooled buffer (memory first, temp file above the threshold).
+    """
+    return tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_BYTES)
+
+
+def tamanho_stream(stream):
+    """
+    Size of a seekable stream, left rewound.
+    """
+    stream.seek(0, os.SEEK_END)
+    tamanho = stream.tell()
+    stream.seek(0)
+    return tamanho
+
+
+def desanexar_stream(file):
+    """
+    Takes a FileStorage's stream over from the request; the caller must close
+    it. Flask closes a request's files as soon as the view returns, before a
+    streamed response is produced; it then closes an empty placeholder.
+    """
+    stream = file.stream
+    file.stream = io.BytesIO()
+    return stream
+
+
+def copiar_para_buffer(stream, limite=MAX_UPLOAD_BYTES):
+    """
+    Copies a stream into a new spooled buffer, rewound and ready to read.
+
+    Raises:
+        ArquivoMuitoGrandeError: As soon as more than `limite` bytes are read.
+    """
+    buffer = novo_buffer()
+    total = 0
+    while True:
+        chunk = stream.read(_CHUNK)
+        if not chunk:
+            break
+        total += len(chunk)
+        if total > limite:
+            buffer.close()
+            raise ArquivoMuitoGrandeError(
+                f'Arquivo excede o limite de {limite // (1024 * 1024)} MB.'
+            )
+        buffer.write(chunk)
+    buffer.seek(0)
+    return buffer
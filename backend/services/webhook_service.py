@@ -0,0 +1,339 @@
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+import uuid
+from urllib.parse import urlsplit
+
+from services.cache_service import DATA_DIR
+from services.metrics_service import registrar_erro
+
+WEBHOOK_DB_PATH = os.getenv('WEBHOOK_DB_PATH', os.path.join(DATA_DIR, 'webhook.sqlite3'))
+WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', 4))
+# 1 = one nota per POST (what the Power Automate flow expects today);
+# above 1, notas for the same URL are sent together as {"notas": [...]}
+WEBHOOK_BATCH_SIZE = int(os.getenv('WEBHOOK_BATCH_SIZE', 1))
+WEBHOOK_MAX_RETRIES = int(os.getenv('WEBHOOK_MAX_RETRIES', 6))
+WEBHOOK_TIMEOUT_SECONDS = float(os.getenv('WEBHOOK_TIMEOUT_SECONDS', 30))
+WEBHOOK_BACKOFF_SECONDS = float(os.getenv('WEBHOOK_BACKOFF_SECONDS', 2))
+_BACKOFF_MAX_SECONDS = 600
+
+# Hosts the server may POST to, comma-separated; an entry also matches its
+# subdomains. Defaults to Power Automate / Logic Apps trigger hosts. Only
+# HTTPS is allowed, unless an entry is written as http://host (local tests).
+WEBHOOK_ALLOWED_HOSTS = tuple(
+    host.strip().lower()
+    for host in os.getenv('WEBHOOK_ALLOWED_HOSTS', 'logic.azure.com,api.powerplatform.com').split(',')
+    if host.strip()
+)
+
+_POLL_SECONDS = 1.0
+
+STATUS_PENDENTE = 'pendente'
+STATUS_ENVIANDO = 'enviando'
+STATUS_ENTREGUE = 'entregue'
+STATUS_FALHA = 'falha'  # dead letter
+
+
+class WebhookUrlNaoPermitidaError(ValueError):
+    """
+    Raised when a webhook URL is not HTTPS or its host is not allowed.
+    """
+
+
+def url_permitida(url, hosts=WEBHOOK_ALLOWED_HOSTS):
+    """
+    Checks a webhook URL against the host allowlist, so the outbox cannot be
+    used to make the server POST to arbitrary (or internal) addresses.
+    """
+    try:
+        partes = urlsplit(url or '')
+        host = (partes.hostname or '').lower()
+    except ValueError:
+        return False
+    if not host or partes.username or partes.password:
+        return False
+    for permitido in hosts:
+        esquemas = ('https',)
+        if permitido.startswith('http://'):
+            permitido = permitido[len('http://'):]
+            esquemas = ('https', 'http')
+        if partes.scheme in esquemas and (host == permitido or host.endswith('.' + permitido)):
+            return True
+    return False
+
+
+class WebhookDispatcher:
+    """
+    Server-side outbox for webhook deliveries (Power Automate).
+
+    Every nota is stored in SQLite before it is sent, so deliveries survive
+    restarts and do not depend on the browser tab. Worker threads share one
+    pooled httpx client. Failures are retried with exponential backoff and
+    jitter; after `max_retries`, or on a non-retryable 4xx, the delivery moves
+    to the dead-letter state, from where it can be replayed.
+    """
+
+    def __init__(self, db_path, client=None, workers=WEBHOOK_WORKERS, batch_size=WEBHOOK_BATCH_SIZE,
+                 max_retries=WEBHOOK_MAX_RETRIES, backoff_seconds=WEBHOOK_BACKOFF_SECONDS,
+                 timeout=WEBHOOK_TIMEOUT_SECONDS, hosts_permitidos=WEBHOOK_ALLOWED_HOSTS):
+        self.workers = workers
+        self.hosts_permitidos = hosts_permitidos
+        self.batch_size = max(1, batch_size)
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.timeout = timeout
+        if client is None:
+            import httpx
+            client = httpx.Client(
+                timeout=timeout,
+                limits=httpx.Limits(max_connections=workers * 2, max_keepalive_connections=workers),
+            )
+        self.client = client
+
+        self._lock = threading.Lock()
+        self._mudou = threading.Condition()
+        self._parar = threading.Event()
+        self._threads = []
+
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS entregas (
+                id TEXT PRIMARY KEY,
+                webhook_url TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL,
+                tentativas INTEGER NOT NULL DEFAULT 0,
+                proxima_tentativa REAL NOT NULL,
+                lease_ate REAL,
+                erro TEXT,
+                criado_em REAL NOT NULL,
+                entregue_em REAL
+            )
+        """)
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_entregas_fila ON entregas (status, proxima_tentativa)')
+
+    # --- Producer side ---
+
+    def enfileirar(self, webhook_url, notas):
+        """
+        Stores one delivery per nota and wakes the workers.
+
+        Returns:
+            list: IDs of the new deliveries, in the same order as `notas`.
+
+        Raises:
+            WebhookUrlNaoPermitidaError: If `webhook_url` fails url_permitida.
+        """
+        if not url_permitida(webhook_url, self.hosts_permitidos):
+            raise WebhookUrlNaoPermitidaError('webhookUrl não permitida')
+        agora = time.time()
+        ids = [uuid.uuid4().hex for _ in notas]
+        with self._lock:
+            self._conn.execute('BEGIN')
+            self._conn.executemany(
+                'INSERT INTO entregas (id, webhook_url, payload, status, proxima_tentativa, criado_em) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                [(i, webhook_url, json.dumps(nota, ensure_ascii=False), STATUS_PENDENTE, agora, agora)
+                 for i, nota in zip(ids, notas)]
+            )
+            self._conn.execute('COMMIT')
+        self._notificar()
+        return ids
+
+    def get(self, entrega_id):
+        with self._lock:
+            row = self._conn.execute('SELECT * FROM entregas WHERE id = ?', (entrega_id,)).fetchone()
+        return _entrega_publica(row) if row else None
+
+    def dead_letter(self, limite=100):
+        """
+        Returns the deliveries that gave up, most recent first.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT * FROM entregas WHERE status = ? ORDER BY criado_em DESC LIMIT ?',
+                (STATUS_FALHA, limite)
+            ).fetchall()
+        return [_entrega_publica(row) for row in rows]
+
+    def reenviar(self, ids=None):
+        """
+        Moves dead-letter deliveries (all, or only `ids`) back to the queue.
+
+        Returns:
+            int: Number of deliveries requeued.
+        """
+        agora = time.time()
+        with self._lock:
+            if ids:
+                marcadores = ','.join('?' * len(ids))
+                cursor = self._conn.execute(
+                    f'UPDATE entregas SET status = ?, tentativas = 0, proxima_tentativa = ?, erro = NULL '
+                    f'WHERE status = ? AND id IN ({marcadores})',
+                    (STATUS_PENDENTE, agora, STATUS_FALHA, *ids)
+                )
+            else:
+                cursor = self._conn.execute(
+                    'UPDATE entregas SET status = ?, tentativas = 0, proxima_tentativa = ?, erro = NULL '
+                    'WHERE status = ?',
+                    (STATUS_PENDENTE, agora, STATUS_FALHA)
+                )
+        self._notificar()
+        return cursor.rowcount
+
+    def aguardar(self, timeout):
+        with self._mudou:
+            self._mudou.wait(timeout)
+
+    # --- Worker side ---
+
+    def start(self):
+        if self._threads:
+            return
+        self._parar.clear()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f'webhook-worker-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        self._parar.set()
+        self._notificar()
+        for thread in self._threads:
+            thread.join(timeout=5)
+        self._threads = []
+
+    def _worker(self):
+        while not self._parar.is_set():
+            try:
+                lote = self._reivindicar()
+                if lote:
+                    self._entregar(lote)
+                    continue
+            except Exception as e:
+                # e.g. the SQLite lock timed out: keep the thread alive; claimed
+                # deliveries come back when their lease expires
+                registrar_erro(e, 'webhook_worker')
+                print(f"Webhook: erro no worker ({type(e).__name__}: {e})")
+            with self._mudou:
+                self._mudou.wait(_POLL_SECONDS)
+
+    def _reivindicar(self):
+        agora = time.time()
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                primeira = self._conn.execute(
+                    'SELECT * FROM entregas WHERE (status = ? AND proxima_tentativa <= ?) '
+                    'OR (status = ? AND lease_ate < ?) ORDER BY proxima_tentativa LIMIT 1',
+                    (STATUS_PENDENTE, agora, STATUS_ENVIANDO, agora)
+                ).fetchone()
+                if primeira is None:
+                    self._conn.execute('COMMIT')
+                    return []
+
+                lote = [primeira]
+                if self.batch_size > 1:
+                    lote += self._conn.execute(
+                        'SELECT * FROM entregas WHERE status = ? AND proxima_tentativa <= ? '
+                        'AND webhook_url = ? AND id != ? ORDER BY proxima_tentativa LIMIT ?',
+                        (STATUS_PENDENTE, agora, primeira['webhook_url'], primeira['id'], self.batch_size - 1)
+                    ).fetchall()
+
+                self._conn.executemany(
+                    'UPDATE entregas SET status = ?, tentativas = tentativas + 1, lease_ate = ? WHERE id = ?',
+                    [(STATUS_ENVIANDO, agora + self.timeout * 2, row['id']) for row in lote]
+                )
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+        return lote
+
+    def _entregar(self, lote):
+        import httpx
+
+        notas = [json.loads(row['payload']) for row in lote]
+        corpo = notas[0] if self.batch_size == 1 else {'notas': notas}
+
+        erro = None
+        retentavel = True
+        try:
+            if not url_permitida(lote[0]['webhook_url'], self.hosts_permitidos):
+                # Queued before the allowlist changed
+                erro, retentavel = 'webhookUrl não permitida', False
+            else:
+                response = self.client.post(lote[0]['webhook_url'], json=corpo)
+                if response.status_code >= 400:
+                    erro = f'HTTP {response.status_code}: {response.text[:200]}'
+                    retentavel = response.status_code == 429 or response.status_code >= 500
+        except httpx.HTTPError as e:
+            erro = f'{type(e).__name__}: {e}'
+
+        agora = time.time()
+        with self._lock:
+            self._conn.execute('BEGIN')
+            for row in lote:
+                tentativas = row['tentativas'] + 1
+                if erro is None:
+                    self._conn.execute(
+                        'UPDATE entregas SET status = ?, lease_ate = NULL, erro = NULL, entregue_em = ? WHERE id = ?',
+                        (STATUS_ENTREGUE, agora, row['id'])
+                    )
+                elif not retentavel or tentativas > self.max_retries:
+                    print(f"Webhook: entrega {row['id']} movida para dead-letter ({erro})")
+                    self._conn.execute(
+                        'UPDATE entregas SET status = ?, lease_ate = NULL, erro = ? WHERE id = ?',
+                        (STATUS_FALHA, erro, row['id'])
+                    )
+                else:
+                    espera = random.uniform(0, min(_BACKOFF_MAX_SECONDS, self.backoff_seconds * 2 ** (tentativas - 1)))
+                    self._conn.execute(
+                        'UPDATE entregas SET status = ?, lease_ate = NULL, erro = ?, proxima_tentativa = ? WHERE id = ?',
+                        (STATUS_PENDENTE, erro, agora + espera, row['id'])
+                    )
+            self._conn.execute('COMMIT')
+        self._notificar()
+
+    def _notificar(self):
+        with self._mudou:
+            self._mudou.notify_all()
+
+
+def _entrega_publica(row):
+    # The URL itself is never shown: Power Automate URLs carry their secret
+    # (sig=) in the query string
+    return {
+        'id': row['id'],
+        'webhookHost': urlsplit(row['webhook_url']).hostname,
+        'nota': json.loads(row['payload']),
+        'status': row['status'],
+        'tentativas': row['tentativas'],
+        'erro': row['erro'],
+        'criadoEm': row['criado_em'],
+        'entregueEm': row['entregue_em'],
+    }
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_webhook_dispatcher():
+    """
+    Returns the process-wide webhook dispatcher, starting its workers on first use.
+    """
+    global _dispatcher
+    if _dispatcher is None:
+        with _dispatcher_lock:
+            if _dispatcher is None:
+                dispatcher = WebhookDispatcher(WEBHOOK_DB_PATH)
+                dispatcher.start()
+                _dispatcher = dispatcher
+    return _dispatcher
@@ -1,79 +1,140 @@
+import io
 import xml.etree.ElementTree as ET
 
-def ler_xml_nfe(xml_path):
+from services.metrics_service import etapa, registrar_erro
+
+# Bump when the parsing logic changes, to invalidate cached results
+PARSER_VERSION = "2"
+
+NFE_NS = '{http://www.portalfiscal.inf.br/nfe}'
+
+# Blocks handled on their end event. Both namespaced and bare tags are mapped,
+# so tags are matched as they come from the parser, with no renaming pass.
+_BLOCOS = {}
+for _nome in ('infNFe', 'ide', 'emit', 'total', 'cobr', 'det'):
+    _BLOCOS[NFE_NS + _nome] = _nome
+    _BLOCOS[_nome] = _nome
+
+
+def _texto(elem, tag):
+    filho = elem.find(tag)
+    if filho is None:
+        return None
+    return (filho.text or '').strip()
+
+
+def iter_xml_nfe(xml_source):
     """
-    Parses an NFe XML file and extracts relevant information.
-    
+    Streams an NFe XML and yields one record per infNFe found.
+
+    Works on single NFe, nfeProc and lot files (enviNFe or any wrapper with
+    several NFe), with or without the portalfiscal namespace. Only end events
+    are handled and finished subtrees are cleared as we go, so memory stays
+    flat no matter how many det items the file has.
+
     Args:
-        xml_path (str): Path to the XML file.
-        
-    Returns:
-        dict: Extracted invoice data.
+        xml_source (str | bytes | file): Path, raw bytes or binary file-like object.
+
+    Yields:
+        dict: Extracted invoice data, including every duplicata in 'duplicatas'.
     """
-    try:
-        tree = ET.parse(xml_path)
-        root = tree.getroot()
-        
-        # XML namespace handling
-        # NFe usually has a namespace like {http://www.portalfiscal.inf.br/nfe}
-        ns = {'nfe': 'http://www.portalfiscal.inf.br/nfe'}
-        
-        # Helper to find text with namespace
-        def find_text(path):
-            # Try with namespace first
-            element = root.find(path, ns)
-            if element is not None:
-                return element.text
-            # Fallback: try without namespace (if user removed it or different version)
-            # This is tricky with ElementTree. We might need to strip namespaces.
-            return None
-
-        # Alternative: Strip namespaces for easier parsing
-        for elem in root.iter():
-            if '}' in elem.tag:
-                elem.tag = elem.tag.split('}', 1)[1]
-        
-        # Now we can search without namespace prefix
-        # Structure: NFe -> infNFe -> ...
-        
-        # Depending on if it's NFe or nfeProc, the root might differ.
-        # Usually nfeProc contains NFe.
-        
-        inf_nfe = root.find('.//infNFe')
-        if inf_nfe is None:
-            raise ValueError("Estrutura infNFe não encontrada.")
-            
-        emit = inf_nfe.find('emit')
-        ide = inf_nfe.find('ide')
-        total = inf_nfe.find('total')
-        
-        data = {}
-        
-        if ide is not None:
-            data['numeroNota'] = ide.find('nNF').text if ide.find('nNF') is not None else ''
-            dh_emi = ide.find('dhEmi').text if ide.find('dhEmi') is not None else ''
-            # Format date: YYYY-MM-DDTHH:MM:SS-OFFSET -> YYYY-MM-DD
+    if isinstance(xml_source, (bytes, bytearray)):
+        xml_source = io.BytesIO(xml_source)
+
+    data = {}
+
+    for _, elem in ET.iterparse(xml_source):
+        nome = _BLOCOS.get(elem.tag)
+        if nome is None:
+            continue
+
+        if nome == 'det':
+            # Items are never read; drop them as soon as they are parsed
+            elem.clear()
+            continue
+
+        ns = elem.tag[:-len(nome)]
+
+        if nome == 'ide':
+            data['numeroNota'] = _texto(elem, ns + 'nNF') or ''
+            # Format date: YYYY-MM-DDTHH:MM:SS-OFFSET -> YYYY-MM-DD (dEmi: NFe 2.0 layout)
+            dh_emi = _texto(elem, ns + 'dhEmi') or _texto(elem, ns + 'dEmi')
             if dh_emi:
                 data['dataEmissao'] = dh_emi.split('T')[0]
-                
-        if emit is not None:
-            data['cnpj'] = emit.find('CNPJ').text if emit.find('CNPJ') is not None else ''
-            data['fornecedor'] = emit.find('xNome').text if emit.find('xNome') is not None else ''
-            
-        if total is not None:
-            icms_tot = total.find('ICMSTot')
+
+        elif nome == 'emit':
+            data['cnpj'] = _texto(elem, ns + 'CNPJ') or ''
+            data['fornecedor'] = _texto(elem, ns + 'xNome') or ''
+
+        elif nome == 'total':
+            icms_tot = elem.find(ns + 'ICMSTot')
             if icms_tot is not None:
-                data['valor'] = icms_tot.find('vNF').text if icms_tot.find('vNF') is not None else ''
+                data['valor'] = _texto(icms_tot, ns + 'vNF') or ''
+
+        elif nome == 'cobr':
+            duplicatas = [
+                {
+                    'numero': _texto(dup, ns + 'nDup') or '',
+                    'vencimento': _texto(dup, ns + 'dVenc') or '',
+                    'valor': _texto(dup, ns + 'vDup') or '',
+                }
+                for dup in elem.iterfind(ns + 'dup')
+            ]
+            if duplicatas:
+                data['duplicatas'] = duplicatas
+                data['dataVencimento'] = duplicatas[0]['vencimento']
 
-        # Data Vencimento (fatura/duplicata)
-        cobr = inf_nfe.find('cobr')
-        if cobr is not None:
-            dup = cobr.find('dup')
-            if dup is not None:
-                data['dataVencimento'] = dup.find('dVenc').text if dup.find('dVenc') is not None else ''
+        elif nome == 'infNFe':
+            chave = (elem.get('Id') or '')[3:]  # Id="NFe<44 digits>"
+            if len(chave) == 44 and chave.isdigit():
+                data['chaveAcesso'] = chave
+            elem.clear()
+            yield data
+            data = {}
 
-        return data
+
+def ler_xml_nfe(xml_source):
+    """
+    Parses an NFe XML file and extracts relevant information.
+
+    Args:
+        xml_source (str | bytes | file): Path, raw bytes or binary file-like object.
+
+    Returns:
+        dict: Extracted invoice data (first NFe in the file).
+    """
+    try:
+        with etapa('xml_parse'):
+            for data in iter_xml_nfe(xml_source):
+                return data
+        raise ValueError("Estrutura infNFe não encontrada.")
 
     except Exception as e:
+        registrar_erro(e, 'xml_parse')
         print(f"Erro ao ler XML: {e}")
         return {}
+
+
+def ler_lote_xml_nfe(xml_source):
+    """
+    Parses every NFe in an XML file (a single NFe or a lot such as enviNFe).
+
+    Args:
+        xml_source (str | bytes | file): Path, raw bytes or binary file-like object.
+
+    Returns:
+        list: One dict per infNFe, in file order. On a parse error, the notas
+            read before the error (possibly none).
+    """
+    notas = []
+    try:
+        with etapa('xml_parse'):
+            for data in iter_xml_nfe(xml_source):
+                notas.append(data)
+        if not notas:
+            raise ValueError("Estrutura infNFe não encontrada.")
+
+    except Exception as e:
+        registrar_erro(e, 'xml_parse')
+        print(f"Erro ao ler XML: {e}")
+    return notas
@@ -1,8 +1,53 @@
 import unittest
 import os
+import io
+import json
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import tempfile
+import time
+import zipfile
+import gzip
+import csv
+import sqlite3
+import subprocess
+import sys
+from unittest import mock
 import xml.etree.ElementTree as ET
-from services.xml_service import ler_xml_nfe
+from werkzeug.datastructures import FileStorage
+
+# Keep caches/stores created by the services out of the working tree
+os.environ.setdefault('DATA_DIR', tempfile.mkdtemp(prefix='nf_test_'))
+
+# Cold start budget for `import app` (seconds); override on slow CI machines
+IMPORT_BUDGET_SECONDS = float(os.getenv('IMPORT_BUDGET_SECONDS', 0.5))
+
+from services.xml_service import ler_xml_nfe, iter_xml_nfe
 from services.ocr_service import extract_text_pdf, parse_invoice_text
+from services.batch_service import coletar_arquivos, processar_lote
+from services.cache_service import ExtractionCache
+from services.chave_service import decodificar_chave
+from services import ocr_service, llm_service, nota_service
+from services.job_service import JobQueue, STATUS_FINAIS
+from services.webhook_service import WebhookDispatcher, WebhookUrlNaoPermitidaError, url_permitida
+from services.invoice_store import InvoiceStore
+from services.metrics_service import metricas
+from services import startup_service, invoice_store, auth_service
+import app as app_module
+from benchmarks.corpus import VARIANTES_XML, gerar_pdf_danfe, gerar_texto_danfe, gerar_xml_nfe, pdf_de_paginas
+
+
+def _falhar_primeiras(metodo, vezes):
+    # Raises like a SQLite lock timeout on the first `vezes` calls
+    falhas = [sqlite3.OperationalError('database is locked')] * vezes
+
+    def chamar(*args, **kwargs):
+        if falhas:
+            raise falhas.pop()
+        return metodo(*args, **kwargs)
+    return chamar
+
 
 class TestBackendServices(unittest.TestCase):
 
@@ -43,6 +88,53 @@ class TestBackendServices(unittest.TestCase):
         self.assertEqual(data.get('valor'), '150.00')
         self.assertEqual(data.get('dataEmissao'), '2023-10-27')
 
+    def test_xml_lot_streaming(self):
+        nfe = """<NFe><infNFe Id="NFe35240511222333000181550010000012341123456789">
+            <ide><nNF>{n}</nNF><dhEmi>2024-05-15T10:00:00-03:00</dhEmi></ide>
+            <emit><CNPJ>11222333000181</CNPJ><xNome>Lote Ltda</xNome></emit>
+            <det nItem="1"><prod><cProd>1</cProd></prod></det>
+            <total><ICMSTot><vNF>10.00</vNF></ICMSTot></total>
+            <cobr>
+                <dup><nDup>001</nDup><dVenc>2024-06-15</dVenc><vDup>5.00</vDup></dup>
+                <dup><nDup>002</nDup><dVenc>2024-07-15</dVenc><vDup>5.00</vDup></dup>
+            </cobr>
+        </infNFe></NFe>"""
+        lote = '<enviNFe xmlns="http://www.portalfiscal.inf.br/nfe"><idLote>1</idLote>{}</enviNFe>'.format(
+            ''.join(nfe.format(n=n) for n in (1, 2, 3))
+        )
+
+        notas = list(iter_xml_nfe(io.BytesIO(lote.encode('utf-8'))))
+        self.assertEqual([n['numeroNota'] for n in notas], ['1', '2', '3'])
+        self.assertEqual(notas[0]['chaveAcesso'], '35240511222333000181550010000012341123456789')
+        self.assertEqual(notas[0]['dataVencimento'], '2024-06-15')
+        self.assertEqual([d['vencimento'] for d in notas[0]['duplicatas']], ['2024-06-15', '2024-07-15'])
+
+        # Same document without the namespace
+        sem_ns = lote.replace(' xmlns="http://www.portalfiscal.inf.br/nfe"', '')
+        self.assertEqual(ler_xml_nfe(io.BytesIO(sem_ns.encode('utf-8'))), notas[0])
+
+        # The batch endpoint gives every NFe of a lot its own line; the single
+        # file endpoint returns the first and says how many there are
+        client = app_module.app.test_client()
+        resposta = client.post('/api/ler-notas-lote', data={'files': (io.BytesIO(lote.encode('utf-8')), 'lote.xml')})
+        linhas = [json.loads(linha) for linha in resposta.get_data(as_text=True).splitlines()]
+        self.assertEqual([l['dados']['numeroNota'] for l in linhas[:-1]], ['1', '2', '3'])
+        self.assertEqual([l['nota'] for l in linhas[:-1]], [1, 2, 3])
+        self.assertEqual(linhas[-1]['resumo'], {'total': 3, 'sucesso': 3, 'erros': 0})
+
+        resposta = client.post('/api/ler-nota', data={'file': (io.BytesIO(lote.encode('utf-8')), 'lote.xml')})
+        self.assertEqual(resposta.get_json()['numeroNota'], '1')
+        self.assertEqual(resposta.get_json()['notasNoArquivo'], 3)
+
+        # A job keeps every NFe of the lot
+        base = tempfile.mkdtemp(dir=os.environ['DATA_DIR'])
+        fila = JobQueue(os.path.join(base, 'jobs.sqlite3'), base, nota_service.extrair_notas, workers=1)
+        job = fila.submit('lote.xml', io.BytesIO(lote.encode('utf-8')))
+        fila._executar(fila._reivindicar())
+        job = fila.get(job['id'])
+        self.assertEqual(job['status'], 'concluido')
+        self.assertEqual([n['numeroNota'] for n in job['resultado']], ['1', '2', '3'])
+
     def test_ocr_parsing_logic(self):
         # We can't easily test OCR (pytesseract) without dependencies,
         # but we can test the regex parsing logic which is crucial.
@@ -80,5 +172,578 @@ class TestBackendServices(unittest.TestCase):
         # Float(1250.50) -> 1250.5
         self.assertEqual(data.get('valor'), 1250.5)
 
+    def test_batch_processing(self):
+        with open(self.xml_path, 'rb') as f:
+            xml_bytes = f.read()
+
+        zip_buffer = io.BytesIO()
+        with zipfile.ZipFile(zip_buffer, 'w') as zf:
+            zf.writestr('lote/nota.xml', xml_bytes)
+            zf.writestr('lote/leiame.txt', b'ignorar')
+        zip_buffer.seek(0)
+
+        direto = io.BytesIO(xml_bytes)
+        files = [
+            FileStorage(direto, filename='nota.xml'),
+            FileStorage(io.BytesIO(b'<quebrado'), filename='nota.xml'),
+            FileStorage(zip_buffer, filename='lote.zip'),
+        ]
+
+        itens, erros = coletar_arquivos(files)
+        self.assertEqual(len(itens), 3)
+        self.assertEqual(len(erros), 1)  # leiame.txt
+        # Uploaded files are used from the request's buffer, not copied again
+        self.assertIs(itens[0][1], direto)
+
+        resultados = list(processar_lote(itens, max_workers=2))
+
+        self.assertEqual(len(resultados), 3)
+        ok = [r for r in resultados if r['ok']]
+        self.assertEqual(len(ok), 2)
+        self.assertTrue(all(r['dados']['numeroNota'] == '12345' for r in ok))
+
+        # Client gone after the first result: files not started are cancelled
+        chamadas = []
+
+        def lento(nome, fonte):
+            chamadas.append(nome)
+            time.sleep(0.05)
+            return [{'numeroNota': nome}]
+
+        with mock.patch('services.batch_service.extrair_notas', lento):
+            gerador = processar_lote([(str(n), None) for n in range(20)], max_workers=2)
+            next(gerador)
+            gerador.close()
+        self.assertLess(len(chamadas), 20)
+
+        # A ZIP bomb stops at the file-count and decompressed-size caps
+        zip_buffer = io.BytesIO()
+        with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zf:
+            for i in range(6):
+                zf.writestr(f'nota{i}.xml', b'0' * 1000)
+        with mock.patch('services.batch_service.BATCH_MAX_FILES', 4):
+            itens, erros = coletar_arquivos([FileStorage(io.BytesIO(zip_buffer.getvalue()), filename='a.zip')])
+        self.assertEqual((len(itens), len(erros)), (4, 2))
+        self.assertIn('4 arquivos', erros[0]['erro'])
+        with mock.patch('services.batch_service.MAX_BATCH_UPLOAD_BYTES', 2500):
+            itens, erros = coletar_arquivos([FileStorage(io.BytesIO(zip_buffer.getvalue()), filename='a.zip')])
+        self.assertEqual((len(itens), len(erros)), (2, 4))
+        self.assertEqual(erros[0]['erro'], 'Lote excede o tamanho máximo permitido.')
+
+    def test_extraction_cache(self):
+        db_path = os.path.join(os.environ['DATA_DIR'], 'cache_test.sqlite3')
+        dados = {'numeroNota': '12345', 'valor': 150.0}
+
+        cache = ExtractionCache(db_path, 'v1', memory_entries=1)
+        self.assertIsNone(cache.get('pdf:a'))
+        cache.set('pdf:a', dados, duracao_ms=2000)
+        cache.set('pdf:b', dados)  # evicts 'pdf:a' from memory, not from disk
+
+        self.assertEqual(cache.get('pdf:a'), dados)
+        self.assertEqual(cache.get('pdf:a'), dados)
+        stats = cache.stats()
+        self.assertEqual((stats['hitsDisco'], stats['hitsMemoria'], stats['misses']), (1, 1, 1))
+        self.assertEqual(stats['tempoEconomizadoMs'], 4000)
+
+        # Same file, new prompt/model version: old entries no longer count
+        self.assertEqual(ExtractionCache(db_path, 'v1').get('pdf:b'), dados)
+        self.assertIsNone(ExtractionCache(db_path, 'v2').get('pdf:b'))
+
+    def test_chave_acesso(self):
+        chave = '3524 0511 2223 3300 0181 5500 1000 0012 3411 2345 6789'
+        dados = decodificar_chave(chave)
+        self.assertEqual(dados['uf'], 'SP')
+        self.assertEqual(dados['anoMes'], '2024-05')
+        self.assertEqual(dados['cnpj'], '11.222.333/0001-81')
+        self.assertEqual(dados['serie'], '1')
+        self.assertEqual(dados['numeroNota'], '1234')
+        # Wrong check digit
+        self.assertIsNone(decodificar_chave(chave[:-1] + '0'))
+
+    def test_tiered_extraction(self):
+        danfe = """
+        RECEBEMOS DE FORNECEDOR EXEMPLO LTDA OS PRODUTOS CONSTANTES DA NOTA FISCAL
+        CHAVE DE ACESSO
+        3524 0511 2223 3300 0181 5500 1000 0012 3411 2345 6789
+        DATA DA EMISSÃO
+        15/05/2024
+        VALOR TOTAL DA NOTA
+        1.250,50
+        """
+        with mock.patch.object(ocr_service, '_extrair_com_llm') as llm:
+            data = ocr_service.extrair_dados_texto(danfe)
+        llm.assert_not_called()
+        self.assertEqual(data['numeroNota'], '1234')
+        self.assertEqual(data['cnpj'], '11.222.333/0001-81')
+        self.assertEqual(data['fornecedor'], 'FORNECEDOR EXEMPLO LTDA')
+        self.assertEqual(data['valor'], 1250.5)
+        self.assertEqual(data['dataEmissao'], '2024-05-15')
+
+        # Without the supplier name the model is asked, but cannot override confident fields
+        sem_fornecedor = danfe.replace('RECEBEMOS DE FORNECEDOR EXEMPLO LTDA OS PRODUTOS', '')
+        resposta = {'fornecedor': 'Outro Nome', 'numeroNota': '999'}
+        with mock.patch.object(ocr_service, '_extrair_com_llm', return_value=resposta) as llm:
+            data = ocr_service.extrair_dados_texto(sem_fornecedor)
+        llm.assert_called_once()
+        self.assertEqual(data['fornecedor'], 'Outro Nome')
+        self.assertEqual(data['numeroNota'], '1234')
+
+        # Tax block: labels on one row, values on the next. The first amount
+        # below the label is the ICMS base, so the model gets the last word
+        bloco = danfe.replace('VALOR TOTAL DA NOTA\n        1.250,50', (
+            'BASE DE CALCULO DO ICMS  VALOR DO ICMS  VALOR TOTAL DOS PRODUTOS  VALOR TOTAL DA NOTA\n'
+            '        1.000,00  180,00  1.250,50  1.250,50'
+        ))
+        self.assertEqual(ocr_service.extrair_campos_rapido(bloco)['valor'], (1000.0, 0.5))
+        with mock.patch.object(ocr_service, '_extrair_com_llm', return_value={'valor': 1250.5}) as llm:
+            data = ocr_service.extrair_dados_texto(bloco)
+        llm.assert_called_once()
+        self.assertEqual(data['valor'], 1250.5)
+
+    def _aguardar_job(self, fila, job_id, limite=5):
+        fim = time.time() + limite
+        while time.time() < fim:
+            job = fila.get(job_id)
+            if job['status'] in STATUS_FINAIS:
+                return job
+            fila.aguardar(0.1)
+        self.fail('Job não terminou a tempo')
+
+    def test_job_queue(self):
+        base = tempfile.mkdtemp(dir=os.environ['DATA_DIR'])
+        db_path = os.path.join(base, 'jobs.sqlite3')
+
+        def processar(nome, caminho):
+            with open(caminho) as f:
+                conteudo = f.read()
+            if conteudo == 'lento':
+                time.sleep(1)
+            return [{'numeroNota': conteudo}]
+
+        # A job claimed by a worker that died: its lease expires and a new queue takes over
+        morta = JobQueue(db_path, base, processar, workers=1, timeout=0.3)
+        orfao = morta.submit('orfao.xml', io.BytesIO(b'1'))
+        morta._reivindicar()
+        morta._conn.execute('UPDATE jobs SET lease_ate = 0 WHERE id = ?', (orfao['id'],))
+
+        fila = JobQueue(db_path, base, processar, workers=2, timeout=0.3)
+        fila._reivindicar = _falhar_primeiras(fila._reivindicar, 2)
+        fila.start()
+        try:
+            ok = fila.submit('nota.xml', io.BytesIO(b'12345'))
+            lento = fila.submit('lento.xml', io.BytesIO(b'lento'))
+
+            job = self._aguardar_job(fila, ok['id'])
+            self.assertEqual(job['status'], 'concluido')
+            self.assertEqual(job['resultado'], [{'numeroNota': '12345'}])
+
+            job = self._aguardar_job(fila, lento['id'])
+            self.assertEqual(job['status'], 'erro')
+            self.assertIn('Tempo limite', job['erro'])
+
+            job = self._aguardar_job(fila, orfao['id'])
+            self.assertEqual(job['status'], 'concluido')
+            self.assertEqual(job['tentativas'], 2)
+        finally:
+            fila.stop()
+
+        # SSE: streams are capped in number and end after JOB_SSE_MAX_SECONDS
+        parada = JobQueue(db_path, base, processar, workers=1)
+        pendente = parada.submit('pendente.xml', io.BytesIO(b'1'))
+        url = f"/api/jobs/{pendente['id']}/eventos"
+        client = app_module.app.test_client()
+        with mock.patch.object(app_module, 'get_fila', return_value=parada), \
+                mock.patch.object(app_module, 'JOB_SSE_MAX_SECONDS', 0.2):
+            abertas = [client.get(url) for _ in range(app_module.JOB_SSE_MAX_STREAMS)]
+            self.assertTrue(all(r.status_code == 200 for r in abertas))
+            self.assertEqual(client.get(url).status_code, 503)
+
+            corpo = abertas[0].get_data(as_text=True)
+            self.assertIn('"status": "pendente"', corpo)
+            for resposta in abertas:
+                resposta.close()
+            nova = client.get(url)
+            self.assertEqual(nova.status_code, 200)
+            nova.close()
+
+    def test_upload_in_memory(self):
+        client = app_module.app.test_client()
+        with open(self.xml_path, 'rb') as f:
+            xml_bytes = f.read()
+
+        resposta = client.post('/api/ler-nota', data={'file': (io.BytesIO(xml_bytes), 'nota.xml')})
+        self.assertEqual(resposta.status_code, 200)
+        self.assertEqual(resposta.get_json()['numeroNota'], '12345')
+
+        with mock.patch.object(app_module, 'MAX_UPLOAD_BYTES', 100):
+            resposta = client.post('/api/ler-nota', data={'file': (io.BytesIO(xml_bytes), 'nota.xml')})
+        self.assertEqual(resposta.status_code, 413)
+
+    def test_pdf_lazy_extraction(self):
+        primeira = [
+            'DANFE',
+            '3524 0511 2223 3300 0181 5500 1000 0012 3411 2345 6789',
+            'VALOR TOTAL DA NOTA 1.250,50',
+        ]
+        itens = [[f'ITEM {p}-{i} PRODUTO QUALQUER' for i in range(40)] for p in range(9)]
+        pdf = pdf_de_paginas([primeira] + itens)
+
+        texto, info = ocr_service.extrair_texto_pdf(pdf)
+        self.assertEqual((info['paginasLidas'], info['paginasTotal']), (1, 10))
+        self.assertIn('VALOR TOTAL DA NOTA', texto)
+
+        # No header or totals: pages are read up to the cap
+        texto, info = ocr_service.extrair_texto_pdf(io.BytesIO(pdf_de_paginas(itens)), max_paginas=4)
+        self.assertEqual((info['paginasLidas'], info['paginasTotal']), (4, 9))
+
+        # A cache hit reads no page and does not replay the first run's timings
+        danfe = gerar_pdf_danfe(2024, 1)
+        primeira = nota_service.processar_arquivo('nota.pdf', io.BytesIO(danfe))
+        repetida = nota_service.processar_arquivo('nota.pdf', io.BytesIO(danfe))
+        self.assertEqual(primeira['extracaoPdf']['paginasLidas'], 1)
+        self.assertNotIn('cache', primeira['extracaoPdf'])
+        self.assertEqual(repetida['extracaoPdf'],
+                         {'paginasLidas': 0, 'paginasTotal': 1, 'tempoMs': 0.0, 'cache': True})
+        self.assertEqual(repetida['valor'], primeira['valor'])
+
+    def test_llm_dispatcher_batches_and_retries(self):
+        pedidos = []
+
+        class StubLLM(BaseHTTPRequestHandler):
+            def do_POST(self):
+                corpo = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                prompt = corpo['contents'][0]['parts'][0]['text']
+                pedidos.append(prompt)
+                if len(pedidos) == 1:
+                    self._responder(429, {'error': {'code': 429, 'message': 'quota', 'status': 'RESOURCE_EXHAUSTED'}})
+                    return
+                notas = re.findall(r'=== NOTA (\d+) ===\nNOTA FISCAL NUMERO (\d+)', prompt)
+                # Out of order, and a batched answer drops nota 2
+                texto = json.dumps([{'nota': int(i), 'numeroNota': n} for i, n in reversed(notas)
+                                    if len(notas) == 1 or i != '2'])
+                self._responder(200, {'candidates': [{'content': {'role': 'model', 'parts': [{'text': texto}]}}]})
+
+            def _responder(self, status, corpo):
+                saida = json.dumps(corpo).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(saida)))
+                self.end_headers()
+                self.wfile.write(saida)
+
+            def log_message(self, *args):
+                pass
+
+        servidor = ThreadingHTTPServer(('127.0.0.1', 0), StubLLM)
+        threading.Thread(target=servidor.serve_forever, daemon=True).start()
+        try:
+            from google import genai
+            from google.genai import types
+            client = genai.Client(api_key='teste', http_options=types.HttpOptions(
+                base_url=f'http://127.0.0.1:{servidor.server_address[1]}'))
+            dispatcher = llm_service.LLMDispatcher(
+                client, batch_size=3, batch_wait_ms=500, rate_per_minute=6000)
+
+            resultados = {}
+
+            def chamar(n):
+                resultados[n] = dispatcher.extrair(f'NOTA FISCAL NUMERO {n}')
+
+            with mock.patch.object(llm_service, '_BACKOFF_BASE_SECONDS', 0.01):
+                threads = [threading.Thread(target=chamar, args=(n,)) for n in (1, 2, 3)]
+                for t in threads:
+                    t.start()
+                for t in threads:
+                    t.join(10)
+        finally:
+            servidor.shutdown()
+
+        self.assertEqual(resultados, {n: {'numeroNota': str(n)} for n in (1, 2, 3)})
+        # One 429, the three notas in a single batched prompt, then the one
+        # missing from its answer asked again on its own
+        self.assertEqual(len(pedidos), 3)
+        self.assertEqual(len(re.findall(r'=== NOTA \d+ ===', pedidos[1])), 3)
+        self.assertEqual(len(re.findall(r'=== NOTA \d+ ===', pedidos[2])), 1)
+
+        # A batched answer that is not a JSON array: every nota is asked again alone
+        prompts = []
+
+        class Resposta:
+            def __init__(self, text):
+                self.text = text
+
+        class Modelos:
+            def generate_content(self, model, contents):
+                prompts.append(contents)
+                if len(re.findall(r'=== NOTA \d+ ===', contents)) > 1:
+                    return Resposta('Desculpe, não consegui ler as notas.')
+                return Resposta(json.dumps({'numeroNota': re.search(r'NUMERO (\d+)', contents).group(1)}))
+
+        cliente = mock.Mock(models=Modelos())
+        dispatcher = llm_service.LLMDispatcher(cliente, batch_size=2, batch_wait_ms=500, rate_per_minute=6000)
+        resultados = {}
+        threads = [threading.Thread(target=chamar, args=(n,)) for n in (1, 2)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join(10)
+        self.assertEqual(resultados, {n: {'numeroNota': str(n)} for n in (1, 2)})
+        self.assertEqual(len(prompts), 3)
+
+    def test_webhook_dispatcher(self):
+        recebidos = []
+        respostas = {'/flow': [500, 200], '/quebrado': [400, 200]}
+
+        class StubWebhook(BaseHTTPRequestHandler):
+            def do_POST(self):
+                corpo = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                status = respostas[self.path].pop(0) if len(respostas[self.path]) > 1 else respostas[self.path][0]
+                if status == 200:
+                    recebidos.append(corpo)
+                self.send_response(status)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        servidor = ThreadingHTTPServer(('127.0.0.1', 0), StubWebhook)
+        threading.Thread(target=servidor.serve_forever, daemon=True).start()
+        base_url = f'http://127.0.0.1:{servidor.server_address[1]}'
+
+        db_path = os.path.join(tempfile.mkdtemp(dir=os.environ['DATA_DIR']), 'webhook.sqlite3')
+        dispatcher = WebhookDispatcher(db_path, workers=2, backoff_seconds=0.01,
+                                       hosts_permitidos=('http://127.0.0.1',))
+        # Workers survive unexpected errors instead of dying silently
+        dispatcher._reivindicar = _falhar_primeiras(dispatcher._reivindicar, 2)
+        dispatcher.start()
+        try:
+            # Only allowlisted hosts; the URL (and its sig= secret) is never shown back
+            for url in ('http://10.0.0.1/flow', 'https://evil.com/x', 'https://127.0.0.1.evil.com/'):
+                with self.assertRaises(WebhookUrlNaoPermitidaError):
+                    dispatcher.enfileirar(url, [{'numeroNota': '1'}])
+            self.assertTrue(url_permitida('https://prod-01.westus.logic.azure.com:443/workflows/x?sig=s'))
+            self.assertFalse(url_permitida('http://prod-01.westus.logic.azure.com/workflows/x'))
+            self.assertFalse(url_permitida('https://logic.azure.com.evil.com/'))
+
+            # 500 is retried; 400 goes straight to the dead letter
+            ok, = dispatcher.enfileirar(base_url + '/flow', [{'numeroNota': '1'}])
+            ruim, = dispatcher.enfileirar(base_url + '/quebrado', [{'numeroNota': '2'}])
+
+            def _aguardar(entrega_id, status):
+                fim = time.time() + 5
+                while dispatcher.get(entrega_id)['status'] != status and time.time() < fim:
+                    dispatcher.aguardar(0.05)
+                return dispatcher.get(entrega_id)
+
+            self.assertEqual(_aguardar(ok, 'entregue')['tentativas'], 2)
+            self.assertEqual(_aguardar(ruim, 'falha')['erro'][:8], 'HTTP 400')
+            self.assertEqual([e['id'] for e in dispatcher.dead_letter()], [ruim])
+            self.assertNotIn('webhookUrl', dispatcher.get(ruim))
+            self.assertEqual(dispatcher.get(ruim)['webhookHost'], '127.0.0.1')
+
+            # Replay once the flow is fixed
+            self.assertEqual(dispatcher.reenviar(), 1)
+            self.assertEqual(_aguardar(ruim, 'entregue')['status'], 'entregue')
+        finally:
+            dispatcher.stop()
+            servidor.shutdown()
+
+        self.assertEqual(sorted(n['numeroNota'] for n in recebidos), ['1', '2'])
+
+    def test_invoice_store(self):
+        db_path = os.path.join(tempfile.mkdtemp(dir=os.environ['DATA_DIR']), 'notas.sqlite3')
+        store = InvoiceStore(db_path)
+        notas = [
+            {'id': f'ID-{i}', 'numeroNota': str(i), 'cnpj': '12.345.678/0001-99', 'valor': '1.234,50',
+             'dataEmissao': f'2024-01-{i:02d}', 'uploadDate': f'2024-02-{i:02d}',
+             'status': 'paga' if i % 2 else 'pendente'}
+            for i in range(1, 11)
+        ]
+        self.assertTrue(all(r['ok'] for r in store.salvar('a@x.com', notas)))
+
+        pagina = store.consultar('a@x.com', {'status': 'paga', 'cnpj': '12345678000199'}, pagina=2, tamanho=2)
+        self.assertEqual(pagina['total'], 5)
+        self.assertEqual([n['id'] for n in pagina['notas']], ['ID-5', 'ID-3'])
+        self.assertEqual(store.consultar('a@x.com', {'emissaoDe': '2024-01-09'})['total'], 2)
+        self.assertEqual(store.consultar('a@x.com', {'busca': '345.678'})['total'], 10)
+        self.assertEqual(store.consultar('a@x.com', {'busca': 'pend'})['total'], 5)
+        self.assertEqual(store.consultar('b@x.com')['total'], 0)
+
+        # Same ID updates in place; same CNPJ + número under another ID is rejected
+        store.salvar('a@x.com', [dict(notas[0], status='aprovada')])
+        self.assertEqual(store.get('a@x.com', 'ID-1')['status'], 'aprovada')
+        duplicada, = store.salvar('a@x.com', [dict(notas[0], id='ID-novo')])
+        self.assertFalse(duplicada['ok'])
+        self.assertEqual(duplicada['duplicadaDe'], 'ID-1')
+
+        chave = '35240112345678000199550010000000111000000011'
+        primeira, segunda = store.salvar('a@x.com', [
+            {'id': 'C1', 'numeroNota': '111', 'chaveAcesso': chave},
+            {'id': 'C2', 'numeroNota': '222', 'chaveAcesso': chave},
+        ])
+        self.assertTrue(primeira['ok'])
+        self.assertEqual(segunda['duplicadaDe'], 'C1')
+
+        # IDs are per user: another user may reuse one without touching the first
+        self.assertEqual(store.salvar('b@x.com', [{'id': 'ID-1', 'numeroNota': '999'}])[0]['ok'], True)
+        self.assertEqual(store.get('b@x.com', 'ID-1')['numeroNota'], '999')
+        self.assertEqual(store.get('a@x.com', 'ID-1')['status'], 'aprovada')
+        self.assertEqual(store.remover('b@x.com', ['ID-1']), 1)
+
+        self.assertEqual(store.remover('a@x.com', ['ID-1', 'C1']), 2)
+        self.assertEqual(store.consultar('a@x.com')['total'], 9)
+
+    def test_export_streaming(self):
+        from services.invoice_store import get_invoice_store
+        import openpyxl
+
+        get_invoice_store().salvar('export@x.com', [
+            {'id': '1700000000000123', 'numeroNota': '000123', 'cnpj': '11222333000181', 'valor': '1.234,50',
+             'dataEmissao': '2024-03-01', 'status': 'paga', 'chaveAcesso': '35240311222333000181550010000001231000001230',
+             'fornecedor': '=HYPERLINK("http://x","y")'},
+            {'id': 'ID-2', 'numeroNota': '124', 'cnpj': '11222333000181', 'valor': 10, 'dataEmissao': '2024-02-01',
+             'status': 'pendente'},
+        ])
+        client = app_module.app.test_client()
+
+        resposta = client.get('/api/notas/exportar?usuario=export@x.com&formato=csv',
+                              headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(resposta.headers['Content-Encoding'], 'gzip')
+        linhas = list(csv.reader(io.StringIO(gzip.decompress(resposta.data).decode('utf-8-sig')), delimiter=';'))
+        self.assertEqual(len(linhas), 3)
+        # Emission-date order; IDs and keys verbatim, CNPJ formatted, formulas neutralised
+        self.assertEqual(linhas[1][:4], ['ID-2', '124', '', '11.222.333/0001-81'])
+        self.assertEqual(linhas[2][:3], ['1700000000000123', '000123', '35240311222333000181550010000001231000001230'])
+        self.assertEqual(linhas[2][4], '\'=HYPERLINK("http://x","y")')
+        self.assertEqual(linhas[2][5:7], ['1234,50', '01/03/2024'])
+
+        # excel=1: numeric-looking text as ="..." so Excel keeps it as text
+        resposta = client.get('/api/notas/exportar?usuario=export@x.com&formato=csv&excel=1')
+        linhas = list(csv.reader(io.StringIO(resposta.data.decode('utf-8-sig')), delimiter=';'))
+        self.assertEqual(linhas[1][:2], ['ID-2', '="124"'])
+        self.assertEqual(linhas[2][:3], ['="1700000000000123"', '="000123"',
+                                         '="35240311222333000181550010000001231000001230"'])
+
+        resposta = client.get('/api/notas/exportar?usuario=export@x.com&formato=xlsx&status=paga')
+        planilha = openpyxl.load_workbook(io.BytesIO(resposta.data)).active
+        linhas = list(planilha.iter_rows(min_row=2))
+        self.assertEqual(len(linhas), 1)
+        self.assertEqual(linhas[0][1].value, '000123')
+        self.assertEqual(linhas[0][1].number_format, '@')
+        self.assertEqual(linhas[0][2].value, '35240311222333000181550010000001231000001230')
+        self.assertEqual(linhas[0][5].value, 1234.5)
+        # A fornecedor starting with '=' is a string cell, not a live formula
+        self.assertEqual(linhas[0][4].data_type, 's')
+        with zipfile.ZipFile(io.BytesIO(resposta.data)) as pacote:
+            self.assertNotIn(b'<f>', pacote.read('xl/worksheets/sheet1.xml'))
+
+    def test_api_token(self):
+        client = app_module.app.test_client()
+        # Without API_TOKEN only this machine gets in
+        self.assertEqual(client.get('/api/notas?usuario=a@x.com').status_code, 200)
+        remoto = client.get('/api/notas?usuario=a@x.com', environ_base={'REMOTE_ADDR': '10.0.0.5'})
+        self.assertEqual(remoto.status_code, 401)
+
+        with mock.patch.object(auth_service, 'API_TOKEN', 's3cr3t'):
+            self.assertEqual(client.get('/api/notas?usuario=a@x.com').status_code, 401)
+            self.assertEqual(client.get('/api/webhook/dead-letter', headers={'X-API-Token': 'errado'}).status_code, 401)
+            resposta = client.get('/api/notas?usuario=a@x.com', headers={'X-API-Token': 's3cr3t'},
+                                  environ_base={'REMOTE_ADDR': '10.0.0.5'})
+            self.assertEqual(resposta.status_code, 200)
+            # Download links cannot set headers
+            resposta = client.get('/api/notas/exportar?usuario=a@x.com&token=s3cr3t')
+            self.assertEqual(resposta.status_code, 200)
+
+    def test_metrics_and_server_timing(self):
+        metricas.clear()
+        client = app_module.app.test_client()
+        with open(self.xml_path, 'rb') as f:
+            tamanho = len(f.read())
+        with open(self.xml_path, 'rb') as f:
+            resposta = client.post('/api/ler-nota', data={'file': (f, 'nota.xml')})
+
+        self.assertEqual(resposta.status_code, 200)
+        etapas = [parte.split(';')[0] for parte in resposta.headers['Server-Timing'].split(', ')]
+        self.assertIn('upload', etapas)
+        self.assertIn('total', etapas)
+        self.assertEqual(metricas.valor('bytes_processados_total', formato='xml'), tamanho)
+        self.assertEqual(metricas.valor('requisicoes_em_andamento'), 0)
+
+        # A streamed lot stays in flight until its body is sent and closed
+        with open(self.xml_path, 'rb') as f:
+            resposta = client.post('/api/ler-notas-lote', data={'files': (f, 'nota.xml')}, buffered=False)
+        self.assertNotIn('Server-Timing', resposta.headers)
+        self.assertEqual(metricas.valor('requisicoes_em_andamento'), 1)
+        self.assertEqual(len(resposta.get_data().splitlines()), 2)
+        resposta.close()
+        self.assertEqual(metricas.valor('requisicoes_em_andamento'), 0)
+
+        # LLM failure falls back to regex and is counted as such
+        with mock.patch.object(ocr_service, '_extrair_com_llm', side_effect=TimeoutError('quota')):
+            ocr_service.extrair_dados_texto('Nota Fiscal Nº 123')
+        self.assertEqual(metricas.valor('extracoes_total', metodo='regex'), 1)
+        self.assertEqual(metricas.valor('erros_total', tipo='TimeoutError', etapa='llm'), 1)
+
+        exportado = client.get('/metrics').get_data(as_text=True)
+        self.assertIn('# TYPE leitor_nf_etapa_segundos histogram', exportado)
+        self.assertIn('leitor_nf_etapa_segundos_count{etapa="fallback"} 1', exportado)
+        self.assertIn('leitor_nf_requisicao_segundos_count{rota="/api/ler-nota",status="200"} 1', exportado)
+        self.assertIn('leitor_nf_requisicao_segundos_count{rota="/api/ler-notas-lote",status="200"} 1', exportado)
+
+    def test_benchmark_corpus(self):
+        # Same seed, same bytes; every namespace variant parses to the same nota
+        self.assertEqual(gerar_xml_nfe(7, 5), gerar_xml_nfe(7, 5))
+        notas = [ler_xml_nfe(gerar_xml_nfe(7, 5, variante=v)) for v in VARIANTES_XML]
+        self.assertTrue(notas[0]['chaveAcesso'])
+        self.assertTrue(all(nota == notas[0] for nota in notas))
+        self.assertEqual(len(list(iter_xml_nfe(gerar_xml_nfe(7, 2, notas=4)))), 4)
+
+        pdf = gerar_pdf_danfe(7, 3)
+        leitor = ocr_service._pypdf2().PdfReader(io.BytesIO(pdf))
+        self.assertEqual(len(leitor.pages), 3)
+        self.assertEqual(''.join(p.extract_text() + '\n' for p in leitor.pages), gerar_texto_danfe(7, 3))
+
+    def test_cold_start(self):
+        # Fresh interpreter: importing the app and serving the first XML must
+        # not load the PDF/LLM/XLSX dependencies, and must fit the budget
+        script = """
+import io, json, sys, time
+inicio = time.perf_counter()
+import app
+importacao = time.perf_counter() - inicio
+from benchmarks.corpus import gerar_xml_nfe
+client = app.app.test_client()
+inicio = time.perf_counter()
+resposta = client.post('/api/ler-nota', data={'file': (io.BytesIO(gerar_xml_nfe(1, 50)), 'nota.xml')})
+primeira = time.perf_counter() - inicio
+pesadas = ('httpx', 'PyPDF2', 'google.genai', 'openpyxl')
+print(json.dumps({
+    'importacao': importacao,
+    'primeira': primeira,
+    'status': resposta.status_code,
+    'carregadas': [m for m in pesadas if m in sys.modules],
+    'healthz': client.get('/healthz').get_json(),
+}))
+"""
+        env = dict(os.environ, DATA_DIR=tempfile.mkdtemp(prefix='nf_cold_'))
+        saida = subprocess.run([sys.executable, '-c', script], cwd=os.path.dirname(os.path.abspath(__file__)),
+                               env=env, capture_output=True, text=True, timeout=60)
+        self.assertEqual(saida.returncode, 0, saida.stderr)
+        resultado = json.loads(saida.stdout.strip().splitlines()[-1])
+
+        self.assertEqual(resultado['carregadas'], [])
+        self.assertEqual(resultado['status'], 200)
+        self.assertLess(resultado['importacao'], IMPORT_BUDGET_SECONDS)
+        self.assertLess(resultado['primeira'], 1.0)
+        self.assertEqual(resultado['healthz']['status'], 'ok')
+        self.assertFalse(resultado['healthz']['aquecido'])
+
+        # After fork, inherited singletons are dropped and rebuilt on demand
+        store = invoice_store.get_invoice_store()
+        startup_service.reiniciar_apos_fork()
+        self.assertIsNone(invoice_store._store)
+        self.assertIsNot(invoice_store.get_invoice_store(), store)
+
 if __name__ == '__main__':
     unittest.main()
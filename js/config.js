@@ -112,8 +112,14 @@ const Config = {
         baseUrl: (window.location.hostname === 'localhost' || window.location.hostname === '127.0.0.1') 
             ? 'http://127.0.0.1:5001' 
             : 'https://vzfcqsxv-5001.brs.devtunnels.ms/', // ⚠️ Substitua pela URL real após o deploy
+        // Mesmo valor de API_TOKEN no backend (obrigatório fora do localhost)
+        token: '',
         endpoints: {
-            upload: '/api/ler-nota'
+            upload: '/api/ler-nota',
+            batch: '/api/ler-notas-lote',
+            webhookDeliveries: '/api/webhook/entregas',
+            invoices: '/api/notas',
+            invoicesExport: '/api/notas/exportar'
         }
     }
 };
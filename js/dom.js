@@ -201,8 +201,10 @@ class DOMManager {
     /**
      * Renders the table of saved invoices.
      * @param {Array} invoices
+     * @param {number} [total] - Notas matching the search in the backend; when
+     *   larger than invoices.length, a footer says only a page is shown.
      */
-    renderInvoicesTable(invoices) {
+    renderInvoicesTable(invoices, total = invoices.length) {
         const tbody = this.elements.invoicesTableBody;
         tbody.innerHTML = '';
 
@@ -281,6 +283,12 @@ class DOMManager {
             `;
             tbody.appendChild(row);
         });
+
+        if (total > invoices.length) {
+            const row = document.createElement('tr');
+            row.innerHTML = `<td colspan="9" style="text-align:center">Mostrando ${invoices.length} de ${total} notas. Refine a busca para ver as demais.</td>`;
+            tbody.appendChild(row);
+        }
     }
 
     renderCustomizationPanel() {
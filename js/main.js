@@ -14,6 +14,12 @@ document.addEventListener('DOMContentLoaded', () => {
     window.domManager = dom; // Expose
     const validator = new window.Validator(config);
 
+    // Notas live in the backend store (one row per nota); config.savedInvoices
+    // holds only the page currently shown
+    const INVOICE_PAGE_SIZE = 200;
+    let invoicesTotal = 0;
+    let localInvoicesPending = []; // Left in localStorage by older versions
+
     // --- Login Logic ---
     const loginOverlay = document.getElementById('loginOverlay');
     const loginForm = document.getElementById('loginForm');
@@ -96,8 +102,9 @@ document.addEventListener('DOMContentLoaded', () => {
         // 3. Apply to Runtime Config
         applyUserConfig(userData);
 
-        // Auto-save any migrations (like uploadDate backfill)
+        // Auto-save any migrations
         saveCurrentUserData();
+        loadInvoices();
 
         // 4. Update UI
         dom.updateUserDisplay(email);
@@ -111,9 +118,6 @@ document.addEventListener('DOMContentLoaded', () => {
         
         // Reset navigation to default upload section or maintain if desired
         // For simplicity, we just ensure views are updated if visible
-        if (document.querySelector('#saved-invoices-section').classList.contains('hidden') === false) {
-            dom.renderInvoicesTable(config.savedInvoices);
-        }
         if (document.querySelector('#customization-section').classList.contains('hidden') === false) {
             dom.renderCustomizationPanel();
         }
@@ -145,29 +149,9 @@ document.addEventListener('DOMContentLoaded', () => {
         config.currentUser = userData.email;
         config.currentWebhook = userData.webhookUrl;
         
-        // Load Arrays (ensure they are arrays)
-        config.savedInvoices = Array.isArray(userData.savedInvoices) ? userData.savedInvoices : [];
-        
-        // --- Migration: Backfill uploadDate ---
-        // User stated old invoices are "from today".
-        const todayStr = new Date().toISOString().split('T')[0];
-        
-        let needsSave = false;
-        config.savedInvoices.forEach(inv => {
-            if (!inv.uploadDate) {
-                inv.uploadDate = todayStr;
-                needsSave = true;
-            }
-        });
-        // We will save this change implicitly on next action or logout, 
-        // but let's persist immediately just in case
-        if (needsSave) {
-            // Can't call saveCurrentUserData because config.currentUser might not be fully set?
-            // Actually it is set above.
-            // However, this function is called DURING login, let's defer save or just modify in-memory.
-            // Since `storage.saveUserData` writes to localStorage, we can do it after apply.
-        }
-
+        // Load Arrays (ensure they are arrays); notas come from loadInvoices()
+        config.savedInvoices = [];
+        localInvoicesPending = Array.isArray(userData.savedInvoices) ? userData.savedInvoices : [];
         config.customFields = Array.isArray(userData.customFields) ? userData.customFields : [];
         config.costCenters = Array.isArray(userData.costCenters) ? userData.costCenters : [];
 
@@ -189,14 +173,96 @@ document.addEventListener('DOMContentLoaded', () => {
         const dataToSave = {
             email: config.currentUser,
             webhookUrl: config.currentWebhook,
-            savedInvoices: config.savedInvoices,
             customFields: config.customFields,
             costCenters: config.costCenters,
             fieldConfig: config.fieldConfig // Save standard field config
         };
+        if (localInvoicesPending.length) {
+            dataToSave.savedInvoices = localInvoicesPending; // Not migrated yet
+        }
         storage.saveUserData(config.currentUser, dataToSave);
     }
 
+    /**
+     * Moves notas left in localStorage by older versions to the backend
+     * store, then loads the first page from it.
+     */
+    async function loadInvoices() {
+        if (localInvoicesPending.length) {
+            // Old invoices without an upload date are "from today"
+            const todayStr = new Date().toISOString().split('T')[0];
+            const notas = localInvoicesPending.map(inv => ({ ...inv, uploadDate: inv.uploadDate || todayStr }));
+            try {
+                // Duplicates come back as ok: false and are simply dropped
+                await services.saveInvoices(config.currentUser, notas);
+                localInvoicesPending = [];
+                saveCurrentUserData();
+                console.log(`${notas.length} nota(s) migradas do navegador para o backend.`);
+            } catch (error) {
+                // Kept in localStorage; retried on the next login
+                console.error("Falha ao migrar notas para o backend:", error);
+            }
+        }
+        await refreshInvoices();
+    }
+
+    /**
+     * Loads the notas matching the search box from the backend and renders
+     * them. Text and date filters run in the backend; the field-specific
+     * match is then applied to the page that came back.
+     */
+    async function refreshInvoices() {
+        if (!config.currentUser) return;
+        const field = document.getElementById('searchField')?.value || 'all';
+        const text = (document.getElementById('searchInput')?.value || '').trim();
+        const date = document.getElementById('searchDate')?.value || '';
+
+        // The backend 'busca' matches fornecedor, número, CNPJ and status
+        const filtros = { uploadDate: date };
+        if (field !== 'valor') {
+            filtros.busca = text;
+        }
+
+        try {
+            const page = await services.queryInvoices(config.currentUser, filtros, 1, INVOICE_PAGE_SIZE);
+            config.savedInvoices = page.notas;
+            invoicesTotal = page.total;
+        } catch (error) {
+            console.error("Falha ao carregar notas do backend:", error);
+        }
+
+        const filtered = config.savedInvoices.filter(invoice => matchesSearch(invoice, field, text.toLowerCase()));
+        const total = filtered.length === config.savedInvoices.length ? invoicesTotal : filtered.length;
+        dom.renderInvoicesTable(filtered, total);
+        updateBulkActionUI();
+    }
+
+    function matchesSearch(invoice, field, text) {
+        if (!text) return true;
+        if (field === 'all') {
+            // Global search
+            const searchStr = (
+                (invoice.fornecedor || "") + " " +
+                (invoice.numeroNota || "") + " " +
+                (invoice.cnpj || "") + " " +
+                (invoice.status || "") + " " +
+                (invoice.valor || "")
+            ).toLowerCase();
+            // CNPJ is matched by digits in the backend, so "11222333" finds "11.222.333/..."
+            const digits = text.replace(/\D/g, '');
+            return searchStr.includes(text) || (digits && String(invoice.cnpj || '').replace(/\D/g, '').includes(digits));
+        }
+        if (!invoice[field]) {
+            return false; // Field selected but empty/undefined in invoice
+        }
+        if (field === 'cnpj') {
+            const digits = text.replace(/\D/g, '');
+            return String(invoice.cnpj).toLowerCase().includes(text) ||
+                (digits !== '' && String(invoice.cnpj).replace(/\D/g, '').includes(digits));
+        }
+        return String(invoice[field]).toLowerCase().includes(text);
+    }
+
 
     // --- Navigation Logic ---
     const navLinks = document.querySelectorAll('.nav-link');
@@ -222,7 +288,7 @@ document.addEventListener('DOMContentLoaded', () => {
 
             // Special Actions based on section
             if (targetId === 'saved-invoices-section') {
-                dom.renderInvoicesTable(config.savedInvoices);
+                refreshInvoices();
             } else if (targetId === 'customization-section') {
                 dom.renderCustomizationPanel();
             } else if (targetId === 'users-section') {
@@ -283,90 +349,67 @@ document.addEventListener('DOMContentLoaded', () => {
     });
 
     async function handleBatchUpload(files) {
-        dom.showLoader(`Iniciando processamento em lote de ${files.length} arquivos...`);
+        dom.showLoader(`Enviando ${files.length} arquivos para processamento em lote...`);
         dom.hideDetails();
 
         let successCount = 0;
         let errorCount = 0;
-        // Use current user's webhook
-        const webhookUrl = config.currentWebhook; 
-
-        for (let i = 0; i < files.length; i++) {
-            const file = files[i];
-            dom.showLoader(`Processando ${i + 1}/${files.length}: ${file.name}`);
-
-            try {
-                // 1. Extract Data
-                const data = await services.lerNotaFiscal(file);
+        const processed = [];
 
-                if (!data.id) {
-                     // Add literal prefix to force String type in Excel (avoids scientific notation corruption)
-                     data.id = "ID-" + Date.now().toString() + Math.random().toString().substr(2, 5);
-                     data._isNew = true;
-                }
-                if (!data.status) data.status = 'pendente';
-
-                // Compatibilidade com Power Automate: Preenche campos que podem faltar no backend
-                if (!data.centroCusto) data.centroCusto = "1001";
-                if (!data.paymentMethod) data.paymentMethod = "Boleto Bancário";
-                if (!data.cnpj) data.cnpj = "00.000.000/0001-91";
-                if (!data.fornecedor) data.fornecedor = "Fornecedor Desconhecido";
-                
-                // Fallback para datas (essencial para evitar erro 400)
-                const today = new Date().toISOString().split('T')[0];
-                const nextMonth = new Date(Date.now() + 30 * 24 * 60 * 60 * 1000).toISOString().split('T')[0];
-                
-                if (!data.dataEmissao) data.dataEmissao = today;
-                if (!data.dataVencimento) data.dataVencimento = nextMonth;
-
-                // Fallback para número e valor
-                if (!data.numeroNota) data.numeroNota = file.name.replace(/\.[^/.]+$/, "") + "-" + Date.now().toString().slice(-4);
-                if (typeof data.valor === 'number') data.valor = data.valor.toFixed(2);
-                if (!data.valor) data.valor = "0.00";
-                
-                // Add Upload Date
-                data.uploadDate = new Date().toISOString().split('T')[0];
-
-                // 2. Send to Power Automate with explicit logging.
-                // Wait slightly longer for safety
-                await new Promise(r => setTimeout(r, 2000));
-                
-                try {
-                     const currentHook = config.currentWebhook;
-                     if (currentHook) {
-                        console.log(`[Batch] Enviando nota ${data.numeroNota || i} para ${currentHook}`);
-                        
-                        // Force ensuring request completes before moving to next
-                        const result = await services.sendToPowerAutomate(data, currentHook);
-                        if (!result) {
-                            console.warn(`[Batch] Envio falhou (retorno falso) para ${data.numeroNota}`);
-                        } else {
-                            console.log(`[Batch] Sucesso envio para ${data.numeroNota}`);
-                        }
-
-                     } else {
-                        console.warn("[Batch] Webhook não configurado.");
-                     }
-                } catch (e) {
-                    console.error("Batch upload webhook failed for " + file.name, e);
-                    // Don't modify errorCount here, as we saved locally successfully.
-                    // Just log it.
+        try {
+            // One request for the whole lot; the backend processes the files in
+            // parallel and streams one result per file as soon as it is ready
+            await services.uploadBatchToBackend(files, (item) => {
+                if (item.ok) {
+                    const data = normalizeBatchInvoice(item.dados, item.arquivo);
+                    processed.push(data);
+                    successCount++;
+                } else {
+                    console.error(`Falha ao processar ${item.arquivo}:`, item.erro);
+                    errorCount++;
                 }
+                dom.showLoader(`Processados ${successCount + errorCount}/${files.length}...`);
+            });
+        } catch (error) {
+            console.error("Falha no processamento em lote:", error);
+            errorCount = Math.max(errorCount, files.length - successCount);
+        }
 
-                // 3. Save Locally
-                config.savedInvoices.push(data);
-                successCount++;
-
+        // One backend write for the lot; notas already stored come back as duplicates
+        let saved = processed;
+        let duplicateCount = 0;
+        if (processed.length) {
+            try {
+                const resultados = await services.saveInvoices(config.currentUser, processed);
+                saved = processed.filter((_, i) => resultados[i].ok);
+                duplicateCount = processed.length - saved.length;
             } catch (error) {
-                console.error(`Falha ao processar ${file.name}:`, error);
-                errorCount++;
+                console.error("[Batch] Falha ao salvar notas no backend:", error);
+                saved = [];
+                errorCount += processed.length;
+                successCount = 0;
             }
         }
 
-        saveCurrentUserData(); // Save after batch
+        const currentHook = config.currentWebhook;
+        if (currentHook && saved.length) {
+            try {
+                // The backend outbox delivers the whole lot, with retries
+                await services.enqueueWebhookDelivery(saved, currentHook);
+            } catch (e) {
+                // Saved in the backend already; just log it
+                console.error("[Batch] Falha ao enfileirar envio ao Power Automate", e);
+            }
+        } else if (saved.length) {
+            console.warn("[Batch] Webhook não configurado.");
+        }
+
         dom.hideLoader();
         
-        let msg = `Processamento finalizado!\nSucesso: ${successCount}\nErros: ${errorCount}`;
+        let msg = `Processamento finalizado!\nSucesso: ${successCount - duplicateCount}\nErros: ${errorCount}`;
+        if (duplicateCount > 0) {
+            msg += `\nJá cadastradas: ${duplicateCount}`;
+        }
         if (errorCount > 0) {
             msg += "\n\nVerifique se o backend (Python) est� rodando na porta 5001.";
         }
@@ -376,6 +419,36 @@ document.addEventListener('DOMContentLoaded', () => {
         document.querySelector('[data-target="saved-invoices-section"]').click();
     }
 
+    function normalizeBatchInvoice(data, fileName) {
+        if (!data.id) {
+             // Add literal prefix to force String type in Excel (avoids scientific notation corruption)
+             data.id = "ID-" + Date.now().toString() + Math.random().toString().substr(2, 5);
+        }
+        if (!data.status) data.status = 'pendente';
+
+        // Compatibilidade com Power Automate: Preenche campos que podem faltar no backend
+        if (!data.centroCusto) data.centroCusto = "1001";
+        if (!data.paymentMethod) data.paymentMethod = "Boleto Bancário";
+        if (!data.cnpj) data.cnpj = "00.000.000/0001-91";
+        if (!data.fornecedor) data.fornecedor = "Fornecedor Desconhecido";
+        
+        // Fallback para datas (essencial para evitar erro 400)
+        const today = new Date().toISOString().split('T')[0];
+        const nextMonth = new Date(Date.now() + 30 * 24 * 60 * 60 * 1000).toISOString().split('T')[0];
+        
+        if (!data.dataEmissao) data.dataEmissao = today;
+        if (!data.dataVencimento) data.dataVencimento = nextMonth;
+
+        // Fallback para número e valor
+        if (!data.numeroNota) data.numeroNota = fileName.split('/').pop().replace(/\.[^/.]+$/, "") + "-" + Date.now().toString().slice(-4);
+        if (typeof data.valor === 'number') data.valor = data.valor.toFixed(2);
+        if (!data.valor) data.valor = "0.00";
+        
+        // Add Upload Date
+        data.uploadDate = new Date().toISOString().split('T')[0];
+        return data;
+    }
+
     async function handleFileUpload(file) {
         dom.showLoader();
         dom.hideDetails();
@@ -423,11 +496,9 @@ document.addEventListener('DOMContentLoaded', () => {
     });
 
     async function saveInvoice(data) {
-        if (!data.id) {
+        const isNew = !data.id;
+        if (isNew) {
             data.id = Date.now().toString();
-            data._isNew = true; // Flag to tell backend it's new
-        } else {
-            data._isNew = false; // Flag to tell backend it's an update
         }
 
         // Set upload date if not present
@@ -436,25 +507,31 @@ document.addEventListener('DOMContentLoaded', () => {
         }
 
         dom.hideDetails();
-        dom.showLoader("Enviando para Power Automate...");
+        dom.showLoader("Salvando nota...");
+
+        const existing = config.savedInvoices.find(inv => inv.id === data.id);
+        // Merge existing data with new form data to preserve any non-form fields
+        const nota = existing ? { ...existing, ...data } : { status: 'pendente', ...data };
+        if (!nota.status) nota.status = 'pendente';
 
         const webhookUrl = config.currentWebhook;
 
         try {
-            await services.sendToPowerAutomate(data, webhookUrl);
+            const [resultado] = await services.saveInvoices(config.currentUser, [nota]);
+            if (!resultado.ok) {
+                alert(`${resultado.erro} (nota ${resultado.duplicadaDe})`);
+                dom.hideLoader();
+                dom.showDetails();
+                return;
+            }
 
-            const index = config.savedInvoices.findIndex(inv => inv.id === data.id);
-            if (index >= 0) {
-                // Merge existing data with new form data to preserve any non-form fields
-                config.savedInvoices[index] = { ...config.savedInvoices[index], ...data };
-                alert("Nota atualizada e enviada com sucesso!");
+            if (webhookUrl) {
+                // Queued on the backend, which retries until Power Automate accepts it
+                await services.enqueueWebhookDelivery([nota], webhookUrl);
             } else {
-                if (!data.status) data.status = 'pendente';
-                config.savedInvoices.push(data);
-                alert("Nota salva e enviada com sucesso!");
+                console.warn("URL do Webhook não configurada. Nota salva sem envio.");
             }
-            
-            saveCurrentUserData(); // Save changes
+            alert(isNew ? "Nota salva e enviada com sucesso!" : "Nota atualizada e enviada com sucesso!");
 
             form.reset();
             dom.hideLoader();
@@ -724,12 +801,14 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     };
 
-    window.deleteInvoice = (id) => {
+    window.deleteInvoice = async (id) => {
         if (confirm("Tem certeza que deseja excluir esta nota?")) {
-            config.savedInvoices = config.savedInvoices.filter(inv => inv.id !== id);
-            saveCurrentUserData();
-            dom.renderInvoicesTable(config.savedInvoices);
-            updateBulkActionUI(); // Refresh UI state
+            try {
+                await services.deleteInvoices(config.currentUser, [id]);
+            } catch (error) {
+                alert(`Erro ao excluir nota: ${error.message}`);
+            }
+            await refreshInvoices(); // Also refreshes the bulk action UI
         }
     };
 
@@ -788,7 +867,7 @@ document.addEventListener('DOMContentLoaded', () => {
 
         // Hook into Delete Button
         if (deleteSelectedBtn) {
-            deleteSelectedBtn.addEventListener('click', () => {
+            deleteSelectedBtn.addEventListener('click', async () => {
                 const selectedCheckboxes = tableBody.querySelectorAll('.invoice-select:checked');
                 const count = selectedCheckboxes.length;
                 
@@ -797,15 +876,15 @@ document.addEventListener('DOMContentLoaded', () => {
                 if (confirm(`Tem certeza que deseja excluir ${count} nota(s) selecionada(s)?`)) {
                     const idsToDelete = Array.from(selectedCheckboxes).map(cb => cb.value);
                     
-                    // Filter out from saved invoices
-                    config.savedInvoices = config.savedInvoices.filter(inv => !idsToDelete.includes(inv.id));
-                    
-                    saveCurrentUserData();
-                    dom.renderInvoicesTable(config.savedInvoices);
+                    try {
+                        await services.deleteInvoices(config.currentUser, idsToDelete);
+                    } catch (error) {
+                        alert(`Erro ao excluir notas: ${error.message}`);
+                    }
                     
                     // Reset UI
                     selectAllCheckbox.checked = false;
-                    updateBulkActionUI();
+                    await refreshInvoices();
                 }
             });
         }
@@ -850,43 +929,12 @@ document.addEventListener('DOMContentLoaded', () => {
     const searchDate = document.getElementById('searchDate');   // Date filter
     const clearFiltersBtn = document.getElementById('clearFiltersBtn');
 
-    function applyFilters() {
-        const field = searchField.value;
-        const text = searchInput.value.toLowerCase();
-        const date = searchDate ? searchDate.value : "";
-
-        const filtered = config.savedInvoices.filter(invoice => {
-            // Text Match Logic
-            let matchText = true;
-            if (text) {
-                if (field === 'all') {
-                    // Global search
-                     const searchStr = (
-                        (invoice.fornecedor || "") + " " + 
-                        (invoice.numeroNota || "") + " " + 
-                        (invoice.cnpj || "") + " " +
-                        (invoice.status || "") + " " + 
-                        (invoice.valor || "")
-                    ).toLowerCase();
-                    matchText = searchStr.includes(text);
-                } else if (invoice[field]) {
-                    // Specific field search
-                    matchText = String(invoice[field]).toLowerCase().includes(text);
-                } else {
-                    matchText = false; // Field selected but empty/undefined in invoice
-                }
-            }
+    let filterTimer = null;
 
-            // Date Match Logic
-            let matchDate = true;
-            if (date) {
-                matchDate = invoice.uploadDate === date;
-            }
-
-            return matchText && matchDate;
-        });
-
-        dom.renderInvoicesTable(filtered);
+    function applyFilters() {
+        // One backend query once the user stops typing
+        clearTimeout(filterTimer);
+        filterTimer = setTimeout(refreshInvoices, 300);
     }
 
     if (searchInput) {
@@ -906,7 +954,7 @@ document.addEventListener('DOMContentLoaded', () => {
             if (searchInput) searchInput.value = '';
             if (searchField) searchField.value = 'all';
             if (searchDate) searchDate.value = '';
-            dom.renderInvoicesTable(config.savedInvoices);
+            refreshInvoices();
         });
     }
 
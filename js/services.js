@@ -172,38 +172,181 @@ class InvoiceService {
     }
 
     /**
-     * Envia os dados da nota para o Power Automate via Webhook.
-     * @param {Object} invoiceData - Os dados da nota fiscal.
-     * @param {string} webhookUrl - A URL do webhook do Power Automate.
+     * Sends many files (or ZIPs) to the backend batch endpoint in one request.
+     * The backend answers with NDJSON, one line per file as soon as it is ready.
+     * @param {FileList|File[]} files
+     * @param {Function} onResult - Called with each per-file result ({arquivo, ok, dados|erro}).
+     * @returns {Promise<Object>} - Final summary ({total, sucesso, erros}).
      */
-    async sendToPowerAutomate(invoiceData, webhookUrl) {
-        if (!webhookUrl) {
-            console.warn("URL do Webhook não configurada. Simulando envio.");
-            return true;
+    async uploadBatchToBackend(files, onResult) {
+        const formData = new FormData();
+        for (const file of files) {
+            formData.append('files', file);
         }
 
-        console.log("Sending to Power Automate:", invoiceData);
+        const baseUrl = this.config.api.baseUrl.endsWith('/') ? this.config.api.baseUrl.slice(0, -1) : this.config.api.baseUrl;
+        const endpoint = this.config.api.endpoints.batch.startsWith('/') ? this.config.api.endpoints.batch : '/' + this.config.api.endpoints.batch;
 
-        try {
-            const response = await fetch(webhookUrl, {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json'
-                },
-                body: JSON.stringify(invoiceData)
-            });
+        const response = await fetch(baseUrl + endpoint, {
+            method: 'POST',
+            body: formData
+        });
 
-            if (!response.ok) {
-                // Check if it's a CORS opaque response or just an error
-                throw new Error(`Erro no envio para Power Automate: ${response.status} ${response.statusText}`);
+        if (!response.ok) {
+            throw new Error(`API Error: ${response.statusText}`);
+        }
+
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        let resumo = null;
+
+        const handleLine = (line) => {
+            if (!line.trim()) return;
+            const item = JSON.parse(line);
+            if (item.resumo) {
+                resumo = item.resumo;
+            } else if (onResult) {
+                onResult(item);
             }
+        };
 
-            console.log("Successfully sent to Power Automate");
-            return true;
-        } catch (error) {
-            console.error("Failed to send to Power Automate:", error);
-            throw error; // Propagate error so main.js handles it
+        while (true) {
+            const { done, value } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+            const lines = buffer.split('\n');
+            buffer = lines.pop();
+            lines.forEach(handleLine);
+        }
+        handleLine(buffer);
+
+        return resumo;
+    }
+
+    apiUrl(path) {
+        const baseUrl = this.config.api.baseUrl.endsWith('/') ? this.config.api.baseUrl.slice(0, -1) : this.config.api.baseUrl;
+        return baseUrl + (path.startsWith('/') ? path : '/' + path);
+    }
+
+    /**
+     * Headers for the routes that hold user data (notas, webhook deliveries),
+     * which require the API token when the backend sets API_TOKEN.
+     * @param {Object} headers - Extra headers.
+     * @returns {Object}
+     */
+    apiHeaders(headers = {}) {
+        return this.config.api.token ? { ...headers, 'X-API-Token': this.config.api.token } : headers;
+    }
+
+    /**
+     * Hands notas to the backend webhook queue. The backend delivers them to
+     * Power Automate with retries, even after this tab is closed.
+     * @param {Object[]} notas
+     * @param {string} webhookUrl
+     * @returns {Promise<string[]>} - One delivery ID per nota.
+     */
+    async enqueueWebhookDelivery(notas, webhookUrl) {
+        const response = await fetch(this.apiUrl(this.config.api.endpoints.webhookDeliveries), {
+            method: 'POST',
+            headers: this.apiHeaders({
+                'Content-Type': 'application/json'
+            }),
+            body: JSON.stringify({ webhookUrl: webhookUrl, notas: notas })
+        });
+
+        if (!response.ok) {
+            // e.g. 400 "webhookUrl não permitida" when the host is not allowlisted
+            const erro = await response.json().catch(() => ({}));
+            throw new Error(erro.error || `API Error: ${response.statusText}`);
         }
+        const result = await response.json();
+        return result.ids;
+    }
+
+    /**
+     * Loads one page of the user's saved notas from the backend store.
+     * @param {string} usuario - User e-mail.
+     * @param {Object} filtros - e.g. { status, cnpj, uploadDate, emissaoDe, emissaoAte, busca }.
+     * @param {number} pagina - 1-based page number.
+     * @param {number} tamanhoPagina
+     * @returns {Promise<Object>} - { notas, total, pagina, tamanhoPagina }
+     */
+    async queryInvoices(usuario, filtros = {}, pagina = 1, tamanhoPagina = 50) {
+        const params = new URLSearchParams({ usuario: usuario, pagina: pagina, tamanhoPagina: tamanhoPagina });
+        Object.entries(filtros).forEach(([nome, valor]) => {
+            if (valor) params.append(nome, valor);
+        });
+
+        const response = await fetch(this.apiUrl(`${this.config.api.endpoints.invoices}?${params}`), {
+            headers: this.apiHeaders()
+        });
+        if (!response.ok) {
+            throw new Error(`API Error: ${response.statusText}`);
+        }
+        return await response.json();
+    }
+
+    /**
+     * Inserts or updates notas by ID. Only the notas passed are written.
+     * @param {string} usuario
+     * @param {Object[]} notas
+     * @returns {Promise<Object[]>} - One { id, ok } per nota; duplicates come
+     *   back with ok: false and duplicadaDe (ID of the nota already stored).
+     */
+    async saveInvoices(usuario, notas) {
+        const response = await fetch(this.apiUrl(this.config.api.endpoints.invoices), {
+            method: 'POST',
+            headers: this.apiHeaders({
+                'Content-Type': 'application/json'
+            }),
+            body: JSON.stringify({ usuario: usuario, notas: notas })
+        });
+
+        if (!response.ok && response.status !== 409) {
+            throw new Error(`API Error: ${response.statusText}`);
+        }
+        const result = await response.json();
+        return result.resultados;
+    }
+
+    /**
+     * @param {string} usuario
+     * @param {string[]} ids
+     * @returns {Promise<number>} - How many notas were removed.
+     */
+    async deleteInvoices(usuario, ids) {
+        const response = await fetch(this.apiUrl(this.config.api.endpoints.invoices), {
+            method: 'DELETE',
+            headers: this.apiHeaders({
+                'Content-Type': 'application/json'
+            }),
+            body: JSON.stringify({ usuario: usuario, ids: ids })
+        });
+
+        if (!response.ok) {
+            throw new Error(`API Error: ${response.statusText}`);
+        }
+        const result = await response.json();
+        return result.removidas;
+    }
+
+    /**
+     * URL that downloads the user's notas as a spreadsheet. Open it in a
+     * link or window so the browser streams it straight to disk.
+     * @param {string} usuario
+     * @param {string} formato - 'csv' or 'xlsx'.
+     * @param {Object} filtros - Same filters as queryInvoices.
+     * @returns {string}
+     */
+    exportInvoicesUrl(usuario, formato = 'xlsx', filtros = {}) {
+        const params = new URLSearchParams({ usuario: usuario, formato: formato });
+        Object.entries(filtros).forEach(([nome, valor]) => {
+            if (valor) params.append(nome, valor);
+        });
+        // A download link cannot send headers
+        if (this.config.api.token) params.append('token', this.config.api.token);
+        return this.apiUrl(`${this.config.api.endpoints.invoicesExport}?${params}`);
     }
 }
 